@@ -1,30 +1,49 @@
 # app.py
-from pathlib import Path
+import hashlib
 import os
 import streamlit as st
-from PIL import Image
 import json
 
-from db.postgres import init_db_postgres, get_pg_conn
-from db.insert import add_found_item_postgres
-from db.search import search_found_items_postgres
-from utils.embedding import get_openai_embedding
+from db.postgres import init_db_postgres, get_pg_conn, get_pool_stats
+from db.backend import add_found_item, add_lost_report, get_backend, record_search_matches, search_found_items
+from db.intake_queue import enqueue_found_item, get_intake_status, get_queue_depth
+from utils.embedding import get_embedding, get_embedding_cache_stats
 from utils.gemini import (
+    describe_found_item,
     gemini_available,
-    create_operator_chat,
-    create_user_chat,
+    gemini_priority,
     is_structured_record,
     standardize_description,
-    extract_field,
 )
+from utils.config import get_setting
 from utils.helpers import load_tag_data, validate_phone, validate_email
+from utils.images import image_phash, store_image, thumbnail_path
+from utils.metrics import configure_logging, request_trace, start_metrics_server
+from utils.pipeline import run_user_intake
+
+# ---------------------
+# Metrics (/metrics on METRICS_PORT, request log lines on stderr)
+# ---------------------
+configure_logging()
+try:
+    start_metrics_server()
+except OSError as e:
+    st.warning(f"Metrics endpoint unavailable: {e}")
 
 # ---------------------
 # Initialize Postgres DB
 # ---------------------
+@st.cache_resource
+def init_db():
+    # Once per process, not per rerun: schema changes lock found_items.
+    # A failed init raises, is not cached, and is retried on the next rerun.
+    init_db_postgres()
+    return True
+
+
 if st.secrets.get("PG_CONNECTION_STRING"):
     try:
-        init_db_postgres()
+        init_db()
     except Exception as e:
         st.error(f"DB init error: {e}")
 
@@ -33,6 +52,29 @@ st.title("Lost & Found Intake — Postgres + pgvector + OpenAI")
 
 page = st.sidebar.radio("Go to", ["Upload Found Item (Operator)", "Report Lost Item (User)"])
 
+if st.secrets.get("PG_CONNECTION_STRING"):
+    with st.sidebar.expander("Postgres pool stats"):
+        try:
+            st.json(get_pool_stats())
+        except Exception as e:
+            st.text(f"Pool unavailable: {e}")
+
+def use_intake_queue() -> bool:
+    # The queue lives in found_items, so it needs the Postgres backend.
+    enabled = str(get_setting("INTAKE_QUEUE", "true")).lower() == "true"
+    return enabled and get_backend() == "postgres" and bool(get_setting("PG_CONNECTION_STRING"))
+
+
+if use_intake_queue():
+    with st.sidebar.expander("Intake queue"):
+        try:
+            st.json(get_queue_depth())
+        except Exception as e:
+            st.text(f"Queue unavailable: {e}")
+
+with st.sidebar.expander("Embedding cache stats"):
+    st.json(get_embedding_cache_stats())
+
 # ---------------------
 # Load tag data
 # ---------------------
@@ -40,6 +82,34 @@ tag_data = load_tag_data()
 if not tag_data:
     st.stop()
 
+# ---------------------
+# Flow state
+# ---------------------
+# Every widget interaction reruns this script. Each page keeps its progress in
+# st.session_state as a small state machine keyed by a hash of its inputs, and
+# finished model/embedding work is memoized per key, so Gemini and the
+# embedding API run once per item no matter how often the page reruns.
+def input_key(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def flow_state(name: str, key: str) -> dict:
+    """State for flow ``name``; restarts at stage "new" when its inputs change."""
+    state = st.session_state.get(name)
+    if state is None or state["key"] != key:
+        state = {"key": key, "stage": "new"}
+        st.session_state[name] = state
+    return state
+
+
+def intake_memo() -> dict:
+    return st.session_state.setdefault("intake_memo", {})
+
+
 # ---------------------
 # Operator Side
 # ---------------------
@@ -49,56 +119,96 @@ if page == "Upload Found Item (Operator)":
     if not gemini_available():
         st.info("Gemini not configured — automated description disabled.")
 
-    uploaded_image = st.file_uploader("Image of found item", type=["jpg","jpeg","png"])
+    if use_intake_queue():
+        # Uploads are only queued here; `python -m db.intake_queue run` does the
+        # Gemini, standardization and embedding work in the background.
+        uploaded_images = st.file_uploader(
+            "Images of found items", type=["jpg","jpeg","png"], accept_multiple_files=True, key="queue_images"
+        )
+        contact = st.text_input("Operator contact (optional)")
+        if st.button("Queue for processing"):
+            if not uploaded_images:
+                st.error("Please upload an image.")
+            queued = st.session_state.setdefault("queued_ids", [])
+            for uploaded in uploaded_images or []:
+                item_id = enqueue_found_item(uploaded, uploaded.name, operator_contact=contact or "")
+                if item_id is not None and item_id not in queued:
+                    queued.append(item_id)
 
-    if st.button("Start Intake"):
-        if not uploaded_image:
-            st.error("Please upload an image.")
-        else:
-            message_content = ""
-            if uploaded_image:
-                img = Image.open(uploaded_image).convert("RGB")
-                st.image(img, width=200)
-                message_content += "I have a photo of the found item. Here is my description based on what I see: "
-
-            # Call Gemini
-            if gemini_available():
+        @st.fragment(run_every=float(get_setting("INTAKE_POLL_SECONDS", 2)))
+        def queued_items():
+            ids = st.session_state.get("queued_ids", [])
+            if ids:
+                st.markdown("### Queued items")
                 try:
-                    operator_chat = create_operator_chat()
-                    response = operator_chat.send_message(message_content)
-                    model_text = response.text
+                    st.dataframe(get_intake_status(ids[-50:]), hide_index=True)
                 except Exception as e:
-                    st.error(f"Error calling Gemini: {e}")
+                    st.text(f"Status unavailable: {e}")
+
+        queued_items()
+    else:
+        uploaded_image = st.file_uploader("Image of found item", type=["jpg","jpeg","png"])
+
+        # Stages: new -> described -> saved
+        if not uploaded_image:
+            if st.button("Start Intake"):
+                st.error("Please upload an image.")
+        else:
+            image_bytes = uploaded_image.getvalue()
+            state = flow_state("operator_intake", input_key("operator", image_bytes))
+            st.image(image_bytes, width=200)
+
+            if state["stage"] == "new" and st.button("Start Intake"):
+                memo = intake_memo().get(state["key"])
+                if memo is None:
                     model_text = ""
-            else:
-                model_text = ""
+                    if gemini_available():
+                        try:
+                            with request_trace("operator_describe"), gemini_priority("operator"):
+                                model_text = describe_found_item(image_bytes, uploaded_image.type or "image/jpeg")
+                        except Exception as e:
+                            st.error(f"Error calling Gemini: {e}")
+                    else:
+                        st.error("Gemini not configured.")
+                    if model_text:
+                        memo = {"model_text": model_text, "record": None}
+                        if is_structured_record(model_text):
+                            with gemini_priority("operator"):
+                                memo["record"] = standardize_description(model_text, tag_data)
+                        intake_memo()[state["key"]] = memo
+                # A failed call stays at "new", so Start Intake can be pressed again.
+                if memo is not None:
+                    state.update(memo)
+                    state["stage"] = "described"
 
-            # Check if structured record
-            if is_structured_record(model_text):
-                structured_text = model_text
-                final_json = standardize_description(structured_text, tag_data)
-                if not final_json:
+            if state["stage"] in ("described", "saved"):
+                final_json = state["record"]
+                if not is_structured_record(state["model_text"]):
+                    st.info("Model did not emit a final structured record. Model output:")
+                    st.code(state["model_text"])
+                elif not final_json:
                     st.error("Failed to standardize the model output.")
                 else:
-                    # Save image to disk
-                    image_path = ""
-                    if uploaded_image:
-                        images_dir = Path("found_images")
-                        images_dir.mkdir(exist_ok=True)
-                        image_path = str(images_dir / uploaded_image.name)
-                        with open(image_path, "wb") as f:
-                            f.write(uploaded_image.getbuffer())
-
+                    st.json(final_json)
                     contact = st.text_input("Operator contact (optional)")
-                    if st.button("Save Found Item to DB"):
-                        ok = add_found_item_postgres(final_json, operator_contact=contact or "", image_path=image_path)
-                        if ok:
-                            st.success("Found item saved to Postgres (JSON handled in backend).")
-                        else:
-                            st.error("Failed to save found item.")
-            else:
-                st.info("Model did not emit a final structured record. Model output:")
-                st.code(model_text)
+                    if state["stage"] == "described" and st.button("Save Found Item to DB"):
+                        memo = intake_memo().get(state["key"], state)
+                        image_path, _ = store_image(uploaded_image, uploaded_image.name)
+
+                        with request_trace("operator_save"):
+                            if memo.get("embedding") is None:
+                                try:
+                                    memo["embedding"] = get_embedding(final_json.get("description", ""))
+                                except Exception as e:
+                                    st.error(f"Embedding error: {e}")
+                            if memo.get("embedding") is not None:
+                                ok = add_found_item(final_json, operator_contact=contact or "", image_path=image_path, embedding=memo["embedding"])
+                                if ok:
+                                    state["stage"] = "saved"
+                                else:
+                                    st.error("Failed to save found item.")
+                    if state["stage"] == "saved":
+                        st.success("Found item saved to Postgres (JSON handled in backend).")
 
 # ---------------------
 # User Side
@@ -124,68 +234,102 @@ if page == "Report Lost Item (User)":
     with col_text:
         initial_text = st.text_input("Short description", placeholder="e.g., blue iPhone with cracked screen", key="user_text")
 
-    if st.button("Start Report"):
+    # Stages: new -> reported -> searched
+    image_bytes = uploaded_image.getvalue() if uploaded_image else b""
+    state = flow_state(
+        "user_report",
+        input_key("user", image_bytes, initial_text, location_choice, category_choice, type_choice),
+    )
+    if image_bytes:
+        st.image(image_bytes, width=250)
+        if "image_phash" not in state:
+            state["image_phash"] = image_phash(image_bytes)
+
+    if state["stage"] == "new" and st.button("Start Report"):
         if not uploaded_image and not initial_text:
             st.error("Please upload an image or enter a short description.")
         else:
-            message_text = ""
-            if uploaded_image:
-                image = Image.open(uploaded_image).convert("RGB")
-                st.image(image, width=250)
-                message_text += "I have uploaded an image of my lost item. "
-            if initial_text:
-                message_text += initial_text
-
-            if gemini_available():
-                try:
-                    user_chat = create_user_chat()
-                    response = user_chat.send_message(message_text)
-                    model_text = response.text
-                except Exception as e:
-                    st.error(f"Error calling Gemini: {e}")
-                    model_text = ""
-            else:
-                model_text = ""
-
-            if is_structured_record(model_text):
-                structured_text = model_text
-                merged_text = f"""
-Subway Location: {location_choice or extract_field(structured_text, 'Subway Location')}
-Color: {extract_field(structured_text, 'Color')}
-Item Category: {category_choice or extract_field(structured_text, 'Item Category')}
-Item Type: {type_choice or extract_field(structured_text, 'Item Type')}
-Description: {extract_field(structured_text, 'Description')}
-"""
-                st.markdown("### Final merged record (used for search)")
-                st.code(merged_text)
-
-                final_json = standardize_description(merged_text, tag_data)
-                if not final_json:
-                    st.error("Failed to standardize.")
+            intake = intake_memo().get(state["key"])
+            if intake is None:
+                message_text = ""
+                if uploaded_image:
+                    message_text += "I have uploaded an image of my lost item. "
+                if initial_text:
+                    message_text += initial_text
+
+                intake = run_user_intake(
+                    message_text,
+                    tag_data,
+                    overrides={
+                        "Subway Location": location_choice,
+                        "Item Category": category_choice,
+                        "Item Type": type_choice,
+                    },
+                    image_phash=state.get("image_phash"),
+                )
+                for error in intake["errors"]:
+                    st.error(f"Intake error: {error}")
+                if intake["errors"]:
+                    intake = None  # stay at "new" so the report can be retried
                 else:
-                    st.success("Standardized record generated (not saved as DB entry).")
-                    contact = st.text_input("Phone number, ten digits")
-                    email = st.text_input("Email address")
-                    if st.button("Submit Lost Item Report and Search for Matches"):
-                        if not validate_phone(contact):
-                            st.error("Please enter a ten digit phone number without spaces.")
-                        elif not validate_email(email):
-                            st.error("Please enter a valid email address.")
-                        else:
-                            matches = search_found_items_postgres(final_json, k=5)
-                            if not matches:
-                                st.info("No matches found.")
-                            else:
-                                st.markdown(f"### Top {len(matches)} matches (tag-filtered + vector-ranked)")
-                                for m in matches:
-                                    st.write(f"Similarity: {m['similarity']:.4f}  —  Category: {m['item_category']}  —  Location: {', '.join(m['subway_location'])}")
-                                    st.write(m["description"])
-                                    if m["image_path"]:
-                                        try:
-                                            st.image(m["image_path"], width=200)
-                                        except Exception:
-                                            st.text("Image path present but could not be displayed.")
-                                    st.markdown("---")
+                    intake_memo()[state["key"]] = intake
+            if intake is not None:
+                state["intake"] = intake
+                state["stage"] = "reported"
+
+    if state["stage"] in ("reported", "searched"):
+        intake = state["intake"]
+        if intake["merged_text"]:
+            st.markdown("### Final merged record (used for search)")
+            st.code(intake["merged_text"])
+
+            final_json = intake["record"]
+            if not final_json:
+                st.error("Failed to standardize.")
             else:
-                st.info("Model did not emit a final structured record. Model output:")
-                st.code(model_text)
+                st.success("Standardized record generated (not saved as DB entry).")
+                contact = st.text_input("Phone number, ten digits")
+                email = st.text_input("Email address")
+                if st.button("Submit Lost Item Report and Search for Matches"):
+                    if not validate_phone(contact):
+                        st.error("Please enter a ten digit phone number without spaces.")
+                    elif not validate_email(email):
+                        st.error("Please enter a valid email address.")
+                    elif state["stage"] == "reported":
+                        with request_trace("report_search"):
+                            # The intake already searched unless its embedding failed.
+                            state["matches"] = intake["matches"]
+                            if state["matches"] is None:
+                                state["matches"] = search_found_items(
+                                    final_json, k=5, embedding=intake["embedding"], image_phash=state.get("image_phash")
+                                )
+                            state["report_id"] = add_lost_report(
+                                final_json,
+                                contact_phone=contact,
+                                contact_email=email,
+                                embedding=intake["embedding"],
+                                image_phash=state.get("image_phash"),
+                            )
+                            record_search_matches(state["report_id"], state["matches"])
+                        state["stage"] = "searched"
+
+                if state["stage"] == "searched":
+                    if state.get("report_id"):
+                        st.success(f"Report #{state['report_id']} saved. Items found later will be matched against it.")
+                    matches = state["matches"]
+                    if not matches:
+                        st.info("No matches found.")
+                    else:
+                        st.markdown(f"### Top {len(matches)} matches (tag-filtered + vector-ranked)")
+                        for m in matches:
+                            st.write(f"Similarity: {m['similarity']:.4f}  —  Category: {m['item_category']}  —  Location: {', '.join(m['subway_location'])}")
+                            st.write(m["description"])
+                            if m["image_path"]:
+                                try:
+                                    st.image(thumbnail_path(m["image_path"]), width=200)
+                                except Exception:
+                                    st.text("Image path present but could not be displayed.")
+                            st.markdown("---")
+        else:
+            st.info("Model did not emit a final structured record. Model output:")
+            st.code(intake["model_text"])
@@ -0,0 +1,68 @@
+"""Benchmark: batch search vs. one search per report, against the configured Postgres.
+
+    python -m benchmarks.bench_batch_search [--sizes 1,10,50] [--k 5]
+
+Run it from the repository root as a module; as a script path it cannot
+import the app's db and utils packages.
+
+Queries reuse embeddings and tags of stored found items, so no embedding
+API calls are made; both sides run the non-hybrid (tag-filtered k-NN)
+ranking. Needs a populated found_items table.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from db.postgres import embedding_dims, get_pg_conn
+from db.search import search_found_items_batch, search_found_items_postgres
+from db.vector import fetch_embeddings
+
+
+def sample_reports(n: int, seed: int = 0):
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, item_category, color FROM found_items
+                WHERE status = 'ready' AND embedding IS NOT NULL AND vector_dims(embedding) = %s
+                ORDER BY md5(id::text || %s) LIMIT %s
+                """,
+                (embedding_dims(), str(seed), n),
+            )
+            rows = {r[0]: r for r in cur.fetchall()}
+            ids, embs = fetch_embeddings(
+                cur, "SELECT id, embedding FROM found_items WHERE id = ANY(%s) ORDER BY id", (list(rows),), dim=embedding_dims()
+            )
+    reports = [{"item_category": rows[i][1], "color": rows[i][2][:1]} for i in ids.tolist()]
+    return reports, [np.asarray(e, dtype=np.float32) for e in embs]
+
+
+def run(sizes: list, k: int) -> dict:
+    reports, embeddings = sample_reports(max(sizes))
+    search_found_items_batch(reports[:1], k=k, embeddings=embeddings[:1])  # warm the pool
+    results = {}
+    for n in sizes:
+        started = time.perf_counter()
+        for report, emb in zip(reports[:n], embeddings[:n]):
+            search_found_items_postgres(report, k=k, hybrid=False, embedding=emb)
+        loop = time.perf_counter() - started
+
+        started = time.perf_counter()
+        search_found_items_batch(reports[:n], k=k, embeddings=embeddings[:n])
+        batch = time.perf_counter() - started
+        results[n] = {"loop_ms": loop * 1000, "batch_ms": batch * 1000}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,10,50")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    for n, r in run([int(s) for s in args.sizes.split(",")], args.k).items():
+        print(f"{n:4d} reports  loop {r['loop_ms']:9.1f} ms  batch {r['batch_ms']:9.1f} ms  ({r['loop_ms'] / r['batch_ms']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
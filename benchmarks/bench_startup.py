@@ -0,0 +1,83 @@
+"""Startup benchmark: import cost of the app's modules and tag catalog load.
+
+    python -m benchmarks.bench_startup [--runs 5]
+
+Unlike the other benchmarks it finds the repository from its own path, so
+``python benchmarks/bench_startup.py`` works too, from any directory.
+
+Each case runs in a fresh interpreter. Reported times are the median wall
+time of the measured statement, plus which heavy third-party modules it
+pulled in; anything listed under "heavy" for the app imports is a
+regression, those are meant to load on first use.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("pandas", "openpyxl", "openai", "google.genai", "PIL")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+APP_IMPORTS = (
+    "import db.postgres, db.backend, utils.embedding, utils.gemini, utils.helpers"
+)
+
+
+def _probe(statement: str, cwd: Path) -> dict:
+    code = _PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True,
+        env={"PYTHONPATH": str(ROOT), "PATH": ""},
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        shutil.copy(ROOT / "Tags.xlsx", tmp / "Tags.xlsx")
+        catalog = "Tags.xlsx.catalog.json"
+        load = "from utils.helpers import load_tag_catalog, TAGS_FILE; load_tag_catalog(TAGS_FILE)"
+        cases = {
+            "app module imports": (APP_IMPORTS, None),
+            "tag catalog: compile from xlsx": (load, lambda: (tmp / catalog).unlink(missing_ok=True)),
+            "tag catalog: compiled cache": (load, None),
+            "legacy pd.read_excel": ("import pandas as pd; pd.read_excel('Tags.xlsx')", None),
+        }
+        results = {}
+        for name, (statement, before) in cases.items():
+            samples = []
+            for _ in range(runs):
+                if before:
+                    before()
+                samples.append(_probe(statement, tmp))
+            results[name] = {
+                "ms": round(statistics.median(s["seconds"] for s in samples) * 1000, 1),
+                "heavy": samples[-1]["heavy"],
+            }
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    for name, r in run(args.runs).items():
+        print(f"{name:32s} {r['ms']:9.1f} ms  heavy: {', '.join(r['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Benchmark suite: insert throughput, search latency and recall on synthetic data, fully offline.
+
+    python -m benchmarks.bench_suite [--rows 10000,100000,1000000] [--queries 200] [--out bench_suite.json]
+    python -m benchmarks.bench_suite --rows 10000 --compare bench_suite.json
+
+Both from the repository root; ``python benchmarks/bench_suite.py`` would
+put benchmarks/ rather than the root on sys.path and fail to import the app.
+
+Runs in a scratch database (BENCH_DATABASE, default lost_and_found_bench)
+on the server of PG_CONNECTION_STRING; it is created if missing and its
+tables are dropped before each row count. Embeddings come from the
+hashing provider of utils.embedding and Gemini answers from
+benchmarks.fakes.FakeGeminiClient, so no API keys are needed and a seed
+reproduces a run exactly.
+
+For each row count, found items generated from Tags.xlsx are bulk loaded
+with db.bulk_import.copy_rows, then the ANN index is built. A further
+``--insert-sample`` items go through add_found_item_postgres one at a time.
+Lost reports written from ``--queries`` stored items are structured by the
+fake Gemini client, standardized, and searched with
+search_found_items_postgres in hybrid and vector-only mode. recall@k is the
+share of searches returning the item the report was written from.
+
+Results are written as JSON; ``--compare`` prints the change of each
+metric against an earlier results file.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+
+from benchmarks import fakes
+from benchmarks.synthetic import lost_report_text, synthetic_items
+from utils.config import get_setting
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_TABLES = (
+    "report_matches", "lost_reports", "match_watermarks", "found_item_keys", "found_items", "embedding_cache", "embedding_state",
+)
+SEARCH_MODES = {"hybrid": True, "vector": False}
+
+
+# ---------------------
+# DATABASE
+# ---------------------
+def use_bench_database() -> str:
+    """Point PG_CONNECTION_STRING at the scratch database, creating it if needed."""
+    dsn = get_setting("PG_CONNECTION_STRING")
+    if not dsn:
+        raise SystemExit("PG_CONNECTION_STRING is not set.")
+    name = get_setting("BENCH_DATABASE", "lost_and_found_bench")
+    if parse_dsn(dsn).get("dbname") != name:
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if not cur.fetchone():
+                cur.execute(f'CREATE DATABASE "{name}"')
+        conn.close()
+        dsn = make_dsn(dsn, dbname=name)
+    os.environ["PG_CONNECTION_STRING"] = dsn
+    if get_setting("PG_CONNECTION_STRING") != dsn:
+        # Streamlit secrets win over the environment; never run against the app's database.
+        raise SystemExit("PG_CONNECTION_STRING comes from Streamlit secrets; run from a directory without them.")
+    return name
+
+
+def reset_tables():
+    from db.postgres import get_pg_conn, init_db_postgres
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {', '.join(BENCH_TABLES)} CASCADE")
+        conn.commit()
+    init_db_postgres()
+
+
+def server_info() -> dict:
+    from db.postgres import get_pg_conn, get_vector_index_method, get_vector_metric, get_vector_storage, pgvector_version
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SHOW server_version")
+            server = cur.fetchone()[0]
+            version = pgvector_version(cur)
+    return {
+        "postgres": server,
+        "pgvector": ".".join(map(str, version)),
+        "index": get_vector_index_method(),
+        "metric": get_vector_metric(),
+        "storage": get_vector_storage(),
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+# ---------------------
+# MEASUREMENTS
+# ---------------------
+def _summary(timings: list) -> dict:
+    ordered = sorted(timings)
+    return {
+        "n": len(ordered),
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p99_ms": ordered[int(0.99 * (len(ordered) - 1))] * 1000,
+    }
+
+
+def bulk_load(rows: int, tags: dict, seed: int, chunk: int = 5000) -> dict:
+    """Fill found_items through the bulk import path; the ANN index is dropped first and rebuilt after."""
+    from db.bulk_import import copy_rows
+    from db.postgres import ensure_vector_index, get_pg_conn
+    from utils.embedding import get_embeddings
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'found_items' AND indexname LIKE 'found_items_embedding_%%_idx'"
+            )
+            for (name,) in cur.fetchall():
+                cur.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+
+    started, batch = time.perf_counter(), []
+
+    def flush():
+        embs = get_embeddings([item["description"] for item in batch])
+        copy_rows([
+            (None, item["subway_location"], item["color"], item["item_category"], item["item_type"],
+             item["description"], emb, "", None, None)
+            for item, emb in zip(batch, embs)
+        ])
+        batch.clear()
+
+    for item in synthetic_items(rows, tags, seed):
+        batch.append(item)
+        if len(batch) == chunk:
+            flush()
+    if batch:
+        flush()
+    load = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (get_setting("BENCH_MAINTENANCE_WORK_MEM", "512MB"),))
+            ensure_vector_index(cur)
+            build = time.perf_counter() - started
+            cur.execute("ANALYZE found_items")
+        conn.commit()
+    return {"rows": rows, "rows_per_s": rows / load if load else 0.0, "index_build_s": build}
+
+
+def measure_inserts(n: int, tags: dict, seed: int) -> dict:
+    from db.insert import add_found_item_postgres
+
+    timings, failed = [], 0
+    started = time.perf_counter()
+    for item in synthetic_items(n, tags, seed):
+        t = time.perf_counter()
+        if not add_found_item_postgres(item):
+            failed += 1
+        timings.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    return {**_summary(timings), "rows_per_s": n / elapsed if elapsed else 0.0, "failed": failed}
+
+
+def sample_reports(n: int, tags: dict, seed: int) -> list:
+    """``(target_id, report)`` pairs: rider reports of stored items, standardized as the app would."""
+    import utils.gemini
+    from db.postgres import get_pg_conn
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, subway_location, color, item_type, description FROM found_items
+                ORDER BY md5(id::text || %s) LIMIT %s
+                """,
+                (str(seed), n),
+            )
+            rows = cur.fetchall()
+    rng = np.random.default_rng(seed)
+    reports = []
+    for id_, location, color, item_type, description in rows:
+        item = {"subway_location": location, "color": color, "item_type": item_type, "description": description}
+        text = lost_report_text(item, rng)
+        record = utils.gemini.structure_user_report(text)
+        reports.append((id_, utils.gemini.standardize_description(record, tags)))
+    return reports
+
+
+def measure_search(reports: list, k: int, hybrid: bool) -> dict:
+    from db.search import search_found_items_postgres
+
+    search_found_items_postgres(reports[0][1], k=k, hybrid=hybrid)  # warm the pool and prepared plans
+    timings, hits = [], 0
+    for target, report in reports:
+        t = time.perf_counter()
+        results = search_found_items_postgres(report, k=k, hybrid=hybrid)
+        timings.append(time.perf_counter() - t)
+        hits += any(r["id"] == target for r in results)
+    return {**_summary(timings), f"recall@{k}": hits / len(reports)}
+
+
+def run_scale(rows: int, tags: dict, args) -> dict:
+    reset_tables()
+    result = {"bulk_load": bulk_load(rows, tags, args.seed)}
+    result["insert"] = measure_inserts(args.insert_sample, tags, args.seed + 1)
+    reports = sample_reports(args.queries, tags, args.seed + 2)
+    result["search"] = {mode: measure_search(reports, args.k, hybrid) for mode, hybrid in SEARCH_MODES.items()}
+    return result
+
+
+# ---------------------
+# REPORTING
+# ---------------------
+def _metrics(scale: dict) -> dict:
+    flat = {
+        "bulk_load rows/s": scale["bulk_load"]["rows_per_s"],
+        "index_build s": scale["bulk_load"]["index_build_s"],
+        "insert rows/s": scale["insert"]["rows_per_s"],
+        "insert p50 ms": scale["insert"]["p50_ms"],
+        "insert p99 ms": scale["insert"]["p99_ms"],
+    }
+    for mode, r in scale["search"].items():
+        for key, value in r.items():
+            if key != "n":
+                flat[f"search {mode} {key.replace('_ms', ' ms')}"] = value
+    return flat
+
+
+def print_results(results: dict, baseline: dict = None):
+    for rows, scale in results["scales"].items():
+        print(f"\n{int(rows):,} rows")
+        old = _metrics(baseline["scales"][rows]) if baseline and rows in baseline.get("scales", {}) else {}
+        for name, value in _metrics(scale).items():
+            line = f"  {name:28s} {value:12.3f}"
+            if name in old and old[name]:
+                line += f"   ({(value - old[name]) / old[name]:+.1%} vs {old[name]:.3f})"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10000", help="comma-separated table sizes, e.g. 10000,100000,1000000")
+    parser.add_argument("--insert-sample", type=int, default=500, help="items inserted one by one with add_found_item_postgres")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_suite.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    database = use_bench_database()
+    from utils.helpers import load_tag_data
+
+    tags = load_tag_data()
+    fakes.install(tags)
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "database": database,
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "scales": {},
+    }
+    for rows in (int(r) for r in args.rows.split(",")):
+        results["scales"][str(rows)] = run_scale(rows, tags, args)
+        results.setdefault("server", server_info())
+        Path(args.out).write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(results, baseline)
+    print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
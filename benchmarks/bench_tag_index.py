@@ -0,0 +1,57 @@
+"""Micro-benchmark: offline tag standardization against Tags.xlsx.
+
+    python -m benchmarks.bench_tag_index [--repeat 200]
+
+(from the repository root, so that utils.tags and Tags.xlsx are found)
+
+Reports index build time and the per-value cost of ``TagIndex.match`` for
+cold lookups (memo cleared) and repeated values.
+"""
+import argparse
+import time
+import timeit
+
+from utils.helpers import load_tag_data
+from utils.tags import TagIndex, tag_vocabularies
+
+SAMPLES = {
+    "subway_location": ["Times Sq", "Times Square-42 St", "Fulton Street", "14th St Union Sq", "Q train", "Chambers"],
+    "color": ["grey", "Navy blue", "dark green", "silver"],
+    "item_category": ["Bags and Accessories", "Electronics", "Clothing"],
+    "item_type": ["iPhone 13", "black backpack", "Laptop Bag", "umbrela", "Sports equipment"],
+}
+
+
+def run(repeat: int) -> dict:
+    vocab = tag_vocabularies(load_tag_data())
+    started = time.perf_counter()
+    index = TagIndex(vocab)
+    build = time.perf_counter() - started
+    pairs = [(field, value) for field, values in SAMPLES.items() for value in values]
+
+    def cold():
+        index._memo.clear()
+        for field, value in pairs:
+            index.match(field, value)
+
+    def warm():
+        for field, value in pairs:
+            index.match(field, value)
+
+    results = {"build index": build * 1e6}
+    for name, fn in (("match: cold", cold), ("match: memoized", warm)):
+        seconds = min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat
+        results[name] = seconds / len(pairs) * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    for name, us in run(args.repeat).items():
+        print(f"{name:20s} {us:10.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Benchmark: recall, latency and index size of each vector storage mode.
+
+    python -m benchmarks.bench_vector_storage [--modes full,halfvec,halfvec:512,binary] [--queries 200]
+    python -m benchmarks.bench_vector_storage --synthetic 50000
+
+Invoke it with ``-m`` from the repository root, not by file path, so the
+db package is importable.
+
+Vectors are copied from found_items into a temporary table (or generated
+with ``--synthetic``: clustered unit vectors whose variance decays along the
+dimensions, like Matryoshka embeddings). For each mode an HNSW index is
+built over the temporary table and every query runs the same re-ranked
+k-NN statement the app uses; recall@k is measured against exact NumPy
+search. Queries are stored vectors with a little noise added.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+
+from db.pgbinary import BinaryCopyWriter, encode_vector
+from db.postgres import (
+    embedding_dims,
+    get_pg_conn,
+    get_vector_metric,
+    is_reduced,
+    pgvector_version,
+    reduced_operator,
+    reduced_vector,
+    rerank_factor,
+    VECTOR_METRICS,
+)
+from db.search import _knn_sql
+from db.vector import fetch_embeddings
+
+TABLE = "bench_vectors"
+
+
+def parse_mode(text: str) -> dict:
+    mode, _, dims = text.partition(":")
+    return {"mode": mode, "dims": int(dims or embedding_dims())}
+
+
+def synthetic_vectors(n: int, seed: int = 0) -> np.ndarray:
+    rng, dims = np.random.default_rng(seed), embedding_dims()
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dims) / 64.0)
+    centers = rng.normal(size=(max(1, n // 50), dims)) * scale
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.5 * rng.normal(size=(n, dims)) * scale
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def load_table(cur, synthetic: int):
+    cur.execute(f"CREATE TEMP TABLE {TABLE} (id INT PRIMARY KEY, embedding VECTOR({embedding_dims()}))")
+    if synthetic:
+        writer = BinaryCopyWriter([lambda v: v.to_bytes(4, "big"), encode_vector])
+        for i, v in enumerate(synthetic_vectors(synthetic)):
+            writer.write_row((i, v))
+        cur.copy_expert(f"COPY {TABLE} FROM STDIN WITH (FORMAT binary)", writer.getbuffer())
+    else:
+        cur.execute(
+            f"""
+            INSERT INTO {TABLE} SELECT id, embedding FROM found_items
+            WHERE embedding IS NOT NULL AND vector_dims(embedding) = {embedding_dims()}
+            """
+        )
+    ids, embs = fetch_embeddings(cur, f"SELECT id, embedding FROM {TABLE} ORDER BY id")
+    return ids.astype(np.int64), embs.astype(np.float32)
+
+
+def make_queries(embs: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = embs[rng.choice(len(embs), size=min(n, len(embs)), replace=False)]
+    noisy = picks + rng.normal(scale=0.02, size=picks.shape).astype(np.float32)
+    return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+
+def exact_neighbours(ids, embs, queries, k: int) -> list:
+    if get_vector_metric() == "cosine":
+        scores = queries @ embs.T
+    else:
+        scores = -((queries[:, None, :] - embs[None, :, :]) ** 2).sum(axis=2)
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [set(ids[row].tolist()) for row in top]
+
+
+def build_index(cur, storage: dict):
+    cur.execute(f"DROP INDEX IF EXISTS {TABLE}_idx")
+    if is_reduced(storage):
+        expr, opclass = f"({reduced_vector(storage, 'embedding')})", reduced_operator(storage)[1]
+    else:
+        expr, opclass = "embedding", VECTOR_METRICS[get_vector_metric()]["opclass"]
+    started = time.perf_counter()
+    cur.execute(f"CREATE INDEX {TABLE}_idx ON {TABLE} USING hnsw ({expr} {opclass})")
+    build = time.perf_counter() - started
+    cur.execute(f"SELECT pg_relation_size('{TABLE}_idx')")
+    return build, cur.fetchone()[0]
+
+
+def run(modes: list, queries: int, k: int, synthetic: int, ef_search: int) -> dict:
+    results = {}
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            ids, embs = load_table(cur, synthetic)
+            cur.execute("ANALYZE " + TABLE)
+            qs = make_queries(embs, queries)
+            truth = exact_neighbours(ids, embs, qs, k)
+            supported = pgvector_version(cur) >= (0, 7)
+            # Small tables cost out as cheaper to scan; measure every mode through its index.
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for text in modes:
+                storage = parse_mode(text)
+                if is_reduced(storage) and not supported:
+                    results[text] = None
+                    continue
+                build, size = build_index(cur, storage)
+                cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(max(ef_search, k * rerank_factor())),))
+                sql = _knn_sql("id", TABLE, "true", "%(emb)s", "%(k)s", storage)
+                timings, recall = [], []
+                for q, expected in zip(qs, truth):
+                    started = time.perf_counter()
+                    cur.execute(sql, {"emb": q, "k": k})
+                    timings.append(time.perf_counter() - started)
+                    recall.append(len(expected & {r[0] for r in cur.fetchall()}) / k)
+                results[text] = {
+                    "recall": statistics.mean(recall),
+                    "p50_ms": statistics.median(timings) * 1000,
+                    "p95_ms": sorted(timings)[int(0.95 * (len(timings) - 1))] * 1000,
+                    "index_mb": size / 2**20,
+                    "build_s": build,
+                }
+        conn.rollback()
+    return {"rows": len(ids), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="full,halfvec,halfvec:512,full:256,binary")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many vectors instead of copying found_items")
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--rerank", type=int, default=None, help="candidates fetched per result on reduced indexes")
+    args = parser.parse_args()
+    if args.rerank:
+        os.environ["PG_VECTOR_RERANK_FACTOR"] = str(args.rerank)
+    out = run(args.modes.split(","), args.queries, args.k, args.synthetic, args.ef_search)
+    print(f"{out['rows']} rows, recall@{args.k}")
+    for mode, r in out["results"].items():
+        if r is None:
+            print(f"{mode:14s} skipped: needs pgvector 0.7+")
+            continue
+        print(
+            f"{mode:14s} recall {r['recall']:.3f}  p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms"
+            f"  index {r['index_mb']:8.1f} MB  build {r['build_s']:6.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
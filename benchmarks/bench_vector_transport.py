@@ -0,0 +1,66 @@
+"""Micro-benchmark: cost of moving one embedding between Python and Postgres.
+
+    python -m benchmarks.bench_vector_transport [--dim 1536] [--repeat 2000]
+
+The module form, run from the repository root, is required: it imports
+db.vector and db.pgbinary.
+
+Compares the legacy ``map(str, list)`` literal with the float32 text adapter
+used for query parameters, the binary COPY encoding used for bulk writes, and
+decoding of text results, of ``vector_send`` bytea results and of the
+zero-copy binary COPY view.
+"""
+import argparse
+import json
+import struct
+import timeit
+
+import numpy as np
+import psycopg2
+
+from db.pgbinary import encode_vector
+from db.vector import VectorAdapter, decode_vector, format_vector, parse_vector
+
+
+def legacy_literal(emb: list) -> str:
+    return "[" + ",".join(map(str, emb)) + "]"
+
+
+def run(dim: int, repeat: int) -> dict:
+    rng = np.random.default_rng(0)
+    arr = rng.normal(0, 1, dim).astype(np.float32)
+    arr /= np.linalg.norm(arr)
+    as_list = arr.astype(np.float64).tolist()  # what the JSON API used to hand back
+    text = legacy_literal(as_list)
+    pg_text = format_vector(arr)  # pgvector prints shortest float32 text
+    binary = encode_vector(arr)
+    copy_row = struct.pack("!hi", 1, len(binary)) + binary
+    bytea_text = "\\x" + binary.hex()  # vector_send(embedding) as the server sends it
+
+    cases = {
+        "encode: legacy map(str, list)": (lambda: legacy_literal(as_list), len(text)),
+        "encode: float32 text adapter": (lambda: VectorAdapter(arr).getquoted(), len(VectorAdapter(arr).getquoted())),
+        "encode: binary COPY": (lambda: encode_vector(arr), len(binary)),
+        "decode: legacy json.loads of ::text": (lambda: json.loads(pg_text), len(pg_text)),
+        "decode: float32 text typecaster": (lambda: parse_vector(pg_text), len(pg_text)),
+        "decode: vector_send bytea": (lambda: decode_vector(psycopg2.BINARY(bytea_text, None)), len(bytea_text)),
+        "decode: binary COPY view": (lambda: np.frombuffer(copy_row, dtype=">f4", offset=10), len(copy_row)),
+    }
+    results = {}
+    for name, (fn, size) in cases.items():
+        seconds = min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat
+        results[name] = {"us_per_vector": round(seconds * 1e6, 2), "bytes": size}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    for name, r in run(args.dim, args.repeat).items():
+        print(f"{name:36s} {r['us_per_vector']:10.2f} us  {r['bytes']:8d} bytes")
+
+
+if __name__ == "__main__":
+    main()
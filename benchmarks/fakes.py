@@ -0,0 +1,93 @@
+"""Offline stand-ins for the model providers, for benchmarks.
+
+Embeddings come from utils.embedding.HashingEmbeddings in ``words`` mode,
+which maps text to unit vectors by feature hashing its words, so texts
+sharing words are close and the same text always gets the same vector, in
+any process. ``FakeGeminiClient`` answers ``generate_content`` with a
+structured record built from the Tags.xlsx terms found in the prompt,
+without looking at images: JSON when the request asks for JSON, otherwise
+"Field: value" lines.
+
+``install()`` routes utils.embedding and utils.gemini to them for the rest
+of the process, and makes the hashing model the one a new database is
+seeded with. The persistent embedding cache is switched off so fake
+vectors never land in a shared embedding_cache table.
+"""
+import json
+import os
+import re
+
+DIM = 1536
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model: str = None, contents=None, config=None) -> _Response:
+        parts = contents if isinstance(contents, list) else [contents]
+        text = " ".join(p for p in parts if isinstance(p, str))
+        if getattr(config, "response_mime_type", None) == "application/json":
+            return _Response(json.dumps(self._client.json_record(text)))
+        return _Response(self._client.record(text))
+
+
+class FakeGeminiClient:
+    """Mimics the parts of ``google.genai.Client`` the app calls."""
+
+    LABELS = (
+        ("subway_location", "Subway Location", "locations"),
+        ("color", "Color", "colors"),
+        ("item_category", "Item Category", "categories"),
+        ("item_type", "Item Type", "item_types"),
+    )
+
+    def __init__(self, tags: dict):
+        self._patterns = {
+            field: [
+                (term, re.compile(rf"(?<![\w/]){re.escape(term)}(?![\w/])", re.IGNORECASE if len(term) > 2 else 0))
+                for term in sorted(tags.get(key, []), key=len, reverse=True)
+            ]
+            for field, _, key in self.LABELS
+        }
+        self.calls = 0
+        self.models = _Models(self)
+
+    def fields(self, text: str) -> dict:
+        self.calls += 1
+        found = {}
+        for field, patterns in self._patterns.items():
+            found[field] = [term for term, pattern in patterns if pattern.search(text)]
+        return found
+
+    def json_record(self, text: str) -> dict:
+        found = self.fields(text)
+        found["item_category"] = found["item_category"][0] if found["item_category"] else None
+        found["description"] = " ".join(text.split())
+        return found
+
+    def record(self, text: str) -> str:
+        found = self.fields(text)
+        lines = [f"{label}: {', '.join(found[field]) or 'null'}" for field, label, _ in self.LABELS]
+        lines.append(f"Description: {' '.join(text.split())}")
+        return "\n".join(lines)
+
+
+def install(tags: dict, dim: int = DIM) -> tuple:
+    """Use the fakes for all embedding and Gemini calls; returns ``(provider, client)``."""
+    import utils.embedding
+    import utils.gemini
+
+    os.environ["EMBEDDING_CACHE_PERSIST"] = "false"
+    os.environ.update(EMBEDDING_PROVIDER="hashing", EMBEDDING_MODEL="words", EMBEDDING_DIMS=str(dim))
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+    provider, client = utils.embedding.HashingEmbeddings("words", dim), FakeGeminiClient(tags)
+    utils.embedding.set_embedding_provider(provider)
+    utils.embedding._memory_cache._entries.clear()
+    utils.gemini.get_client = lambda: client
+    return provider, client
@@ -0,0 +1,60 @@
+"""Synthetic found items and lost-item reports built from the Tags.xlsx vocabularies.
+
+Everything is drawn from a seeded generator, so the same seed gives the
+same rows on every machine. Descriptions combine the tags with material,
+brand, feature and sticker words, which keeps most items distinguishable
+the way real operator descriptions are.
+"""
+import numpy as np
+
+MATERIALS = ("leather", "canvas", "nylon", "plastic", "metal", "wool", "cotton", "denim", "suede", "rubber", "silicone", "velvet")
+SIZES = ("small", "medium", "large", "pocket-sized", "oversized", "slim")
+BRANDS = (
+    "Nike", "Apple", "Samsung", "Herschel", "Coach", "Adidas", "JanSport", "Sony", "Casio", "Fossil",
+    "Patagonia", "Kate Spade", "North Face", "Ray-Ban", "Bose", "Lenovo", "Timex", "Muji", "Uniqlo", "Moleskine",
+)
+FEATURES = (
+    "zipper", "shoulder strap", "keychain", "scratch on the front", "name tag", "embroidered patch", "metal buckle",
+    "side pocket", "charm", "engraving", "cracked corner", "reflective stripe", "drawstring", "magnetic clasp",
+)
+STICKERS = (
+    "otter", "cactus", "rocket", "pizza", "lighthouse", "panda", "comet", "tulip", "anchor", "dragon", "mango",
+    "violin", "glacier", "falcon", "pretzel", "saturn", "koala", "maple", "lantern", "octopus", "bison", "cobalt",
+    "walrus", "pepper", "origami", "zebra", "harbor", "meteor", "kiwi", "tornado", "sphinx", "banjo",
+)
+
+
+def _pick(rng, values, size=None):
+    return values[rng.integers(len(values))] if size is None else [values[i] for i in rng.choice(len(values), size, replace=False)]
+
+
+def synthetic_items(n: int, tags: dict, seed: int = 0):
+    """Yield ``n`` found-item records shaped like standardize_description output."""
+    rng = np.random.default_rng(seed)
+    locations, colors, categories, types = tags["locations"], tags["colors"], tags["categories"], tags["item_types"]
+    for _ in range(n):
+        item_type = _pick(rng, types)
+        color = _pick(rng, colors, int(rng.integers(1, 3)))
+        location = _pick(rng, locations)
+        description = (
+            f"{_pick(rng, SIZES)} {' and '.join(c.lower() for c in color)} {_pick(rng, MATERIALS)} "
+            f"{item_type.split(' / ')[0].lower()} by {_pick(rng, BRANDS)} with a {_pick(rng, FEATURES)} "
+            f"and a {_pick(rng, STICKERS)} sticker, found at {location}"
+        )
+        yield {
+            "subway_location": [location],
+            "color": color,
+            # Tags.xlsx has no type -> category mapping; tie each type to one category.
+            "item_category": categories[types.index(item_type) % len(categories)],
+            "item_type": [item_type],
+            "description": description,
+        }
+
+
+def lost_report_text(item: dict, rng) -> str:
+    """A rider's free-text report of ``item``: the same facts, reworded, some left out."""
+    words = item["description"].split(", found at ")[0].split()
+    kept = [w for w in words if w not in ("a", "and", "with", "by") and rng.random() > 0.25]
+    rng.shuffle(kept)
+    location = f" near {item['subway_location'][0]}" if rng.random() > 0.3 else ""
+    return f"I lost my {' '.join(c.lower() for c in item['color'])} {item['item_type'][0].lower()}{location}. It is {' '.join(kept)}."
@@ -0,0 +1,73 @@
+"""Backend selection for found-item storage and search.
+
+SEARCH_BACKEND picks the implementation: ``postgres`` (default) or ``local``
+for the in-process store in db/local_store.py. Both expose the same
+signatures as add_found_item_postgres / search_found_items_postgres.
+"""
+from utils.config import get_setting
+
+BACKENDS = ("postgres", "local")
+
+
+def get_backend() -> str:
+    backend = str(get_setting("SEARCH_BACKEND", "postgres")).lower()
+    if backend not in BACKENDS:
+        raise RuntimeError(f"Unsupported SEARCH_BACKEND {backend!r}; use one of {list(BACKENDS)}.")
+    return backend
+
+
+def add_found_item(data: dict, operator_contact: str = "", image_path: str = "", embedding=None) -> bool:
+    if get_backend() == "local":
+        from db.local_store import add_found_item_local
+        return add_found_item_local(data, operator_contact=operator_contact, image_path=image_path, embedding=embedding)
+    from db.insert import add_found_item_postgres
+    return add_found_item_postgres(data, operator_contact=operator_contact, image_path=image_path, embedding=embedding)
+
+
+def search_found_items(user_report: dict, k: int = 5, embedding=None, image_phash: int = None, window_days: int = None) -> list:
+    if get_backend() == "local":
+        # The local store keeps no photo hashes or timestamps; image_phash and
+        # window_days only apply to Postgres.
+        from db.local_store import search_found_items_local
+        return search_found_items_local(user_report, k=k, embedding=embedding)
+    from db.search import search_found_items_postgres
+    return search_found_items_postgres(
+        user_report, k=k, embedding=embedding, image_phash=image_phash, window_days=window_days
+    )
+
+
+def find_near_duplicates(image_phash: int, k: int = 5, window_days: int = None) -> list:
+    """Found items with a near-duplicate photo; always empty where photos are not hashed."""
+    if get_backend() == "local":
+        return []
+    from db.search import find_near_duplicates as find
+    return find(image_phash, k=k, window_days=window_days)
+
+
+def search_found_items_batch(reports: list, k: int = 5, embeddings: list = None, window_days: int = None) -> list:
+    if get_backend() == "local":
+        from db.local_store import search_found_items_local
+        if embeddings is None:
+            from utils.embedding import get_embeddings
+            embeddings = get_embeddings([r.get("description", "") for r in reports])
+        return [search_found_items_local(r, k=k, embedding=emb) for r, emb in zip(reports, embeddings)]
+    from db.search import search_found_items_batch as search_batch
+    return search_batch(reports, k=k, embeddings=embeddings, window_days=window_days)
+
+
+def add_lost_report(data: dict, contact_phone: str = "", contact_email: str = "", embedding=None, image_phash: int = None):
+    """Persist a lost report for reverse matching; returns its id, or None where reports are not kept."""
+    if get_backend() == "local":
+        # Kiosk stores are read-mostly mirrors; reports need the shared database.
+        return None
+    from db.reports import add_lost_report_postgres
+    return add_lost_report_postgres(
+        data, contact_phone=contact_phone, contact_email=contact_email, embedding=embedding, image_phash=image_phash
+    )
+
+
+def record_search_matches(report_id: int, matches: list) -> bool:
+    if get_backend() == "local" or report_id is None:
+        return False
+    from db.reports import record_search_matches as record
+    return record(report_id, matches)
@@ -0,0 +1,271 @@
+"""Bulk-load found items from a JSONL or CSV file.
+
+    python -m db.bulk_import shift_log.jsonl --images-dir photos/
+
+Each record has the shape produced by ``standardize_description`` plus an
+optional ``image_path`` relative to ``--images-dir``. Records flow through
+standardize -> batch embed -> binary COPY, with the next chunk being
+standardized and embedded while the current one is copied. Progress is
+checkpointed after every committed chunk, and a per-record dedupe key makes
+reruns idempotent.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from db.pgbinary import BinaryCopyWriter, encode_int8, encode_text, encode_text_array, encode_vector
+from db.postgres import get_pg_conn, init_db_postgres
+from utils.embedding import get_embedding_provider, get_embeddings
+from utils.gemini import standardize_description
+from utils.helpers import clean_tag_list, load_tag_data
+from utils.images import image_phash, make_thumbnails, store_image
+
+COPY_COLUMNS = (
+    "image_path",
+    "subway_location",
+    "color",
+    "item_category",
+    "item_type",
+    "description",
+    "embedding",
+    "contact_info",
+    "dedupe_key",
+    "phash",
+)
+COPY_ENCODERS = [
+    encode_text,
+    encode_text_array,
+    encode_text_array,
+    encode_text,
+    encode_text_array,
+    encode_text,
+    encode_vector,
+    encode_text,
+    encode_text,
+    encode_int8,
+]
+LIST_FIELDS = ("subway_location", "color", "item_type")
+
+
+# ---------------------
+# READING
+# ---------------------
+def _parse_csv_list(value: str) -> list:
+    value = (value or "").strip()
+    if value.startswith("["):
+        return json.loads(value)
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def read_records(path: Path):
+    """Yield raw records from a .jsonl or .csv file, one dict per line/row."""
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                for field in LIST_FIELDS:
+                    if field in row:
+                        row[field] = _parse_csv_list(row[field])
+                yield row
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _chunks(records, size: int, skip: int):
+    chunk = []
+    for index, record in enumerate(records):
+        if index < skip:
+            continue
+        chunk.append(record)
+        if len(chunk) == size:
+            yield index + 1, chunk
+            chunk = []
+    if chunk:
+        yield index + 1, chunk
+
+
+# ---------------------
+# PIPELINE STAGES
+# ---------------------
+def dedupe_key(record: dict, image_digest: str) -> str:
+    """Stable key over the raw record and image, so reruns hit the same rows."""
+    if record.get("dedupe_key"):
+        return str(record["dedupe_key"])
+    h = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode("utf-8"))
+    h.update(bytes.fromhex(image_digest))
+    return h.hexdigest()
+
+
+def _store_image(record: dict, images_dir: Path, store_dir: Path):
+    name = record.get("image_path") or record.get("image")
+    if not name:
+        return "", hashlib.sha256(b"").hexdigest()
+    with open(images_dir / name, "rb") as src:
+        path, digest = store_image(src, name, root=store_dir)
+    make_thumbnails(path)
+    return path, digest
+
+
+def prepare_chunk(records: list, tag_data: dict, images_dir: Path, store_dir: Path, contact: str) -> list:
+    """Standardize, embed and attach images for one chunk; returns COPY rows."""
+    prepared = []
+    for record in records:
+        image_path, image_digest = _store_image(record, images_dir, store_dir)
+        key = dedupe_key(record, image_digest)
+        # Offline only: a Gemini call per row would cap the import at GEMINI_RPM.
+        data = standardize_description(json.dumps(record, default=str), tag_data, fallback=False)
+        prepared.append((image_path, key, data, image_phash(image_path) if image_path else None))
+
+    embeddings = get_embeddings([data.get("description", "") for _, _, data, _ in prepared])
+    return [
+        (
+            image_path,
+            clean_tag_list(data.get("subway_location", [])),
+            clean_tag_list(data.get("color", [])),
+            data.get("item_category", "null"),
+            clean_tag_list(data.get("item_type", [])),
+            data.get("description", ""),
+            emb,
+            contact,
+            key,
+            phash,
+        )
+        for (image_path, key, data, phash), emb in zip(prepared, embeddings)
+    ]
+
+
+def copy_rows(rows: list, embedding_model: str = None) -> int:
+    """COPY rows into a session staging table, then merge, skipping known dedupe keys.
+
+    New rows are tagged with ``embedding_model``, by default the active model's id.
+    """
+    embedding_model = embedding_model or get_embedding_provider().model_id
+    writer = BinaryCopyWriter(COPY_ENCODERS)
+    for row in rows:
+        writer.write_row(row)
+
+    columns = ", ".join(COPY_COLUMNS)
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS found_items_import (
+                    image_path TEXT,
+                    subway_location TEXT[],
+                    color TEXT[],
+                    item_category TEXT,
+                    item_type TEXT[],
+                    description TEXT,
+                    embedding VECTOR,
+                    contact_info TEXT,
+                    dedupe_key TEXT,
+                    phash BIGINT
+                ) ON COMMIT DELETE ROWS
+                """
+            )
+            cur.copy_expert(f"COPY found_items_import ({columns}) FROM STDIN WITH (FORMAT binary)", writer.getbuffer())
+            # Keys claimed in found_item_keys decide which staged rows are new.
+            cur.execute(
+                f"""
+                WITH staged AS (
+                    SELECT nextval(pg_get_serial_sequence('found_items', 'id'))::int AS id, * FROM found_items_import
+                ),
+                claimed AS (
+                    INSERT INTO found_item_keys (dedupe_key, item_id)
+                    SELECT dedupe_key, id FROM staged WHERE dedupe_key IS NOT NULL
+                    ON CONFLICT (dedupe_key) DO NOTHING
+                    RETURNING item_id
+                )
+                INSERT INTO found_items (id, {columns}, embedding_model)
+                SELECT id, {columns}, %s FROM staged
+                WHERE dedupe_key IS NULL OR id IN (SELECT item_id FROM claimed)
+                """,
+                (embedding_model,),
+            )
+            inserted = cur.rowcount
+        conn.commit()
+    return inserted
+
+
+# ---------------------
+# CHECKPOINTS
+# ---------------------
+def _checkpoint_path(path: Path) -> Path:
+    return path.with_name(path.name + ".checkpoint.json")
+
+
+def load_checkpoint(path: Path) -> dict:
+    cp = _checkpoint_path(path)
+    if cp.exists():
+        return json.loads(cp.read_text())
+    return {"records_done": 0, "rows_inserted": 0}
+
+
+def save_checkpoint(path: Path, state: dict):
+    cp = _checkpoint_path(path)
+    tmp = cp.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, cp)
+
+
+# ---------------------
+# DRIVER
+# ---------------------
+def run_import(path: Path, images_dir: Path, store_dir: Path, batch_size: int = 500, contact: str = "", restart: bool = False) -> dict:
+    tag_data = load_tag_data()
+    if not tag_data:
+        raise RuntimeError("Could not load Tags.xlsx.")
+    state = {"records_done": 0, "rows_inserted": 0} if restart else load_checkpoint(path)
+    chunks = _chunks(read_records(path), batch_size, skip=state["records_done"])
+    started = time.monotonic()
+    processed = 0
+
+    def prepare(item):
+        end, records = item
+        return end, len(records), prepare_chunk(records, tag_data, images_dir, store_dir, contact)
+
+    # Single prefetch worker: chunk n+1 is standardized and embedded while chunk n is copied.
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        item = next(chunks, None)
+        pending = prefetch.submit(prepare, item) if item else None
+        while pending is not None:
+            end, count, rows = pending.result()
+            item = next(chunks, None)
+            pending = prefetch.submit(prepare, item) if item else None
+
+            state["rows_inserted"] += copy_rows(rows)
+            state["records_done"] = end
+            save_checkpoint(path, state)
+
+            processed += count
+            rate = processed / max(time.monotonic() - started, 1e-9) * 60
+            print(f"{state['records_done']} records, {state['rows_inserted']} inserted ({rate:.0f} records/min)", file=sys.stderr)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load found items into Postgres.")
+    parser.add_argument("input", type=Path, help="JSONL or CSV file of standardized records")
+    parser.add_argument("--images-dir", type=Path, default=Path("."), help="directory that record image paths are relative to")
+    parser.add_argument("--store-dir", type=Path, default=Path("found_images"), help="where the app serves images from")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--contact", default="", help="operator contact stored on every row")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+
+    init_db_postgres()
+    state = run_import(args.input, args.images_dir, args.store_dir, args.batch_size, args.contact, args.restart)
+    print(json.dumps(state))
+
+
+if __name__ == "__main__":
+    main()
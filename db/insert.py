@@ -1,41 +1,59 @@
 from pathlib import Path
-from db.postgres import get_pg_conn
-from utils.embedding import get_openai_embedding, embedding_to_pgvector_literal
+from db.postgres import get_pg_conn, execute_prepared, refresh_on_dimension_mismatch
+from utils.embedding import get_embedding, get_embedding_provider
+from utils.helpers import clean_tag_list
+from utils.images import image_phash
+from utils.metrics import span
 import streamlit as st
 
 
-def add_found_item_postgres(data: dict, operator_contact: str = "", image_path: str = "") -> bool:
+def add_found_item_postgres(data: dict, operator_contact: str = "", image_path: str = "", embedding=None) -> bool:
     description = data.get("description", "")
-    try:
-        emb = get_openai_embedding(description)
-    except Exception as e:
-        st.error(f"Embedding error: {e}")
-        return False
-
-    emb_literal = embedding_to_pgvector_literal(emb)
+    emb = embedding
+    if emb is None:
+        try:
+            emb = get_embedding(description)
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return False
 
     sql = """
         INSERT INTO found_items (
-            image_path, subway_location, color, item_category, item_type, description, embedding, contact_info
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s::vector, %s)
+            image_path, subway_location, color, item_category, item_type, description, embedding, embedding_model,
+            contact_info, phash
+        ) VALUES (%s, %s::text[], %s::text[], %s, %s::text[], %s, %s::vector, %s, %s, %s)
     """
-    params = (
-        image_path,
-        ",".join(data.get("subway_location", [])),
-        ",".join(data.get("color", [])),
-        data.get("item_category", "null"),
-        ",".join(data.get("item_type", [])),
-        description,
-        emb_literal,
-        operator_contact,
-    )
-
-    try:
-        with get_pg_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-            conn.commit()
-        return True
-    except Exception as e:
-        st.error(f"Error inserting into Postgres: {e}")
-        return False
\ No newline at end of file
+    phash = image_phash(image_path) if image_path else None
+    for attempt in range(2):
+        params = (
+            image_path,
+            clean_tag_list(data.get("subway_location", [])),
+            clean_tag_list(data.get("color", [])),
+            data.get("item_category", "null"),
+            clean_tag_list(data.get("item_type", [])),
+            description,
+            emb,
+            get_embedding_provider().model_id,
+            operator_contact,
+            phash,
+        )
+        try:
+            with get_pg_conn() as conn:
+                with conn.cursor() as cur:
+                    with span("insert.query") as s:
+                        execute_prepared(cur, sql, params)
+                        s.set(rows=cur.rowcount)
+                conn.commit()
+            return True
+        except Exception as e:
+            error = e
+            if attempt or not refresh_on_dimension_mismatch(e):
+                break
+        # The embedding came from the model before a re-embed cutover.
+        try:
+            emb = get_embedding(description)
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return False
+    st.error(f"Error inserting into Postgres: {error}")
+    return False
\ No newline at end of file
@@ -0,0 +1,340 @@
+"""Background intake for operator uploads.
+
+The operator page only enqueues: the image is written to disk and a
+``pending`` found_items row is inserted, which takes milliseconds. Worker
+threads then drain the queue:
+
+    pending -> processing -> ready
+                   |
+                   +-> pending again with backoff, or dead after
+                       INTAKE_MAX_ATTEMPTS
+
+Jobs are claimed with ``FOR UPDATE SKIP LOCKED``, so any number of worker
+processes can share the table. A job left in ``processing`` longer than
+INTAKE_LEASE_SECONDS (a crashed worker) is claimed again. The upload's
+idempotency key (the photo's content hash) is registered in
+found_item_keys; uploading the same photo twice returns the existing row.
+
+    python -m db.intake_queue run --workers 4
+    python -m db.intake_queue status
+    python -m db.intake_queue retry-dead
+"""
+import argparse
+import json
+import mimetypes
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import streamlit as st
+
+from db.postgres import get_pg_conn, init_db_postgres, refresh_on_dimension_mismatch
+from utils.config import get_setting
+from utils.embedding import get_embedding_provider, get_embeddings
+from utils.gemini import describe_found_item, gemini_available, standardize_description
+from utils.helpers import clean_tag_list, load_tag_data
+from utils.images import image_phash, make_thumbnails, store_image
+from utils.metrics import configure_logging, request_trace, start_metrics_server
+
+STATUSES = ("pending", "processing", "ready", "dead")
+
+
+def upload_key(image_digest: str) -> str:
+    return "upload:" + image_digest
+
+
+# ---------------------
+# ENQUEUE (UI side)
+# ---------------------
+def enqueue_found_item(image, filename: str, operator_contact: str = ""):
+    """Store the image (bytes or file object) and a pending row; returns the row id, or None on error."""
+    try:
+        image_path, digest = store_image(image, filename)
+        key = upload_key(digest)
+        with get_pg_conn() as conn:
+            with conn.cursor() as cur:
+                # The key registry, not found_items, enforces uniqueness: found_items is
+                # partitioned by created_at and cannot have a unique index on dedupe_key.
+                cur.execute(
+                    """
+                    INSERT INTO found_item_keys (dedupe_key, item_id)
+                    VALUES (%s, nextval(pg_get_serial_sequence('found_items', 'id')))
+                    ON CONFLICT (dedupe_key) DO NOTHING
+                    RETURNING item_id
+                    """,
+                    (key,),
+                )
+                row = cur.fetchone()
+                if row is None:
+                    cur.execute("SELECT item_id FROM found_item_keys WHERE dedupe_key = %s", (key,))
+                    item_id = cur.fetchone()[0]
+                else:
+                    item_id = row[0]
+                    cur.execute(
+                        """
+                        INSERT INTO found_items (id, image_path, contact_info, dedupe_key, status, next_attempt_at)
+                        VALUES (%s, %s, %s, %s, 'pending', NOW())
+                        """,
+                        (item_id, image_path, operator_contact, key),
+                    )
+            conn.commit()
+        return item_id
+    except Exception as e:
+        st.error(f"Error queueing found item: {e}")
+        return None
+
+
+def get_intake_status(ids: list) -> list:
+    """Status rows for the given ids, newest first."""
+    if not ids:
+        return []
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, status, attempts, last_error, item_category, item_type, description
+                FROM found_items WHERE id = ANY(%s) ORDER BY id DESC
+                """,
+                (list(ids),),
+            )
+            cols = [c.name for c in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+@st.cache_data(ttl=5)
+def get_queue_depth() -> dict:
+    """Pending and processing counts for the sidebar, served by the partial queue index.
+
+    Cached for a few seconds so that reruns do not each hit the database;
+    totals over the whole table come from ``python -m db.intake_queue status``.
+    """
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT status, count(*) FROM found_items WHERE status IN ('pending', 'processing') GROUP BY status"
+            )
+            counts = dict(cur.fetchall())
+    return {status: counts.get(status, 0) for status in ("pending", "processing")}
+
+
+def get_queue_stats() -> dict:
+    """Row counts for every status; scans found_items, so for the CLI only."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT status, count(*) FROM found_items GROUP BY status")
+            counts = dict(cur.fetchall())
+    return {status: counts.get(status, 0) for status in STATUSES}
+
+
+# ---------------------
+# WORKER
+# ---------------------
+def claim_jobs(limit: int) -> list:
+    """Lease up to ``limit`` due jobs, including ones whose worker died holding the lease.
+
+    A job whose lease expired INTAKE_MAX_ATTEMPTS times (e.g. it crashes the
+    worker each time) is dead-lettered instead of being claimed again.
+    """
+    lease = float(get_setting("INTAKE_LEASE_SECONDS", 300))
+    max_attempts = int(get_setting("INTAKE_MAX_ATTEMPTS", 5))
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE found_items
+                SET status = 'dead', locked_at = NULL,
+                    last_error = 'lease expired after ' || attempts || ' attempts; the worker may have crashed'
+                WHERE status = 'processing' AND locked_at < NOW() - make_interval(secs => %s) AND attempts >= %s
+                """,
+                (lease, max_attempts),
+            )
+            cur.execute(
+                """
+                UPDATE found_items f
+                SET status = 'processing', locked_at = NOW(), attempts = f.attempts + 1
+                WHERE f.id IN (
+                    SELECT id FROM found_items
+                    WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                       OR (status = 'processing' AND locked_at < NOW() - make_interval(secs => %s) AND attempts < %s)
+                    ORDER BY next_attempt_at, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING f.id, f.image_path, f.attempts, f.locked_at
+                """,
+                (lease, max_attempts, limit),
+            )
+            cols = [c.name for c in cur.description]
+            jobs = [dict(zip(cols, r)) for r in cur.fetchall()]
+        conn.commit()
+    return jobs
+
+
+def _describe(job: dict, tag_data: dict) -> dict:
+    if not gemini_available():
+        raise RuntimeError("Gemini not configured")
+    path = Path(job["image_path"])
+    make_thumbnails(path)
+    mime_type = mimetypes.guess_type(path.name)[0] or "image/jpeg"
+    model_text = describe_found_item(path.read_bytes(), mime_type)
+    return standardize_description(model_text, tag_data, fallback=False)
+
+
+def complete_job(job: dict, data: dict, embedding, phash: int = None, embedding_model: str = None) -> bool:
+    """Finalize a claimed row; False if the lease was lost to another worker."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE found_items
+                SET subway_location = %s::text[], color = %s::text[], item_category = %s,
+                    item_type = %s::text[], description = %s, embedding = %s::vector, embedding_model = %s, phash = %s,
+                    status = 'ready', last_error = NULL, locked_at = NULL
+                WHERE id = %s AND status = 'processing' AND locked_at = %s
+                """,
+                (
+                    clean_tag_list(data.get("subway_location", [])),
+                    clean_tag_list(data.get("color", [])),
+                    data.get("item_category", "null"),
+                    clean_tag_list(data.get("item_type", [])),
+                    data.get("description", ""),
+                    embedding,
+                    embedding_model or get_embedding_provider().model_id,
+                    phash,
+                    job["id"],
+                    job["locked_at"],
+                ),
+            )
+            done = cur.rowcount == 1
+        conn.commit()
+    return done
+
+
+def fail_job(job: dict, error: str):
+    """Back off and retry, or move the row to the dead-letter state."""
+    max_attempts = int(get_setting("INTAKE_MAX_ATTEMPTS", 5))
+    delay = min(600.0, 10.0 * 2 ** (job["attempts"] - 1))
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE found_items
+                SET status = CASE WHEN attempts >= %s THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = NOW() + make_interval(secs => %s),
+                    last_error = %s, locked_at = NULL
+                WHERE id = %s AND status = 'processing' AND locked_at = %s
+                """,
+                (max_attempts, delay, error[:2000], job["id"], job["locked_at"]),
+            )
+        conn.commit()
+
+
+def process_jobs(jobs: list, tag_data: dict) -> int:
+    """Describe and standardize each job, embed the batch in one call, finalize; returns rows made ready."""
+    described = []
+    for job in jobs:
+        try:
+            described.append((job, _describe(job, tag_data)))
+        except Exception as e:
+            fail_job(job, f"describe: {e}")
+    if not described:
+        return 0
+    provider = get_embedding_provider()
+    try:
+        embeddings = get_embeddings([data.get("description", "") for _, data in described], provider)
+    except Exception as e:
+        for job, _ in described:
+            fail_job(job, f"embed: {e}")
+        return 0
+    ready, stale = 0, []
+    for (job, data), emb in zip(described, embeddings):
+        try:
+            ready += complete_job(job, data, emb, image_phash(job["image_path"]), provider.model_id)
+        except Exception as e:
+            if refresh_on_dimension_mismatch(e):
+                stale.append((job, data))  # embedded just before a re-embed cutover
+            else:
+                fail_job(job, f"finalize: {e}")
+    if stale:
+        provider = get_embedding_provider()
+        try:
+            embeddings = get_embeddings([data.get("description", "") for _, data in stale], provider)
+        except Exception as e:
+            for job, _ in stale:
+                fail_job(job, f"embed: {e}")
+            return ready
+        for (job, data), emb in zip(stale, embeddings):
+            try:
+                ready += complete_job(job, data, emb, image_phash(job["image_path"]), provider.model_id)
+            except Exception as e:
+                fail_job(job, f"finalize: {e}")
+    return ready
+
+
+def retry_dead() -> int:
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE found_items SET status = 'pending', attempts = 0, next_attempt_at = NOW() WHERE status = 'dead'"
+            )
+            count = cur.rowcount
+        conn.commit()
+    return count
+
+
+def _worker_loop(stop: threading.Event, tag_data: dict, batch_size: int, poll_interval: float):
+    while not stop.is_set():
+        try:
+            jobs = claim_jobs(batch_size)
+            if jobs:
+                with request_trace("intake_batch", jobs=len(jobs)):
+                    ready = process_jobs(jobs, tag_data)
+                print(f"{threading.current_thread().name}: {ready}/{len(jobs)} ready", file=sys.stderr)
+                continue
+        except Exception:
+            traceback.print_exc()
+        stop.wait(poll_interval)
+
+
+def run_workers(workers: int = 4, batch_size: int = 8, poll_interval: float = 1.0):
+    tag_data = load_tag_data()
+    if not tag_data:
+        raise RuntimeError("Could not load Tags.xlsx.")
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_worker_loop, args=(stop, tag_data, batch_size, poll_interval), name=f"intake-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background intake worker for queued found items.")
+    parser.add_argument("command", choices=["run", "status", "retry-dead"])
+    parser.add_argument("--workers", type=int, default=int(get_setting("INTAKE_WORKERS", 4)))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    init_db_postgres()
+    if args.command == "run":
+        configure_logging()
+        start_metrics_server()
+        run_workers(args.workers, args.batch_size, args.poll_interval)
+    elif args.command == "retry-dead":
+        print(f"Requeued {retry_dead()} dead items.")
+    print(json.dumps(get_queue_stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""In-process vector store for kiosks and stations without a reliable database link.
+
+Layout of a store directory:
+
+    meta.json        dim, row and tag counts, capacity, tag vocabularies, sync watermark
+    embeddings.f32   memory-mapped float32 matrix, ``capacity x dim``
+    rows.jsonl       one JSON payload per row (id, description, image path, ...)
+    *.npy            memory-mapped columns: each row's offset in rows.jsonl, its
+                     item_category code and, for each list field, parallel
+                     (row, code) arrays
+    .lock            flock target that serializes writers across processes
+
+Tag filters run on the columns, so opening a store parses no JSON; rows.jsonl
+is only read for the payloads of returned hits.
+
+``meta.json`` is the commit point: rows beyond its ``count`` are ignored and
+trimmed by the next writer, so an interrupted append never leaves a
+half-written row. Writers hold the lock from reading ``meta.json`` to
+publishing it again, so the app and ``sync`` can append to the same store;
+readers pick up rows committed by other processes on their next search.
+
+    python -m db.local_store sync --path local_store
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+
+from db.postgres import get_vector_metric
+from utils.config import get_setting
+from utils.embedding import get_embedding, get_embedding_provider
+from utils.helpers import clean_tag_list
+
+LIST_FIELDS = ("subway_location", "color", "item_type")
+DEFAULT_DIM = 1536
+COLUMNS = {
+    "row_offsets": np.int64,
+    "item_category": np.int32,
+    **{f"{field}_{part}": np.int32 for field in LIST_FIELDS for part in ("rows", "codes")},
+}
+
+
+class LocalVectorStore:
+    def __init__(self, path: Path, dim: int = DEFAULT_DIM):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self.dim = dim
+        self.count = 0
+        self.capacity = 0
+        self.last_synced_id = 0
+        self.next_local_id = -1
+        self.vocab = {f: {} for f in ("item_category",) + LIST_FIELDS}
+        self.tag_counts = {f: 0 for f in LIST_FIELDS}
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._rows_bytes = 0
+        self._meta_stamp = None
+        self._embeddings = self._map(0)
+        with self._locked():
+            pass
+
+    # ---------------------
+    # STORAGE
+    # ---------------------
+    def _map(self, capacity: int):
+        if capacity == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.path / "embeddings.f32", dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, 2 * self.capacity, 1024)
+        if isinstance(self._embeddings, np.memmap):
+            self._embeddings.flush()
+        with open(self.path / "embeddings.f32", "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self._embeddings = self._map(capacity)
+
+    def _map_column(self, name: str):
+        path = self.path / f"{name}.npy"
+        if not path.exists():
+            return np.zeros(0, dtype=COLUMNS[name])
+        return np.lib.format.open_memmap(path, mode="r+")
+
+    def _grow_column(self, name: str, used: int, needed: int):
+        """Make room for ``needed`` entries, copying the first ``used`` into a larger file.
+
+        The larger file replaces the old one by rename, so other processes keep
+        reading their mapping of the old file until their next refresh.
+        """
+        column = self.columns[name]
+        if needed <= column.shape[0]:
+            return
+        capacity = max(needed, 2 * column.shape[0], 1024)
+        tmp = self.path / f"{name}.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=COLUMNS[name], shape=(capacity,))
+        grown[:used] = column[:used]
+        grown.flush()
+        os.replace(tmp, self.path / f"{name}.npy")
+        self.columns[name] = grown
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store lock across threads and processes, with meta.json freshly read."""
+        with self._lock:
+            with open(self.path / ".lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._refresh(force=True)
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self, force: bool = False):
+        """Map rows that other processes committed since meta.json was last read."""
+        meta_file = self.path / "meta.json"
+        try:
+            info = meta_file.stat()
+        except FileNotFoundError:
+            return
+        stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+        if stamp == self._meta_stamp and not force:
+            return
+        meta = json.loads(meta_file.read_text())
+        self._meta_stamp = stamp
+        self.dim = meta["dim"]
+        self.last_synced_id = meta["last_synced_id"]
+        self.next_local_id = meta["next_local_id"]
+        self.vocab = {f: dict(meta["vocab"].get(f, {})) for f in ("item_category",) + LIST_FIELDS}
+        if meta["capacity"] != self.capacity:
+            self.capacity = meta["capacity"]
+            self._embeddings = self._map(self.capacity)
+        # A writer that grew a column swapped in a new file, so mappings are renewed on every change.
+        self.columns = {name: self._map_column(name) for name in COLUMNS}
+        if "rows_bytes" not in meta:
+            self._index_rows(meta["count"])
+            return
+        self.count = meta["count"]
+        self.tag_counts = dict(meta["tag_counts"])
+        self._rows_bytes = meta["rows_bytes"]
+
+    def _index_rows(self, count: int):
+        """Build the columns of a store written before they were persisted (lock held)."""
+        self.count = 0
+        self.tag_counts = {f: 0 for f in LIST_FIELDS}
+        self._rows_bytes = 0
+        payloads, offsets = [], []
+        with open(self.path / "rows.jsonl", "rb") as f:
+            for _ in range(count):
+                offsets.append(self._rows_bytes)
+                line = f.readline()
+                self._rows_bytes += len(line)
+                payloads.append(json.loads(line))
+        self._index(payloads, offsets)
+        self._commit()
+
+    def _index(self, payloads: list, offsets: list):
+        """Write the columns of new rows at ``count``; published by the next _commit."""
+        start, n = self.count, len(payloads)
+        categories = []
+        list_rows = {f: [] for f in LIST_FIELDS}
+        list_codes = {f: [] for f in LIST_FIELDS}
+        for offset, payload in enumerate(payloads):
+            cat = payload.get("item_category")
+            categories.append(self._code("item_category", cat) if cat and cat != "null" else -1)
+            for field in LIST_FIELDS:
+                for v in payload[field]:
+                    list_rows[field].append(start + offset)
+                    list_codes[field].append(self._code(field, v))
+        for name, values in (("row_offsets", offsets), ("item_category", categories)):
+            self._grow_column(name, start, start + n)
+            self.columns[name][start:start + n] = values
+        for field in LIST_FIELDS:
+            used, added = self.tag_counts[field], len(list_rows[field])
+            for name, values in ((f"{field}_rows", list_rows[field]), (f"{field}_codes", list_codes[field])):
+                self._grow_column(name, used, used + added)
+                self.columns[name][used:used + added] = values
+            self.tag_counts[field] = used + added
+        self.count += n
+
+    def _code(self, field: str, value: str) -> int:
+        vocab = self.vocab[field]
+        if value not in vocab:
+            vocab[value] = len(vocab)
+        return vocab[value]
+
+    def _commit(self):
+        """Flush embeddings and columns, then publish the new counts in meta.json."""
+        for array in (self._embeddings, *self.columns.values()):
+            if isinstance(array, np.memmap):
+                array.flush()
+        meta = {
+            "dim": self.dim,
+            "count": self.count,
+            "capacity": self.capacity,
+            "tag_counts": self.tag_counts,
+            "rows_bytes": self._rows_bytes,
+            "vocab": self.vocab,
+            "last_synced_id": self.last_synced_id,
+            "next_local_id": self.next_local_id,
+        }
+        tmp = self.path / "meta.tmp.json"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / "meta.json")
+        info = (self.path / "meta.json").stat()
+        self._meta_stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+
+    # ---------------------
+    # WRITES
+    # ---------------------
+    def append_many(self, items: list, embeddings) -> list:
+        """Append rows and their embeddings; returns the assigned ids.
+
+        Items synced from Postgres keep their ``id``; rows created locally get
+        negative ids so they never collide with server ids.
+        """
+        with self._locked():
+            return self._append(items, embeddings)
+
+    def _append(self, items: list, embeddings) -> list:
+        """append_many with the store lock already held."""
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(items), self.dim)
+        start = self.count
+        self._grow(start + len(items))
+        self._embeddings[start:start + len(items)] = embeddings
+
+        payloads = []
+        for item in items:
+            item_id = item.get("id")
+            if item_id is None:
+                item_id = self.next_local_id
+                self.next_local_id -= 1
+            payload = {
+                "id": item_id,
+                "image_path": item.get("image_path", ""),
+                "item_category": item.get("item_category"),
+                "description": item.get("description", ""),
+                "contact_info": item.get("contact_info", ""),
+            }
+            for field in LIST_FIELDS:
+                payload[field] = clean_tag_list(item.get(field, []))
+            payloads.append(payload)
+
+        lines = [(json.dumps(p) + "\n").encode("utf-8") for p in payloads]
+        with open(self.path / "rows.jsonl", "ab") as f:
+            f.truncate(self._rows_bytes)  # drop rows of an append that never committed
+            f.write(b"".join(lines))
+        offsets = []
+        for line in lines:
+            offsets.append(self._rows_bytes)
+            self._rows_bytes += len(line)
+        self._index(payloads, offsets)
+        self._commit()
+        return [p["id"] for p in payloads]
+
+    # ---------------------
+    # SEARCH
+    # ---------------------
+    def _filter_mask(self, user_report: dict):
+        """Boolean row mask for the report's tags, or None when nothing is filtered."""
+        n = self.count
+        mask = None
+        cat = user_report.get("item_category")
+        if cat and cat != "null":
+            code = self.vocab["item_category"].get(cat, -2)
+            mask = self.columns["item_category"][:n] == code
+        for field in LIST_FIELDS:
+            values = clean_tag_list(user_report.get(field, []))
+            if not values:
+                continue
+            codes = [self.vocab[field][v] for v in values if v in self.vocab[field]]
+            hit = np.zeros(n, dtype=bool)
+            if codes:
+                m = self.tag_counts[field]
+                selected = np.isin(self.columns[f"{field}_codes"][:m], codes)
+                hit[self.columns[f"{field}_rows"][:m][selected]] = True
+            mask = hit if mask is None else mask & hit
+        return mask
+
+    def _payloads(self, rows) -> list:
+        """Read the rows.jsonl payloads of the given rows."""
+        payloads = []
+        with open(self.path / "rows.jsonl", "rb") as f:
+            for row in rows:
+                f.seek(int(self.columns["row_offsets"][row]))
+                payloads.append(json.loads(f.readline()))
+        return payloads
+
+    def search(self, user_report: dict, query, k: int = 5) -> list:
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            n = self.count
+            if n == 0:
+                return []
+            mask = self._filter_mask(user_report)
+            if mask is None:
+                candidates = None
+                scores = self._embeddings[:n] @ query
+            else:
+                candidates = np.flatnonzero(mask)
+                if candidates.size == 0:
+                    return []
+                scores = self._embeddings[candidates] @ query
+            k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = top if candidates is None else candidates[top]
+            results = []
+            for payload, sim in zip(self._payloads(rows), scores[top]):
+                sim = float(sim)
+                dist = 1.0 - sim if get_vector_metric() == "cosine" else float(np.sqrt(max(0.0, 2.0 - 2.0 * sim)))
+                results.append({
+                    "id": payload["id"],
+                    "image_path": payload["image_path"],
+                    "subway_location": payload["subway_location"],
+                    "color": payload["color"],
+                    "item_category": payload["item_category"],
+                    "item_type": payload["item_type"],
+                    "description": payload["description"],
+                    "distance": dist,
+                    "similarity": sim,
+                })
+            return results
+
+    # ---------------------
+    # SYNC
+    # ---------------------
+    def sync_from_postgres(self, page_size: int = 5000) -> int:
+        """Pull found_items rows newer than the last synced id; returns rows added."""
+        from db.postgres import get_pg_conn
+        from db.vector import fetch_embeddings
+
+        added = 0
+        while True:
+            with get_pg_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT id, image_path, subway_location, color, item_category, item_type, description, contact_info
+                        FROM found_items
+                        WHERE id > %s AND status = 'ready' AND embedding IS NOT NULL AND vector_dims(embedding) = %s
+                          -- The watermark must not pass rows still queued for intake.
+                          AND id < coalesce((SELECT min(id) FROM found_items WHERE status IN ('pending', 'processing')), 2147483647)
+                        ORDER BY id LIMIT %s
+                        """,
+                        (self.last_synced_id, self.dim, page_size),
+                    )
+                    cols = [c.name for c in cur.description]
+                    items = [dict(zip(cols, r)) for r in cur.fetchall()]
+                    if not items:
+                        return added
+                    ids, embs = fetch_embeddings(
+                        cur,
+                        "SELECT id, embedding FROM found_items WHERE id = ANY(%s) ORDER BY id",
+                        ([i["id"] for i in items],),
+                        dim=self.dim,
+                    )
+            by_id = dict(zip(ids.tolist(), range(len(ids))))
+            with self._locked():
+                # Another process may have synced part of this page meanwhile.
+                fresh = [i for i in items if i["id"] > self.last_synced_id and i["id"] in by_id]
+                # Advanced before _append so that its commit persists rows and watermark together.
+                self.last_synced_id = max(self.last_synced_id, max(i["id"] for i in items))
+                self._append(fresh, embs[[by_id[i["id"]] for i in fresh]])
+            added += len(fresh)
+
+
+@st.cache_resource
+def get_local_store() -> LocalVectorStore:
+    return LocalVectorStore(Path(get_setting("LOCAL_STORE_PATH", "local_store")), get_embedding_provider().dims)
+
+
+# ---------------------
+# BACKEND INTERFACE
+# ---------------------
+def add_found_item_local(data: dict, operator_contact: str = "", image_path: str = "", embedding=None) -> bool:
+    description = data.get("description", "")
+    emb = embedding
+    if emb is None:
+        try:
+            emb = get_embedding(description)
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return False
+    try:
+        get_local_store().append_many([{**data, "image_path": image_path, "contact_info": operator_contact}], [emb])
+        return True
+    except Exception as e:
+        st.error(f"Error writing to local store: {e}")
+        return False
+
+
+def search_found_items_local(user_report: dict, k: int = 5, embedding=None) -> list:
+    user_emb = embedding
+    if user_emb is None:
+        try:
+            user_emb = get_embedding(user_report.get("description", ""))
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return []
+    try:
+        return get_local_store().search(user_report, user_emb, k)
+    except Exception as e:
+        st.error(f"Search error: {e}")
+        return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local found-item vector store.")
+    parser.add_argument("command", choices=["sync", "info"])
+    parser.add_argument("--path", type=Path, default=Path(get_setting("LOCAL_STORE_PATH", "local_store")))
+    args = parser.parse_args(argv)
+
+    store = LocalVectorStore(args.path, get_embedding_provider().dims)
+    if args.command == "sync":
+        print(f"Synced {store.sync_from_postgres()} rows from Postgres.")
+    print(json.dumps({"rows": store.count, "capacity": store.capacity, "last_synced_id": store.last_synced_id}))
+
+
+if __name__ == "__main__":
+    main()
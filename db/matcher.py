@@ -0,0 +1,242 @@
+"""Reverse matching: score newly ready found items against every open lost report.
+
+Each cycle takes the found items past the watermark in (created_at, id)
+order, in batches of MATCH_BATCH_SIZE, and scores a whole batch against the
+open reports with one matrix multiply (embeddings are unit length, so the
+dot product is the cosine similarity). Pairs scoring at least
+MATCH_MIN_SIMILARITY, at most MATCH_PER_ITEM per found item, go into
+report_matches; pairs whose categories are both known and differ are skipped.
+The batch's matches and the new watermark commit together.
+
+The watermark never passes rows still queued for intake, nor rows younger
+than MATCH_WATERMARK_LAG_SECONDS, whose inserting transaction may not have
+committed yet. Found items that were already past the watermark when a
+report was filed are covered by the search run at report time. Items
+revived with ``db.intake_queue retry-dead`` after the watermark passed them
+are picked up with ``reset --since``.
+
+    python -m db.matcher run --interval 30
+    python -m db.matcher once
+    python -m db.matcher status
+    python -m db.matcher reset --since 2026-01-01
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from db.postgres import active_embedding, get_pg_conn, init_db_postgres
+from db.reports import record_matches
+from db.vector import fetch_embeddings
+from utils.config import get_setting
+
+WATERMARK = "found_items"
+_EPOCH = "1970-01-01T00:00:00+00:00"
+
+
+def _category(value) -> str:
+    return "" if value in (None, "", "null") else value
+
+
+class OpenReports:
+    """Embeddings of open lost reports, kept in memory and refreshed incrementally.
+
+    Report embeddings only change at a db.reembed cutover, which ``sync``
+    notices and answers by starting over; otherwise a refresh only fetches
+    reports newer than the last one seen and re-reads the (small) list of
+    open ids to drop closed reports.
+    """
+
+    def __init__(self, dims: int = 0, model: dict = None):
+        self.dims = dims
+        self.model = model
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.embeddings = np.zeros((0, dims), dtype=np.float32)
+        self.categories = np.zeros(0, dtype=object)
+        self.max_id = 0
+
+    def sync(self, cur):
+        """Drop everything loaded if the embedding model changed since."""
+        model = active_embedding(cur)
+        if model != self.model:
+            self.__init__(model["dims"], model)
+
+    def refresh(self, cur):
+        cur.execute(
+            """
+            SELECT id, item_category FROM lost_reports
+            WHERE id > %s AND status = 'open' AND embedding IS NOT NULL AND vector_dims(embedding) = %s
+            ORDER BY id
+            """,
+            (self.max_id, self.dims),
+        )
+        new = cur.fetchall()
+        if new:
+            ids, embs = fetch_embeddings(
+                cur, "SELECT id, embedding FROM lost_reports WHERE id = ANY(%s) ORDER BY id", ([r[0] for r in new],), dim=self.dims
+            )
+            self.ids = np.concatenate([self.ids, ids.astype(np.int64)])
+            self.embeddings = np.concatenate([self.embeddings, embs.astype(np.float32)])
+            self.categories = np.concatenate([self.categories, np.array([_category(r[1]) for r in new], dtype=object)])
+            self.max_id = int(self.ids[-1])
+
+        cur.execute("SELECT id FROM lost_reports WHERE status = 'open'")
+        keep = np.isin(self.ids, np.array([r[0] for r in cur.fetchall()], dtype=np.int64))
+        if not keep.all():
+            self.ids, self.embeddings, self.categories = self.ids[keep], self.embeddings[keep], self.categories[keep]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def score_batch(item_embs: np.ndarray, item_categories, reports: OpenReports, min_similarity: float, per_item: int) -> list:
+    """``(item_index, report_id, score)`` for the best report matches of each found item."""
+    if not len(reports) or not len(item_embs):
+        return []
+    scores = item_embs @ reports.embeddings.T
+    item_cat = np.array([_category(c) for c in item_categories], dtype=object)[:, None]
+    report_cat = reports.categories[None, :]
+    scores[(item_cat != "") & (report_cat != "") & (item_cat != report_cat)] = -np.inf
+
+    if per_item < scores.shape[1]:
+        top = np.argpartition(-scores, per_item - 1, axis=1)[:, :per_item]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    rows = np.arange(scores.shape[0])[:, None]
+    top_scores = scores[rows, top]
+    hit_rows, hit_cols = np.nonzero(top_scores >= min_similarity)
+    return [
+        (int(r), int(reports.ids[top[r, c]]), float(top_scores[r, c]))
+        for r, c in zip(hit_rows, hit_cols)
+    ]
+
+
+def _read_watermark(cur):
+    cur.execute(
+        "INSERT INTO match_watermarks (name, created_at, last_id) VALUES (%s, %s, 0) ON CONFLICT (name) DO NOTHING",
+        (WATERMARK, _EPOCH),
+    )
+    # Row lock: concurrent matchers take turns instead of scoring the same batch.
+    cur.execute("SELECT created_at, last_id FROM match_watermarks WHERE name = %s FOR UPDATE", (WATERMARK,))
+    return cur.fetchone()
+
+
+def match_batch(reports: OpenReports, batch_size: int) -> tuple:
+    """Score the next batch past the watermark; returns (items scored, matches recorded)."""
+    lag = float(get_setting("MATCH_WATERMARK_LAG_SECONDS", 60))
+    min_similarity = float(get_setting("MATCH_MIN_SIMILARITY", 0.6))
+    per_item = int(get_setting("MATCH_PER_ITEM", 10))
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            wm_created_at, wm_id = _read_watermark(cur)
+            reports.sync(cur)
+            cur.execute(
+                """
+                SELECT id, created_at, item_category, status = 'ready' AND embedding IS NOT NULL
+                    AND vector_dims(embedding) = %s AS scorable
+                FROM found_items
+                WHERE (created_at, id) > (%s, %s)
+                  AND created_at < NOW() - make_interval(secs => %s)
+                  AND created_at < coalesce(
+                      (SELECT min(created_at) FROM found_items WHERE status IN ('pending', 'processing')), 'infinity')
+                ORDER BY created_at, id
+                LIMIT %s
+                """,
+                (reports.dims, wm_created_at, wm_id, lag, batch_size),
+            )
+            batch = cur.fetchall()
+            if not batch:
+                return 0, 0
+
+            items = [r for r in batch if r[3]]
+            pairs = []
+            if items:
+                reports.refresh(cur)
+                ids, embs = fetch_embeddings(
+                    cur, "SELECT id, embedding FROM found_items WHERE id = ANY(%s) ORDER BY id", ([r[0] for r in items],), dim=reports.dims
+                )
+                category = {r[0]: r[2] for r in items}
+                item_ids = ids.tolist()
+                hits = score_batch(
+                    embs.astype(np.float32), [category[i] for i in item_ids], reports, min_similarity, per_item
+                )
+                pairs = [(report_id, item_ids[row], score) for row, report_id, score in hits]
+                record_matches(cur, pairs, "matcher")
+
+            last_id, last_created_at = batch[-1][0], batch[-1][1]
+            cur.execute(
+                "UPDATE match_watermarks SET created_at = %s, last_id = %s WHERE name = %s",
+                (last_created_at, last_id, WATERMARK),
+            )
+        conn.commit()
+    return len(batch), len(pairs)
+
+
+def match_new_items(reports: OpenReports = None, batch_size: int = None) -> dict:
+    """Run batches until the watermark catches up; returns totals for the cycle."""
+    reports = reports if reports is not None else OpenReports()
+    batch_size = batch_size or int(get_setting("MATCH_BATCH_SIZE", 1024))
+    totals = {"items": 0, "matches": 0, "open_reports": 0}
+    while True:
+        items, matches = match_batch(reports, batch_size)
+        totals["items"] += items
+        totals["matches"] += matches
+        if items < batch_size:
+            totals["open_reports"] = len(reports)
+            return totals
+
+
+def get_watermark() -> dict:
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT created_at, last_id FROM match_watermarks WHERE name = %s", (WATERMARK,))
+            row = cur.fetchone()
+            cur.execute("SELECT count(*) FROM lost_reports WHERE status = 'open'")
+            open_reports = cur.fetchone()[0]
+    created_at, last_id = row if row else (None, 0)
+    return {"created_at": created_at.isoformat() if created_at else None, "last_id": last_id, "open_reports": open_reports}
+
+
+def reset_watermark(since: str):
+    """Rescan found items created at or after ``since`` on the next cycle."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO match_watermarks (name, created_at, last_id) VALUES (%s, %s, 0)
+                ON CONFLICT (name) DO UPDATE SET created_at = EXCLUDED.created_at, last_id = 0
+                """,
+                (WATERMARK, since),
+            )
+        conn.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match new found items against open lost reports.")
+    parser.add_argument("command", choices=["run", "once", "status", "reset"])
+    parser.add_argument("--interval", type=float, default=float(get_setting("MATCH_INTERVAL_SECONDS", 30)))
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--since", default=_EPOCH, help="timestamp for reset")
+    args = parser.parse_args(argv)
+
+    init_db_postgres()
+    if args.command == "reset":
+        reset_watermark(args.since)
+    elif args.command == "once":
+        print(json.dumps(match_new_items(batch_size=args.batch_size)))
+    elif args.command == "run":
+        reports = OpenReports()
+        try:
+            while True:
+                totals = match_new_items(reports, args.batch_size)
+                if totals["items"]:
+                    print(json.dumps(totals))
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+    print(json.dumps(get_watermark()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Switch the found_items ANN index to another storage mode without blocking writes.
+
+    python -m db.migrate_vectors status
+    python -m db.migrate_vectors build --storage halfvec
+    python -m db.migrate_vectors build --storage binary --dims 512
+
+``build`` creates the new index with CREATE INDEX CONCURRENTLY next to the
+current one, which keeps serving searches until the new index is valid and
+the old ones are dropped. On a partitioned found_items the index is built
+concurrently on each partition and attached to an index on the parent.
+Afterwards set PG_VECTOR_STORAGE and PG_VECTOR_INDEX_DIMS to match in every
+process (init_db_postgres rebuilds any other configuration); running
+processes pick up the new index within EMBEDDING_STATE_TTL seconds. Needs
+pgvector 0.7+ for anything but full storage.
+"""
+import argparse
+import json
+import time
+
+import psycopg2
+
+from db.partitions import is_partitioned
+from db.postgres import get_vector_storage, is_reduced, pgvector_version, vector_index_definition
+from utils.config import get_setting
+
+
+def _connect():
+    conn = psycopg2.connect(get_setting("PG_CONNECTION_STRING"))
+    conn.autocommit = True  # CONCURRENTLY cannot run inside a transaction
+    return conn
+
+
+def index_sizes(cur) -> list:
+    cur.execute(
+        """
+        SELECT i.indexname, (SELECT sum(pg_relation_size(relid))::bigint FROM pg_partition_tree(c.oid)), x.indisvalid
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        JOIN pg_index x ON x.indexrelid = c.oid
+        WHERE i.tablename = 'found_items' AND i.indexname LIKE 'found_items_embedding_%%_idx'
+        ORDER BY i.indexname
+        """
+    )
+    return [{"index": name, "bytes": size, "valid": valid} for name, size, valid in cur.fetchall()]
+
+
+def build_index_concurrently(cur, name: str, table: str, definition: str):
+    try:
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+    except psycopg2.Error:
+        # A failed concurrent build leaves an INVALID index behind.
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        raise
+
+
+def build_partitioned_index(cur, name: str, definition: str):
+    """CONCURRENTLY is not supported on partitioned tables: build per partition, then attach."""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return
+    cur.execute(f"CREATE INDEX {name} ON ONLY found_items {definition}")
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'found_items'::regclass ORDER BY c.relname
+        """
+    )
+    for (partition,) in cur.fetchall():
+        child = f"{partition}_{name[len('found_items_'):]}"
+        build_index_concurrently(cur, child, partition, definition)
+        cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def build(storage: dict, memory: str = None) -> dict:
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            if is_reduced(storage) and pgvector_version(cur) < (0, 7):
+                raise RuntimeError("Reduced vector storage needs pgvector 0.7 or later.")
+            name, definition = vector_index_definition(storage)
+            if memory:
+                cur.execute("SET maintenance_work_mem = %s", (memory,))
+            partitioned = is_partitioned(cur)
+            started = time.perf_counter()
+            if partitioned:
+                build_partitioned_index(cur, name, definition)
+            else:
+                build_index_concurrently(cur, name, "found_items", definition)
+            elapsed = time.perf_counter() - started
+            # Partitioned indexes cannot be dropped concurrently; dropping is quick either way.
+            drop = "DROP INDEX IF EXISTS" if partitioned else "DROP INDEX CONCURRENTLY IF EXISTS"
+            for index in index_sizes(cur):
+                if index["index"] != name:
+                    cur.execute(f"{drop} {index['index']}")
+            return {"index": name, "build_seconds": round(elapsed, 1), "indexes": index_sizes(cur)}
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the found_items vector index for a storage mode.")
+    parser.add_argument("command", choices=["status", "build"])
+    parser.add_argument("--storage", default=None, help="full, halfvec or binary (default PG_VECTOR_STORAGE)")
+    parser.add_argument("--dims", type=int, default=None, help="leading dimensions to index (default PG_VECTOR_INDEX_DIMS)")
+    parser.add_argument("--maintenance-work-mem", default=None, help="e.g. 2GB; HNSW builds are much faster in memory")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        print(json.dumps(build(get_vector_storage(args.storage, args.dims), args.maintenance_work_mem), indent=2))
+        return
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            print(json.dumps(index_sizes(cur), indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Monthly partitions of found_items: creation ahead of time, retention, migration.
+
+found_items is range-partitioned on created_at with one partition per UTC
+month (found_items_p202610) and a default partition for rows outside the
+prepared range. Indexes are declared on the parent, so each partition has
+its own vector, tag, full-text and phash indexes, and searches with a time
+window (see db/search.py) only touch the partitions inside it.
+
+Partitioned tables cannot have a unique index on dedupe_key alone, so the
+idempotency keys of uploads and imports live in found_item_keys instead.
+
+    python -m db.partitions status
+    python -m db.partitions ensure --ahead 2
+    python -m db.partitions expire --keep-months 6 [--drop]
+    python -m db.partitions migrate
+
+``expire`` detaches partitions older than the retention period and moves
+them to the ``archive`` schema, or drops them with ``--drop``. ``migrate``
+converts an existing unpartitioned found_items in place; it locks the table
+for the duration of the copy.
+"""
+import argparse
+import json
+import re
+from datetime import date
+
+from utils.config import get_setting
+
+PARTITION_NAME = re.compile(r"^found_items_p(\d{4})(\d{2})$")
+DEFAULT_PARTITION = "found_items_default"
+ARCHIVE_SCHEMA = "archive"
+
+
+def _add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def _bound(month: date) -> str:
+    return f"{month.isoformat()} 00:00:00+00"
+
+
+def partition_name(month: date) -> str:
+    return f"found_items_p{month.year:04d}{month.month:02d}"
+
+
+def _current_month(cur) -> date:
+    cur.execute("SELECT date_trunc('month', NOW() AT TIME ZONE 'UTC')::date")
+    return cur.fetchone()[0]
+
+
+def is_partitioned(cur) -> bool:
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('found_items')")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def list_partitions(cur) -> dict:
+    """Monthly partitions of found_items by month start."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'found_items'::regclass
+        """
+    )
+    months = {}
+    for (name,) in cur.fetchall():
+        m = PARTITION_NAME.match(name)
+        if m:
+            months[date(int(m.group(1)), int(m.group(2)), 1)] = name
+    return months
+
+
+def _insert_columns(cur, table: str = "found_items") -> str:
+    """Columns of ``table`` that can be written (generated columns excluded)."""
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    )
+    return ", ".join(r[0] for r in cur.fetchall())
+
+
+def create_found_items(cur, name: str = "found_items", dims: int = None):
+    """The partitioned found_items table and its default partition; no-op if ``name`` exists.
+
+    ``dims`` sizes the embedding column, by default for the active model.
+    """
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return
+    if dims is None:
+        from db.postgres import active_embedding
+
+        dims = active_embedding(cur)["dims"]
+    cur.execute(
+        f"""
+        CREATE TABLE {name} (
+            id SERIAL,
+            image_path TEXT,
+            subway_location TEXT[] DEFAULT '{{}}',
+            color TEXT[] DEFAULT '{{}}',
+            item_category TEXT,
+            item_type TEXT[] DEFAULT '{{}}',
+            description TEXT,
+            embedding VECTOR({int(dims)}),
+            embedding_model TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            contact_info TEXT,
+            dedupe_key TEXT,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        """
+    )
+    cur.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {name} DEFAULT")
+
+
+def ensure_dedupe_keys(cur):
+    """Registry of upload/import idempotency keys -> found_items id, backfilled on creation."""
+    cur.execute("SELECT to_regclass('found_item_keys') IS NULL")
+    created = cur.fetchone()[0]
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS found_item_keys (
+            dedupe_key TEXT PRIMARY KEY,
+            item_id INT NOT NULL
+        );
+        """
+    )
+    if created:
+        cur.execute("CREATE INDEX IF NOT EXISTS found_item_keys_item_idx ON found_item_keys (item_id)")
+        cur.execute(
+            """
+            INSERT INTO found_item_keys (dedupe_key, item_id)
+            SELECT dedupe_key, min(id) FROM found_items WHERE dedupe_key IS NOT NULL GROUP BY dedupe_key
+            ON CONFLICT DO NOTHING
+            """
+        )
+
+
+def add_partition(cur, month: date, parent: str = "found_items") -> bool:
+    """Create the partition for ``month``; returns False if it already exists.
+
+    Rows that landed in the default partition for that month are moved into
+    the new partition, which Postgres requires before it can be attached.
+    """
+    name = partition_name(month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return False
+    lower, upper = _bound(month), _bound(_add_months(month, 1))
+    cur.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s)",
+        (lower, upper),
+    )
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+        return True
+
+    columns = _insert_columns(cur, parent)
+    cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {DEFAULT_PARTITION}")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO {parent} ({columns}) SELECT {columns} FROM moved
+        """,
+        (lower, upper),
+    )
+    cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    return True
+
+
+def ensure_partitions(cur, ahead: int = None, since: date = None, parent: str = "found_items") -> list:
+    """Partitions from ``since`` (default: this month) to ``ahead`` months out; returns those created."""
+    ahead = int(get_setting("PG_PARTITION_AHEAD_MONTHS", 2)) if ahead is None else ahead
+    current = _current_month(cur)
+    month = since.replace(day=1) if since else current
+    created = []
+    while month <= _add_months(current, ahead):
+        if add_partition(cur, month, parent):
+            created.append(partition_name(month))
+        month = _add_months(month, 1)
+    return created
+
+
+def expire_partitions(cur, keep_months: int = None, drop: bool = False) -> list:
+    """Detach monthly partitions that ended more than ``keep_months`` months ago.
+
+    Their dedupe keys are released so the same photo can be uploaded again.
+    Archived partitions keep their rows and indexes in the ``archive``
+    schema; dropped ones also lose their report_matches.
+    """
+    keep_months = int(get_setting("PG_RETENTION_MONTHS", 6)) if keep_months is None else keep_months
+    cutoff = _add_months(_current_month(cur), -keep_months)
+    expired = []
+    for month, name in sorted(list_partitions(cur).items()):
+        if _add_months(month, 1) > cutoff:
+            continue
+        cur.execute(f"ALTER TABLE found_items DETACH PARTITION {name}")
+        cur.execute(f"DELETE FROM found_item_keys k USING {name} p WHERE k.item_id = p.id")
+        if drop:
+            cur.execute(f"DELETE FROM report_matches m USING {name} p WHERE m.found_item_id = p.id")
+            cur.execute(f"DROP TABLE {name}")
+        else:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+            cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+        expired.append(name)
+    return expired
+
+
+def migrate_to_partitions(cur) -> int:
+    """Rebuild an unpartitioned found_items as a partitioned table; returns rows copied.
+
+    Ids, the id sequence and all columns are kept; the caller runs
+    init_db_postgres afterwards to recreate the indexes on the new table.
+    """
+    if is_partitioned(cur):
+        return 0
+    cur.execute("LOCK TABLE found_items IN ACCESS EXCLUSIVE MODE")
+    ensure_dedupe_keys(cur)
+    cur.execute("SELECT pg_get_serial_sequence('found_items', 'id')")
+    sequence = cur.fetchone()[0]
+    columns = _insert_columns(cur)
+
+    cur.execute("DROP TABLE IF EXISTS found_items_partitioned")
+    cur.execute(
+        "CREATE TABLE found_items_partitioned (LIKE found_items INCLUDING DEFAULTS INCLUDING GENERATED)"
+        " PARTITION BY RANGE (created_at)"
+    )
+    cur.execute("UPDATE found_items SET created_at = NOW() WHERE created_at IS NULL")
+    cur.execute("ALTER TABLE found_items_partitioned ALTER COLUMN created_at SET NOT NULL")
+    cur.execute(
+        "ALTER TABLE found_items_partitioned ADD CONSTRAINT found_items_partitioned_pkey PRIMARY KEY (id, created_at)"
+    )
+    cur.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF found_items_partitioned DEFAULT")
+    cur.execute("SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC')::date FROM found_items")
+    ensure_partitions(cur, since=cur.fetchone()[0], parent="found_items_partitioned")
+
+    cur.execute(f"INSERT INTO found_items_partitioned ({columns}) SELECT {columns} FROM found_items")
+    copied = cur.rowcount
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    cur.execute("DROP TABLE found_items")
+    cur.execute("ALTER TABLE found_items_partitioned RENAME TO found_items")
+    cur.execute("ALTER TABLE found_items RENAME CONSTRAINT found_items_partitioned_pkey TO found_items_pkey")
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY found_items.id")
+    return copied
+
+
+def partition_status(cur) -> list:
+    cur.execute(
+        """
+        SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'found_items'::regclass
+        ORDER BY c.relname
+        """
+    )
+    return [{"partition": name, "rows_estimate": rows, "bytes": size} for name, rows, size in cur.fetchall()]
+
+
+def main(argv=None):
+    from db.postgres import get_pg_conn, init_db_postgres
+
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of found_items.")
+    parser.add_argument("command", choices=["status", "ensure", "expire", "migrate"])
+    parser.add_argument("--ahead", type=int, default=None, help="months to create ahead (default PG_PARTITION_AHEAD_MONTHS)")
+    parser.add_argument("--keep-months", type=int, default=None, help="retention (default PG_RETENTION_MONTHS)")
+    parser.add_argument("--drop", action="store_true", help="drop expired partitions instead of archiving them")
+    args = parser.parse_args(argv)
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            if args.command == "migrate":
+                print(f"Copied {migrate_to_partitions(cur)} rows into partitions.")
+            elif not is_partitioned(cur):
+                raise SystemExit("found_items is not partitioned; run `python -m db.partitions migrate` first.")
+            elif args.command == "ensure":
+                print(json.dumps({"created": ensure_partitions(cur, args.ahead)}))
+            elif args.command == "expire":
+                print(json.dumps({"expired": expire_partitions(cur, args.keep_months, args.drop)}))
+        conn.commit()
+    if args.command == "migrate":
+        init_db_postgres()
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            print(json.dumps(partition_status(cur), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Encoders for Postgres' binary COPY format.
+
+Only the types found_items needs are covered: text, text[], bigint and
+pgvector's vector. See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+"""
+import io
+import struct
+
+import numpy as np
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+TEXT_OID = 25
+
+_NULL = struct.pack("!i", -1)
+
+
+def encode_text(value) -> bytes:
+    return str(value).encode("utf-8")
+
+
+def encode_int8(value) -> bytes:
+    return struct.pack("!q", value)
+
+
+def encode_text_array(values) -> bytes:
+    items = [encode_text(v) for v in values]
+    if not items:
+        return struct.pack("!iiI", 0, 0, TEXT_OID)
+    parts = [struct.pack("!iiIii", 1, 0, TEXT_OID, len(items), 1)]
+    for item in items:
+        parts.append(struct.pack("!i", len(item)))
+        parts.append(item)
+    return b"".join(parts)
+
+
+def encode_vector(values) -> bytes:
+    # pgvector's vector_send: int16 dimensions, int16 unused, big-endian float4 values.
+    arr = np.asarray(values, dtype=">f4")
+    return struct.pack("!HH", arr.shape[0], 0) + arr.tobytes()
+
+
+class BinaryCopyWriter:
+    """Accumulates rows in binary COPY format for ``cursor.copy_expert``."""
+
+    def __init__(self, encoders: list):
+        self.encoders = encoders
+        self.rows = 0
+        self._buf = io.BytesIO()
+        self._buf.write(COPY_SIGNATURE)
+        self._buf.write(struct.pack("!ii", 0, 0))
+
+    def write_row(self, values):
+        buf = self._buf
+        buf.write(struct.pack("!h", len(self.encoders)))
+        for encode, value in zip(self.encoders, values):
+            if value is None:
+                buf.write(_NULL)
+                continue
+            data = encode(value)
+            buf.write(struct.pack("!i", len(data)))
+            buf.write(data)
+        self.rows += 1
+
+    def getbuffer(self) -> io.BytesIO:
+        """Return a readable stream positioned at the start, trailer included."""
+        self._buf.write(struct.pack("!h", -1))
+        self._buf.seek(0)
+        return self._buf
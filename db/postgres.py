@@ -1,78 +1,857 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions, pool
 from psycopg2.extras import RealDictCursor
 import streamlit as st
 
-def get_pg_conn():
-    conn_str = st.secrets.get("PG_CONNECTION_STRING")
+from db.vector import register_vector_typecaster
+from utils.config import get_setting
+from utils.metrics import registry, span
+
+
+# ---------------------
+# CONNECTION POOL
+# ---------------------
+class PooledConnection(extensions.connection):
+    """Connection that remembers its prepared statements and when it was last used."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+        self.vector_registered = False
+
+
+class PgPool:
+    """Blocking, health-checked wrapper around psycopg2's ThreadedConnectionPool.
+
+    psycopg2's pool raises as soon as it is exhausted; here callers queue on a
+    semaphore for up to ``timeout`` seconds instead, and the time they spend
+    waiting is recorded so the pool can be sized from ``stats()``.
+    """
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, healthcheck_idle: float):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, dsn, connection_factory=PooledConnection)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "timeouts": 0,
+            "healthcheck_failures": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+        }
+
+    def getconn(self) -> PooledConnection:
+        start = time.monotonic()
+        with self._lock:
+            self._stats["waiting"] += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.monotonic() - start
+        with self._lock:
+            self._stats["waiting"] -= 1
+            if not acquired:
+                self._stats["timeouts"] += 1
+        if not acquired:
+            raise pool.PoolError(f"Timed out after {self.timeout}s waiting for a Postgres connection.")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_total_s"] += waited
+            self._stats["wait_max_s"] = max(self._stats["wait_max_s"], waited)
+        return conn
+
+    def putconn(self, conn: PooledConnection):
+        try:
+            if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+        conn.last_used = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def _checkout_healthy(self) -> PooledConnection:
+        conn = self._pool.getconn()
+        if conn.closed or (time.monotonic() - conn.last_used > self.healthcheck_idle and not _ping(conn)):
+            with self._lock:
+                self._stats["healthcheck_failures"] += 1
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        stats["wait_avg_ms"] = 1000.0 * stats["wait_total_s"] / checkouts if checkouts else 0.0
+        stats["wait_max_ms"] = 1000.0 * stats.pop("wait_max_s")
+        stats.pop("wait_total_s")
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        return stats
+
+
+def _ping(conn) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@st.cache_resource
+def get_pg_pool() -> PgPool:
+    """Process-wide pool, shared by every session and kept across Streamlit reruns."""
+    conn_str = get_setting("PG_CONNECTION_STRING")
     if not conn_str:
         raise RuntimeError("PG_CONNECTION_STRING not set in Streamlit secrets.")
-    return psycopg2.connect(conn_str)
+    return PgPool(
+        conn_str,
+        minconn=int(get_setting("PG_POOL_MIN_SIZE", 1)),
+        maxconn=int(get_setting("PG_POOL_MAX_SIZE", 10)),
+        timeout=float(get_setting("PG_POOL_TIMEOUT", 30)),
+        healthcheck_idle=float(get_setting("PG_POOL_HEALTHCHECK_IDLE", 30)),
+    )
+
+
+@contextmanager
+def get_pg_conn():
+    """Check a connection out of the pool for the duration of a ``with`` block.
+
+    The transaction is committed when the block exits cleanly and rolled back
+    otherwise; the connection always goes back to the pool. ``vector`` columns
+    come back as float32 NumPy arrays.
+    """
+    pg_pool = get_pg_pool()
+    with span("pg.checkout"):
+        conn = pg_pool.getconn()
+    try:
+        if not conn.vector_registered:
+            conn.vector_registered = register_vector_typecaster(conn)
+        with conn:
+            yield conn
+    finally:
+        pg_pool.putconn(conn)
+
+
+def get_pool_stats() -> dict:
+    return get_pg_pool().stats()
+
+
+registry.register_gauges("pg_pool", get_pool_stats)
+
+
+# ---------------------
+# PREPARED STATEMENTS
+# ---------------------
+_PLACEHOLDER = re.compile(r"%(?:\((\w+)\))?(s|%)")
+
+
+def _numbered_placeholders(sql: str):
+    """Rewrite ``%s`` / ``%(name)s`` placeholders as ``$n``; returns (sql, names).
+
+    A named placeholder used several times maps to a single ``$n``, so large
+    values such as a query vector are sent once per EXECUTE.
+    """
+    names = []
+
+    def number(m):
+        if m.group(2) == "%":
+            return "%"
+        name = m.group(1)
+        if name is None or name not in names:
+            names.append(name)
+            return f"${len(names)}"
+        return f"${names.index(name) + 1}"
+
+    return _PLACEHOLDER.sub(number, sql), names
+
+
+def execute_prepared(cur, sql: str, params=()):
+    """Run ``sql`` (psycopg2 ``%s`` or ``%(name)s`` style) as a server-side prepared statement.
+
+    Each pooled connection PREPAREs a given statement text once and EXECUTEs it
+    afterwards, so Postgres skips parsing and planning on repeat calls.
+    Connections that did not come from the pool fall back to a plain execute.
+    """
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:
+        return cur.execute(sql, params)
+
+    name = "stmt_" + hashlib.md5(sql.encode("utf-8")).hexdigest()[:16]
+    numbered, names = _numbered_placeholders(sql)
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {numbered}")
+        prepared.add(name)
+    values = [params[n] for n in names] if isinstance(params, dict) else list(params)
+    if values:
+        return cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(values))})", values)
+    return cur.execute(f"EXECUTE {name}")
+
+
+# ---------------------
+# SLOW QUERY LOG
+# ---------------------
+slow_query_log = logging.getLogger("lost_found.slow_query")
+_VECTOR_LITERAL = re.compile(r"'\[[-+0-9.eE,]+\]'")
+_EXECUTE = re.compile(rb"^EXECUTE (stmt_\w+)")
+# Session settings that change a search's plan; apply_search_settings sets them per transaction.
+_PLAN_SETTINGS = ("hnsw.ef_search", "hnsw.iterative_scan", "ivfflat.probes", "ivfflat.iterative_scan")
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+_explain_lock = threading.Lock()
+_last_explain = None
+
+
+def log_slow_query(cur, stage, sql: str = None):
+    """Log the cursor's last statement if ``stage`` took SLOW_QUERY_MS or longer.
+
+    ``stage`` is the finished utils.metrics span around the statement. At
+    most one slow statement every SLOW_QUERY_EXPLAIN_INTERVAL seconds (0: never)
+    is also run again under EXPLAIN ANALYZE, on its own connection in a
+    background thread and with the same search settings, and logged with
+    its plan; the others are logged right away without one. Only pass
+    reads, after their rows were fetched. SLOW_QUERY_MS=0 turns the log off.
+    """
+    global _last_explain
+    threshold = float(get_setting("SLOW_QUERY_MS", 500))
+    if not threshold or stage.seconds * 1000 < threshold or not cur.query:
+        return
+    query = cur.query
+    entry = {
+        "stage": stage.stage,
+        "ms": round(stage.seconds * 1000, 2),
+        **stage.attrs,
+        # EXECUTE lines carry the query vector; the statement text is more useful.
+        "sql": " ".join((sql or query.decode("utf-8", "replace")).split())[:4000],
+        "plan": None,
+    }
+    interval = float(get_setting("SLOW_QUERY_EXPLAIN_INTERVAL", 60))
+    with _explain_lock:
+        now = time.monotonic()
+        sample = interval > 0 and (_last_explain is None or now - _last_explain >= interval)
+        if sample:
+            _last_explain = now
+    if not sample:
+        slow_query_log.warning(json.dumps(entry, default=str))
+        return
+    with cur.connection.cursor() as plain:
+        plain.execute(
+            "SELECT " + ", ".join(["current_setting(%s, true)"] * len(_PLAN_SETTINGS)), _PLAN_SETTINGS
+        )
+        settings = {name: value for name, value in zip(_PLAN_SETTINGS, plain.fetchone()) if value is not None}
+    _explain_executor.submit(_explain_and_log, entry, query, sql, settings)
+
+
+def _explain_and_log(entry: dict, query: bytes, sql: str, settings: dict):
+    try:
+        conn = psycopg2.connect(get_setting("PG_CONNECTION_STRING"))
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout = %s", (int(get_setting("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 30000)),))
+                for name, value in settings.items():
+                    cur.execute("SELECT set_config(%s, %s, false)", (name, value))
+                prepared = _EXECUTE.match(query)
+                if prepared:
+                    # Prepared statements live on the connection that ran the search.
+                    cur.execute(f"PREPARE {prepared.group(1).decode()} AS {_numbered_placeholders(sql)[0]}")
+                cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + query)
+                entry["plan"] = _VECTOR_LITERAL.sub("'[...]'", "\n".join(r[0] for r in cur.fetchall()))
+        finally:
+            conn.rollback()
+            conn.close()
+    except Exception as e:
+        entry["plan"] = f"EXPLAIN failed: {e}"
+    slow_query_log.warning(json.dumps(entry, default=str))
+
+
+# ---------------------
+# EMBEDDING MODEL
+# ---------------------
+# Every vector written before embedding_state existed came from this model.
+LEGACY_EMBEDDING = {"provider": "openai", "model": "text-embedding-3-small", "dims": 1536}
+_active_embedding = None
+
+
+def active_embedding(cur=None, refresh: bool = False) -> dict:
+    """Provider, model and dims of the vectors in found_items and lost_reports.
+
+    Read from embedding_state at most every EMBEDDING_STATE_TTL seconds, so a
+    db.reembed cutover reaches every process within that time, or right away
+    with ``refresh``. Uses a connection from the pool unless ``cur`` is given.
+    """
+    global _active_embedding, _active_storage
+    cached = _active_embedding
+    if cached and not refresh and time.monotonic() - cached[1] < float(get_setting("EMBEDDING_STATE_TTL", 10)):
+        return cached[0]
+    if cur is None:
+        with get_pg_conn() as conn:
+            with conn.cursor() as plain:
+                plain.execute("SELECT provider, model, dims FROM embedding_state")
+                row = plain.fetchone()
+    else:
+        with cur.connection.cursor() as plain:
+            plain.execute("SELECT provider, model, dims FROM embedding_state")
+            row = plain.fetchone()
+    if row is None:
+        raise RuntimeError("embedding_state is empty; run init_db_postgres.")
+    spec = {"provider": row[0], "model": row[1], "dims": row[2]}
+    if cached and cached[0] != spec:
+        _active_storage = None
+    _active_embedding = (spec, time.monotonic())
+    return spec
+
+
+_DIMENSION_MISMATCH = re.compile(r"different \w+ dimensions|expected \d+ dimensions")
+
+
+def refresh_on_dimension_mismatch(error) -> bool:
+    """True if ``error`` is pgvector rejecting a vector of the wrong size.
+
+    That happens in the EMBEDDING_STATE_TTL after a cutover that changed
+    dims, while this process still embeds with the old model. The active
+    model is re-read, so the caller can embed again and retry once.
+    """
+    if not _DIMENSION_MISMATCH.search(str(error)):
+        return False
+    active_embedding(refresh=True)
+    return True
+
+
+def embedding_dims() -> int:
+    """Dimensions of the stored vectors, as last read by active_embedding."""
+    return _active_embedding[0]["dims"] if _active_embedding else active_embedding()["dims"]
+
+
+def ensure_embedding_state(cur):
+    """Single-row record of the embedding model in use and of a re-embed in progress.
+
+    Seeded on first run: a database that already holds found items keeps the
+    model they were embedded with, a new one starts with the configured
+    EMBEDDING_PROVIDER, EMBEDDING_MODEL and EMBEDDING_DIMS.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS embedding_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            dims INT NOT NULL,
+            target_provider TEXT,
+            target_model TEXT,
+            target_dims INT,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        """
+    )
+    cur.execute("SELECT 1 FROM embedding_state")
+    if cur.fetchone():
+        return
+    cur.execute("SELECT to_regclass('found_items') IS NOT NULL")
+    if cur.fetchone()[0]:
+        spec = LEGACY_EMBEDDING
+    else:
+        from utils.embedding import make_embedding_provider
+
+        spec = make_embedding_provider().spec()
+    cur.execute(
+        "INSERT INTO embedding_state (provider, model, dims) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+        (spec["provider"], spec["model"], spec["dims"]),
+    )
+
+
+def ensure_embedding_model_column(cur, table: str):
+    """Tag column naming the model behind each row's embedding; existing rows get the active model."""
+    from utils.embedding import make_embedding_provider
+
+    cur.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'embedding_model'
+        """,
+        (table,),
+    )
+    if cur.fetchone():
+        return
+    model_id = make_embedding_provider(**active_embedding(cur)).model_id
+    # A constant default is stored in the catalog, so this does not rewrite the table.
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN embedding_model TEXT DEFAULT %s", (model_id,))
+    cur.execute(f"ALTER TABLE {table} ALTER COLUMN embedding_model DROP DEFAULT")
+
+
+# ---------------------
+# VECTOR SEARCH SETTINGS
+# ---------------------
+# OpenAI embeddings are unit length, so cosine distance ranks exactly like L2
+# but reads directly as 1 - cosine similarity.
+VECTOR_METRICS = {
+    "cosine": {"operator": "<=>", "opclass": "vector_cosine_ops"},
+    "l2": {"operator": "<->", "opclass": "vector_l2_ops"},
+}
+VECTOR_INDEX_METHODS = ("hnsw", "ivfflat", "none")
+# What the ANN index is built over. "full" is the stored vector itself;
+# "halfvec" and "binary" index a 16-bit or 1-bit copy. PG_VECTOR_INDEX_DIMS
+# below the embedding size indexes only the leading (Matryoshka) dimensions.
+# The table always keeps the full vectors, used to re-rank the index
+# candidates exactly.
+VECTOR_STORAGE_MODES = ("full", "halfvec", "binary")
+_STORAGE_INDEX = re.compile(r"^found_items_embedding_(hnsw|ivfflat)_(full|halfvec|binary)(\d+)_idx$")
+
+
+def get_vector_metric() -> str:
+    metric = str(get_setting("PG_VECTOR_METRIC", "cosine")).lower()
+    if metric not in VECTOR_METRICS:
+        raise RuntimeError(f"Unsupported PG_VECTOR_METRIC {metric!r}; use one of {sorted(VECTOR_METRICS)}.")
+    return metric
+
+
+def get_vector_index_method() -> str:
+    method = str(get_setting("PG_VECTOR_INDEX", "hnsw")).lower()
+    if method not in VECTOR_INDEX_METHODS:
+        raise RuntimeError(f"Unsupported PG_VECTOR_INDEX {method!r}; use one of {list(VECTOR_INDEX_METHODS)}.")
+    return method
+
 
+def get_vector_storage(mode: str = None, dims: int = None) -> dict:
+    """Configured index storage; ``mode`` and ``dims`` override the settings."""
+    mode = str(mode or get_setting("PG_VECTOR_STORAGE", "full")).lower()
+    if mode not in VECTOR_STORAGE_MODES:
+        raise RuntimeError(f"Unsupported PG_VECTOR_STORAGE {mode!r}; use one of {list(VECTOR_STORAGE_MODES)}.")
+    full = embedding_dims()
+    dims = int(dims or int(get_setting("PG_VECTOR_INDEX_DIMS", 0) or 0) or full)
+    if not 0 < dims <= full:
+        raise RuntimeError(f"PG_VECTOR_INDEX_DIMS must be between 1 and {full}.")
+    return {"mode": mode, "dims": dims}
+
+
+def is_reduced(storage: dict, full_dims: int = None) -> bool:
+    return storage["mode"] != "full" or storage["dims"] != (full_dims or embedding_dims())
+
+
+def reduced_vector(storage: dict, vector_sql: str, full_dims: int = None) -> str:
+    """SQL for the indexed form of ``vector_sql`` under ``storage``."""
+    dims = storage["dims"]
+    base = vector_sql if dims == (full_dims or embedding_dims()) else f"subvector({vector_sql}, 1, {dims})"
+    if storage["mode"] == "binary":
+        return f"binary_quantize({base})::bit({dims})"
+    return f"{base}::{'halfvec' if storage['mode'] == 'halfvec' else 'vector'}({dims})"
+
+
+def reduced_operator(storage: dict) -> tuple:
+    """(operator, opclass) of the approximate search on a reduced index.
+
+    Truncated and half-precision copies are compared by cosine whatever the
+    metric: the stored vectors are unit length, so cosine ranks like L2, and
+    the exact re-rank applies the configured metric.
+    """
+    if storage["mode"] == "binary":
+        return "<~>", "bit_hamming_ops"
+    if storage["mode"] == "halfvec":
+        return "<=>", "halfvec_cosine_ops"
+    return "<=>", "vector_cosine_ops"
+
+
+def rerank_factor() -> int:
+    return max(1, int(get_setting("PG_VECTOR_RERANK_FACTOR", 4)))
+
+
+_active_storage = None
+
+
+def active_vector_storage(cur, refresh: bool = False) -> dict:
+    """Storage mode of the ANN index that exists on found_items.
+
+    Searches follow the index actually built rather than the settings, so
+    a process started with different settings still issues queries the
+    index can serve. Re-read at most every EMBEDDING_STATE_TTL seconds, so
+    a db.migrate_vectors build reaches running processes without a restart.
+    """
+    global _active_storage
+    active_embedding(cur)  # forgets the storage when the embedding model changed
+    cached = _active_storage
+    if cached and not refresh and time.monotonic() - cached[1] < float(get_setting("EMBEDDING_STATE_TTL", 10)):
+        return cached[0]
+    with cur.connection.cursor() as plain:
+        plain.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'found_items' AND indexname LIKE 'found_items_embedding_%%_idx'"
+        )
+        names = [r[0] for r in plain.fetchall()]
+    storage = {"mode": "full", "dims": embedding_dims()}
+    for name in names:
+        m = _STORAGE_INDEX.match(name)
+        if m:
+            storage = {"mode": m.group(2), "dims": int(m.group(3))}
+    _active_storage = (storage, time.monotonic())
+    return storage
+
+
+def distance_operator() -> str:
+    return VECTOR_METRICS[get_vector_metric()]["operator"]
+
+
+def similarity_from_distance(dist):
+    """Turn a pgvector distance into cosine similarity for the configured metric."""
+    if dist is None:
+        return None
+    if get_vector_metric() == "cosine":
+        return 1.0 - dist
+    # For unit vectors ||a - b||^2 = 2 - 2 cos(a, b).
+    return 1.0 - (dist * dist) / 2.0
+
+
+_pgvector_version = None
+
+
+def pgvector_version(cur) -> tuple:
+    global _pgvector_version
+    if _pgvector_version is None:
+        with cur.connection.cursor() as plain:
+            plain.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = plain.fetchone()
+        _pgvector_version = tuple(int(p) for p in re.findall(r"\d+", row[0])) if row else ()
+    return _pgvector_version
+
+
+def apply_search_settings(cur, limit: int = 0):
+    """Set per-query ANN recall knobs for the current transaction.
+
+    An HNSW scan returns at most ef_search rows, so it is raised to ``limit``
+    (times the re-rank factor on a reduced index) when a query asks for more
+    candidates than that. On pgvector 0.8+
+    iterative index scans keep filtered searches on the ANN index: the scan
+    keeps walking the graph until enough rows pass the tag filters instead of
+    returning fewer than ``k`` results.
+    """
+    if is_reduced(active_vector_storage(cur)):
+        limit *= rerank_factor()
+    ef_search = max(int(get_setting("PG_HNSW_EF_SEARCH", 40)), limit)
+    cur.execute(
+        "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+        (str(ef_search), str(int(get_setting("PG_IVFFLAT_PROBES", 10)))),
+    )
+    iterative_scan = str(get_setting("PG_VECTOR_ITERATIVE_SCAN", "relaxed_order")).lower()
+    if iterative_scan != "off" and pgvector_version(cur) >= (0, 8):
+        cur.execute(
+            "SELECT set_config('hnsw.iterative_scan', %s, true), set_config('ivfflat.iterative_scan', 'relaxed_order', true)",
+            (iterative_scan,),
+        )
+
+
+def vector_index_definition(storage: dict = None, method: str = None, column: str = "embedding", full_dims: int = None) -> tuple:
+    """(index name, CREATE INDEX body after ``ON found_items``) for the configured ANN index.
+
+    ``column`` and ``full_dims`` describe another vector column than the
+    live one, for the index db.reembed builds ahead of a cutover.
+    """
+    storage = storage or get_vector_storage()
+    method = method or get_vector_index_method()
+    metric = get_vector_metric()
+    if method == "hnsw":
+        params = f"m = {int(get_setting('PG_HNSW_M', 16))}, ef_construction = {int(get_setting('PG_HNSW_EF_CONSTRUCTION', 64))}"
+    else:
+        params = f"lists = {int(get_setting('PG_IVFFLAT_LISTS', 100))}"
+    if not is_reduced(storage, full_dims):
+        name = f"found_items_embedding_{method}_{metric}_idx"
+        opclass = VECTOR_METRICS[metric]["opclass"]
+    else:
+        name = f"found_items_embedding_{method}_{storage['mode']}{storage['dims']}_idx"
+        column, opclass = f"({reduced_vector(storage, column, full_dims)})", reduced_operator(storage)[1]
+    return name, f"USING {method} ({column} {opclass}) WITH ({params})"
+
+
+def ensure_vector_index(cur, storage: dict = None):
+    """Create the configured ANN index on found_items.embedding.
+
+    Index names encode method, metric and storage mode, so switching
+    PG_VECTOR_INDEX, PG_VECTOR_METRIC or PG_VECTOR_STORAGE builds the new
+    index and drops the one it replaces; on large tables build it first with
+    ``python -m db.migrate_vectors``. IVFFlat picks its centroids at build
+    time; create it once the table holds representative data.
+    """
+    global _active_storage
+    storage = storage or get_vector_storage()
+    method = get_vector_index_method()
+    if method != "none" and is_reduced(storage) and pgvector_version(cur) < (0, 7):
+        raise RuntimeError(f"PG_VECTOR_STORAGE={storage['mode']} with {storage['dims']} dims needs pgvector 0.7 or later.")
+    wanted, definition = vector_index_definition(storage, method) if method != "none" else (None, None)
+
+    cur.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'found_items' AND indexname LIKE 'found_items_embedding_%%_idx'"
+    )
+    for (name,) in cur.fetchall():
+        if name != wanted:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+    _active_storage = None
+    if method == "none":
+        return
+    create_index(cur, wanted, f"ON found_items {definition}")
+
+
+# ---------------------
+# SCHEMA
+# ---------------------
+TAG_COLUMNS = ("subway_location", "color", "item_type")
+
+
+# ALTER TABLE takes an ACCESS EXCLUSIVE lock and CREATE INDEX a SHARE lock even
+# when IF NOT EXISTS makes them no-ops, so every schema step checks the catalog
+# first and an up-to-date database is initialized without locking found_items.
+def missing_columns(cur, table: str, columns) -> list:
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s)
+        """,
+        (table, list(columns)),
+    )
+    present = {r[0] for r in cur.fetchall()}
+    return [c for c in columns if c not in present]
+
+
+def create_index(cur, name: str, definition: str):
+    """``CREATE INDEX name definition`` unless a relation called ``name`` exists."""
+    cur.execute("SELECT to_regclass(%s) IS NULL", (name,))
+    if cur.fetchone()[0]:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+
+
+def migrate_tag_columns(cur):
+    """Convert legacy comma-joined TEXT tag columns to TEXT[] in place."""
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'found_items' AND column_name = ANY(%s) AND data_type = 'text'
+        """,
+        (list(TAG_COLUMNS),),
+    )
+    for (col,) in cur.fetchall():
+        cur.execute(
+            f"""
+            ALTER TABLE found_items ALTER COLUMN {col} TYPE TEXT[] USING
+                CASE WHEN {col} IS NULL OR btrim({col}) = '' THEN '{{}}'::text[]
+                     ELSE array_remove(array_remove(regexp_split_to_array(btrim({col}), '\\s*,\\s*'), 'null'), '')
+                END
+            """
+        )
+        cur.execute(f"ALTER TABLE found_items ALTER COLUMN {col} SET DEFAULT '{{}}'")
+
+
+def ensure_search_tsv(cur):
+    """Maintain a weighted full-text vector over item_type (A) and description (B)."""
+    if missing_columns(cur, "found_items", ["search_tsv"]):
+        # Generated columns need an IMMUTABLE expression; array_to_string is only
+        # STABLE in general but is immutable for text[], so wrap it.
+        cur.execute(
+            """
+            CREATE OR REPLACE FUNCTION found_items_tsv(item_type TEXT[], description TEXT) RETURNS tsvector
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                SELECT setweight(to_tsvector('english'::regconfig, coalesce(array_to_string(item_type, ' '), '')), 'A')
+                    || setweight(to_tsvector('english'::regconfig, coalesce(description, '')), 'B')
+            $$;
+            """
+        )
+        cur.execute(
+            """
+            ALTER TABLE found_items ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                GENERATED ALWAYS AS (found_items_tsv(item_type, description)) STORED;
+            """
+        )
+    create_index(cur, "found_items_search_tsv_idx", "ON found_items USING gin (search_tsv)")
+
+
+# Mirrored by utils.images.phash_bands.
+PHASH_BANDS_FUNCTION = """
+    CREATE OR REPLACE FUNCTION phash_bands(h BIGINT) RETURNS INT[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT CASE WHEN h IS NULL THEN NULL ELSE ARRAY[
+            (h & 65535)::int,
+            (65536 | ((h >> 16) & 65535))::int,
+            (131072 | ((h >> 32) & 65535))::int,
+            (196608 | ((h >> 48) & 65535))::int
+        ] END
+    $$;
+"""
+
+
+def ensure_phash(cur):
+    """Perceptual image hash with a multi-index hashing lookup.
+
+    ``phash_bands`` splits the 64-bit hash into four 16-bit bands tagged with
+    their position. Two hashes within Hamming distance 7 differ by at most one
+    bit in some band, so a GIN overlap query with the band keys of the photo
+    and their one-bit neighbours finds similar photos without scanning, and
+    ``bit_count`` ranks the candidates exactly (PostgreSQL 14+).
+    """
+    missing = missing_columns(cur, "found_items", ["phash", "phash_bands"])
+    if "phash" in missing:
+        cur.execute("ALTER TABLE found_items ADD COLUMN IF NOT EXISTS phash BIGINT")
+    if "phash_bands" in missing:
+        cur.execute(PHASH_BANDS_FUNCTION)
+        cur.execute(
+            """
+            ALTER TABLE found_items ADD COLUMN IF NOT EXISTS phash_bands INT[]
+                GENERATED ALWAYS AS (phash_bands(phash)) STORED
+            """
+        )
+    create_index(cur, "found_items_phash_bands_idx", "ON found_items USING gin (phash_bands)")
+
+
+def ensure_tag_indexes(cur):
+    for col in TAG_COLUMNS:
+        create_index(cur, f"found_items_{col}_gin_idx", f"ON found_items USING gin ({col})")
+    create_index(cur, "found_items_item_category_idx", "ON found_items (item_category)")
+
+
+def ensure_intake_queue(cur):
+    """Queue columns for background intake; rows inserted directly default to 'ready'.
+
+    status: pending -> processing -> ready, or dead after INTAKE_MAX_ATTEMPTS.
+    """
+    columns = {
+        "status": "TEXT NOT NULL DEFAULT 'ready'",
+        "attempts": "INT NOT NULL DEFAULT 0",
+        "last_error": "TEXT",
+        "locked_at": "TIMESTAMP WITH TIME ZONE",
+        "next_attempt_at": "TIMESTAMP WITH TIME ZONE",
+    }
+    missing = missing_columns(cur, "found_items", list(columns))
+    if missing:
+        cur.execute(
+            "ALTER TABLE found_items "
+            + ", ".join(f"ADD COLUMN IF NOT EXISTS {col} {columns[col]}" for col in missing)
+        )
+    create_index(
+        cur,
+        "found_items_queue_idx",
+        "ON found_items (next_attempt_at, id) WHERE status IN ('pending', 'processing')",
+    )
+
+
+def ensure_lost_reports(cur, dims: int = 1536):
+    """Lost reports kept open for reverse matching, and the candidates found for them.
+
+    report_matches is filled at report time from the search results and later
+    by db/matcher.py as new found items become ready; match_watermarks holds
+    the matcher's (created_at, id) position in found_items.
+    """
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS lost_reports (
+            id SERIAL PRIMARY KEY,
+            subway_location TEXT[] DEFAULT '{{}}',
+            color TEXT[] DEFAULT '{{}}',
+            item_category TEXT,
+            item_type TEXT[] DEFAULT '{{}}',
+            description TEXT,
+            embedding VECTOR({int(dims)}),
+            embedding_model TEXT,
+            phash BIGINT,
+            contact_phone TEXT,
+            contact_email TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        """
+    )
+    create_index(cur, "lost_reports_open_idx", "ON lost_reports (id) WHERE status = 'open'")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_matches (
+            report_id INT NOT NULL REFERENCES lost_reports (id) ON DELETE CASCADE,
+            found_item_id INT NOT NULL,
+            score REAL NOT NULL,
+            source TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            PRIMARY KEY (report_id, found_item_id)
+        );
+        """
+    )
+    create_index(cur, "report_matches_found_item_idx", "ON report_matches (found_item_id)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS match_watermarks (
+            name TEXT PRIMARY KEY,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            last_id INT NOT NULL
+        );
+        """
+    )
+    create_index(cur, "found_items_created_at_idx", "ON found_items (created_at, id)")
+
+
+def init_db_postgres(vector_storage: str = None, index_dims: int = None):
+    """Create found_items, embedding_cache and lost report tables, enable vector extension and build indexes.
+
+    Vector columns are sized for the model recorded in embedding_state.
+
+    ``vector_storage`` and ``index_dims`` override PG_VECTOR_STORAGE and
+    PG_VECTOR_INDEX_DIMS for the ANN index; every process that calls this
+    should agree on them, or each call rebuilds the index its way.
+    """
+    from db.partitions import create_found_items, ensure_dedupe_keys, ensure_partitions, is_partitioned
 
-def init_db_postgres():
-    """Create found_items table and enable vector extension."""
     with get_pg_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            ensure_embedding_state(cur)
+            dims = active_embedding(cur)["dims"]
+            # New databases get the monthly-partitioned layout; an existing
+            # unpartitioned table is converted with `python -m db.partitions migrate`.
+            create_found_items(cur, dims=dims)
+            # Shared embedding cache, keyed by (model, hash of normalized text).
             cur.execute(
                 """
-                CREATE TABLE IF NOT EXISTS found_items (
-                    id SERIAL PRIMARY KEY,
-                    image_path TEXT,
-                    subway_location TEXT,
-                    color TEXT,
-                    item_category TEXT,
-                    item_type TEXT,
-                    description TEXT,
-                    embedding VECTOR(1536),
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding VECTOR NOT NULL,
                     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    contact_info TEXT
+                    PRIMARY KEY (model, text_hash)
                 );
                 """
             )
+            migrate_tag_columns(cur)
+            if missing_columns(cur, "found_items", ["dedupe_key"]):
+                cur.execute("ALTER TABLE found_items ADD COLUMN IF NOT EXISTS dedupe_key TEXT;")
+            ensure_dedupe_keys(cur)
+            if is_partitioned(cur):
+                ensure_partitions(cur)
+            ensure_intake_queue(cur)
+            ensure_tag_indexes(cur)
+            ensure_search_tsv(cur)
+            ensure_phash(cur)
+            ensure_lost_reports(cur, dims)
+            for table in ("found_items", "lost_reports"):
+                ensure_embedding_model_column(cur, table)
+            ensure_vector_index(cur, get_vector_storage(vector_storage, index_dims))
         conn.commit()
-
-# -----------------------------
-# FILE: db/insert.py
-# -----------------------------
-from pathlib import Path
-from db.postgres import get_pg_conn
-from utils.embedding import get_openai_embedding, embedding_to_pgvector_literal
-import streamlit as st
-
-
-def add_found_item_postgres(data: dict, operator_contact: str = "", image_path: str = "") -> bool:
-    description = data.get("description", "")
-    try:
-        emb = get_openai_embedding(description)
-    except Exception as e:
-        st.error(f"Embedding error: {e}")
-        return False
-
-    emb_literal = embedding_to_pgvector_literal(emb)
-
-    sql = """
-        INSERT INTO found_items (
-            image_path, subway_location, color, item_category, item_type, description, embedding, contact_info
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s::vector, %s)
-    """
-    params = (
-        image_path,
-        ",".join(data.get("subway_location", [])),
-        ",".join(data.get("color", [])),
-        data.get("item_category", "null"),
-        ",".join(data.get("item_type", [])),
-        description,
-        emb_literal,
-        operator_contact,
-    )
-
-    try:
-        with get_pg_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-            conn.commit()
-        return True
-    except Exception as e:
-        st.error(f"Error inserting into Postgres: {e}")
-        return False
\ No newline at end of file
@@ -0,0 +1,347 @@
+"""Move stored embeddings to another model while the app keeps serving.
+
+    python -m db.reembed status
+    python -m db.reembed start --provider onnx --model bge-small-en-v1.5 --dims 384
+    python -m db.reembed run [--batch-size 256]
+    python -m db.reembed cutover [--maintenance-work-mem 2GB]
+    python -m db.reembed cleanup
+    python -m db.reembed abort
+
+``start`` records the target model in embedding_state and adds shadow
+columns (embedding_next, embedding_model_next) to found_items and
+lost_reports. ``run`` fills them in id order, a batch per transaction, and
+can be stopped and resumed at any time; searches keep using the live
+column. Rows written meanwhile are embedded with the live model and picked
+up by the next pass.
+
+``cutover`` runs a catch-up pass, builds the ANN index on the shadow column
+next to the live one (same method and storage mode), then blocks writes,
+embeds the last stragglers and swaps the columns and indexes in one short
+transaction. Reads continue until the column rename. Processes pick the new
+model up from embedding_state within EMBEDDING_STATE_TTL seconds, so they
+need the target provider's credentials or model files beforehand, but no
+restart. A search or write that meets a vector of the old size before then
+re-reads embedding_state, embeds again and retries once. The previous
+vectors stay in embedding_prev until ``cleanup``.
+
+Without a migration in progress, ``run`` re-embeds rows whose
+embedding_model tag differs from the active model, e.g. rows a stale
+process wrote just after a cutover.
+"""
+import argparse
+import json
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db.migrate_vectors import build_index_concurrently, build_partitioned_index
+from db.partitions import is_partitioned
+from db.postgres import (
+    active_vector_storage,
+    get_pg_conn,
+    get_vector_index_method,
+    vector_index_definition,
+)
+from utils.config import get_setting
+from utils.embedding import get_embeddings, make_embedding_provider, provider_for
+
+TABLES = ("found_items", "lost_reports")
+_NEXT_INDEX_PREFIX = "found_items_reembed_"
+
+
+def _connect():
+    conn = psycopg2.connect(get_setting("PG_CONNECTION_STRING"))
+    conn.autocommit = True  # CONCURRENTLY cannot run inside a transaction
+    return conn
+
+
+def _read_state(cur, lock: bool = False) -> dict:
+    cur.execute(
+        "SELECT provider, model, dims, target_provider, target_model, target_dims FROM embedding_state"
+        + (" FOR UPDATE" if lock else "")
+    )
+    row = cur.fetchone()
+    if row is None:
+        raise RuntimeError("embedding_state is empty; run init_db_postgres.")
+    # Called for every batch: the cached instances keep ONNX sessions and tokenizers loaded.
+    state = {"active": provider_for(dict(zip(("provider", "model", "dims"), row[:3]))), "target": None}
+    if row[3]:
+        state["target"] = provider_for(dict(zip(("provider", "model", "dims"), row[3:])))
+    return state
+
+
+def _has_column(cur, table: str, column: str) -> bool:
+    cur.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+        """,
+        (table, column),
+    )
+    return cur.fetchone() is not None
+
+
+# ---------------------
+# RE-EMBEDDING
+# ---------------------
+def reembed_batch(cur, table: str, provider, column: str, tag: str, after_id: int, batch_size: int) -> tuple:
+    """Embed the next rows past ``after_id`` not yet tagged with ``provider``; returns (rows, last id)."""
+    cur.execute(
+        f"""
+        SELECT id, description FROM {table}
+        WHERE id > %s AND embedding IS NOT NULL AND {tag} IS DISTINCT FROM %s
+        ORDER BY id LIMIT %s
+        """,
+        (after_id, provider.model_id, batch_size),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return 0, after_id
+    embeddings = get_embeddings([description or "" for _, description in rows], provider)
+    execute_values(
+        cur,
+        f"""
+        UPDATE {table} AS t SET {column} = v.embedding, {tag} = v.model
+        FROM (VALUES %s) AS v (id, embedding, model)
+        WHERE t.id = v.id
+        """,
+        [(id_, emb, provider.model_id) for (id_, _), emb in zip(rows, embeddings)],
+        template="(%s, %s::vector, %s)",
+    )
+    return len(rows), rows[-1][0]
+
+
+def _target_columns(state: dict) -> tuple:
+    if state["target"]:
+        return state["target"], "embedding_next", "embedding_model_next"
+    return state["active"], "embedding", "embedding_model"
+
+
+def run(batch_size: int = None, cur=None) -> dict:
+    """Re-embed every row not yet on the target (or, with no migration, the active) model.
+
+    Each batch commits on its own, unless ``cur`` is given, in which case
+    everything happens in its transaction.
+    """
+    batch_size = batch_size or int(get_setting("REEMBED_BATCH_SIZE", 256))
+    counts = {}
+    for table in TABLES:
+        done, last_id = 0, 0
+        while True:
+            if cur is not None:
+                provider, column, tag = _target_columns(_read_state(cur))
+                rows, last_id = reembed_batch(cur, table, provider, column, tag, last_id, batch_size)
+            else:
+                with get_pg_conn() as conn:
+                    with conn.cursor() as batch_cur:
+                        provider, column, tag = _target_columns(_read_state(batch_cur))
+                        rows, last_id = reembed_batch(batch_cur, table, provider, column, tag, last_id, batch_size)
+                    conn.commit()
+            if not rows:
+                break
+            done += rows
+        counts[table] = done
+    return counts
+
+
+# ---------------------
+# LIFECYCLE
+# ---------------------
+def start(provider: str = None, model: str = None, dims: int = None) -> dict:
+    """Record the target model and add the shadow columns it is written to."""
+    target = make_embedding_provider(provider, model, dims)
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            state = _read_state(cur, lock=True)
+            if state["target"] and state["target"].model_id != target.model_id:
+                raise RuntimeError(f"Already re-embedding to {state['target'].model_id}; run abort first.")
+            if target.model_id == state["active"].model_id:
+                raise RuntimeError(f"{target.model_id} is already the active model.")
+            for table in TABLES:
+                if _has_column(cur, table, "embedding_prev"):
+                    raise RuntimeError(f"{table} still has the columns of the last cutover; run cleanup first.")
+                cur.execute(
+                    f"""
+                    ALTER TABLE {table}
+                        ADD COLUMN IF NOT EXISTS embedding_next VECTOR({target.dims}),
+                        ADD COLUMN IF NOT EXISTS embedding_model_next TEXT
+                    """
+                )
+            cur.execute(
+                """
+                UPDATE embedding_state
+                SET target_provider = %s, target_model = %s, target_dims = %s, updated_at = NOW()
+                """,
+                (target.name, target.model, target.dims),
+            )
+        conn.commit()
+    return status()
+
+
+def _build_next_index(target, memory: str = None) -> str:
+    """ANN index on embedding_next mirroring the live one; returns its final name, or None without an index."""
+    method = get_vector_index_method()
+    if method == "none":
+        return None
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            live = active_vector_storage(cur)
+            full = _read_state(cur)["active"].dims
+    # Indexes over all dimensions stay that way; truncated ones keep their size if the new model is wide enough.
+    storage = {"mode": live["mode"], "dims": target.dims if live["dims"] == full else min(live["dims"], target.dims)}
+    name, definition = vector_index_definition(storage, method, column="embedding_next", full_dims=target.dims)
+    building = name.replace("found_items_embedding_", _NEXT_INDEX_PREFIX, 1)
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            if memory:
+                cur.execute("SET maintenance_work_mem = %s", (memory,))
+            if is_partitioned(cur):
+                build_partitioned_index(cur, building, definition)
+            else:
+                build_index_concurrently(cur, building, "found_items", definition)
+    finally:
+        conn.close()
+    return name
+
+
+def cutover(batch_size: int = None, memory: str = None) -> dict:
+    """Catch up, index the shadow column, then swap it in under a short write lock."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            target = _read_state(cur)["target"]
+    if target is None:
+        raise RuntimeError("No re-embed in progress; run start first.")
+    started = time.perf_counter()
+    caught_up = run(batch_size)
+    index = _build_next_index(target, memory)
+
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            # Blocks writers but not searches, which keep reading the live column until the rename.
+            cur.execute(f"LOCK TABLE {', '.join(TABLES)} IN SHARE ROW EXCLUSIVE MODE")
+            final = run(batch_size, cur)
+            for table in TABLES:
+                cur.execute(f"ALTER TABLE {table} RENAME COLUMN embedding TO embedding_prev")
+                cur.execute(f"ALTER TABLE {table} RENAME COLUMN embedding_next TO embedding")
+                cur.execute(f"ALTER TABLE {table} RENAME COLUMN embedding_model TO embedding_model_prev")
+                cur.execute(f"ALTER TABLE {table} RENAME COLUMN embedding_model_next TO embedding_model")
+            cur.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'found_items' AND indexname LIKE 'found_items_embedding_%%_idx'"
+            )
+            for (name,) in cur.fetchall():
+                cur.execute(f"DROP INDEX IF EXISTS {name}")
+            if index:
+                cur.execute(f"ALTER INDEX {index.replace('found_items_embedding_', _NEXT_INDEX_PREFIX, 1)} RENAME TO {index}")
+                # Partition indexes follow migrate_vectors' naming, {partition}_embedding_...
+                cur.execute(
+                    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+                    (index,),
+                )
+                for (child,) in cur.fetchall():
+                    cur.execute(f"ALTER INDEX {child} RENAME TO {child.replace('_reembed_', '_embedding_', 1)}")
+            cur.execute(
+                """
+                UPDATE embedding_state
+                SET provider = target_provider, model = target_model, dims = target_dims,
+                    target_provider = NULL, target_model = NULL, target_dims = NULL, updated_at = NOW()
+                """
+            )
+        conn.commit()
+    return {
+        "model": target.model_id,
+        "index": index,
+        "rows": {table: caught_up[table] + final[table] for table in TABLES},
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def cleanup():
+    """Drop the vectors of the model replaced at the last cutover."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(
+                    f"ALTER TABLE {table} DROP COLUMN IF EXISTS embedding_prev, DROP COLUMN IF EXISTS embedding_model_prev"
+                )
+        conn.commit()
+
+
+def abort():
+    """Forget the target model and drop its shadow columns and index."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'found_items' AND indexname LIKE %s",
+                (_NEXT_INDEX_PREFIX + "%",),
+            )
+            for (name,) in cur.fetchall():
+                cur.execute(f"DROP INDEX IF EXISTS {name}")
+            for table in TABLES:
+                cur.execute(
+                    f"ALTER TABLE {table} DROP COLUMN IF EXISTS embedding_next, DROP COLUMN IF EXISTS embedding_model_next"
+                )
+            cur.execute(
+                """
+                UPDATE embedding_state
+                SET target_provider = NULL, target_model = NULL, target_dims = NULL, updated_at = NOW()
+                """
+            )
+        conn.commit()
+
+
+def status() -> dict:
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            state = _read_state(cur)
+            active, target = state["active"], state["target"]
+            result = {"model": active.model_id, "target": target.model_id if target else None, "tables": {}}
+            for table in TABLES:
+                next_done = "0"
+                if target and _has_column(cur, table, "embedding_model_next"):
+                    next_done = "count(*) FILTER (WHERE embedding_model_next = %(target)s)"
+                cur.execute(
+                    f"""
+                    SELECT count(*), count(*) FILTER (WHERE embedding_model IS DISTINCT FROM %(active)s), {next_done}
+                    FROM {table} WHERE embedding IS NOT NULL
+                    """,
+                    {"active": active.model_id, "target": target.model_id if target else None},
+                )
+                rows, stale, done = cur.fetchone()
+                result["tables"][table] = {"rows": rows, "not_on_active_model": stale}
+                if target:
+                    result["tables"][table]["on_target_model"] = done
+                result["tables"][table]["previous_vectors_kept"] = _has_column(cur, table, "embedding_prev")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-embed stored vectors with another embedding model.")
+    parser.add_argument("command", choices=["status", "start", "run", "cutover", "cleanup", "abort"])
+    parser.add_argument("--provider", default=None, help="openai, onnx or hashing (default EMBEDDING_PROVIDER)")
+    parser.add_argument("--model", default=None, help="model name (default EMBEDDING_MODEL or the provider's default)")
+    parser.add_argument("--dims", type=int, default=None, help="embedding dimensions (default EMBEDDING_DIMS or the model's)")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per transaction (default REEMBED_BATCH_SIZE)")
+    parser.add_argument("--maintenance-work-mem", default=None, help="for the cutover's index build, e.g. 2GB")
+    args = parser.parse_args(argv)
+
+    if args.command == "start":
+        result = start(args.provider, args.model, args.dims)
+    elif args.command == "run":
+        result = run(args.batch_size)
+    elif args.command == "cutover":
+        result = cutover(args.batch_size, args.maintenance_work_mem)
+    elif args.command == "cleanup":
+        cleanup()
+        result = status()
+    elif args.command == "abort":
+        abort()
+        result = status()
+    else:
+        result = status()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Lost reports, persisted so that items found later can still be matched to them."""
+from psycopg2.extras import execute_values
+import streamlit as st
+
+from db.postgres import get_pg_conn, execute_prepared, refresh_on_dimension_mismatch
+from utils.embedding import get_embedding, get_embedding_provider
+from utils.helpers import clean_tag_list
+
+
+def add_lost_report_postgres(
+    data: dict, contact_phone: str = "", contact_email: str = "", embedding=None, image_phash: int = None
+):
+    """Store an open lost report; returns its id, or None on error."""
+    description = data.get("description", "")
+    emb = embedding
+    if emb is None:
+        try:
+            emb = get_embedding(description)
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return None
+
+    sql = """
+        INSERT INTO lost_reports (
+            subway_location, color, item_category, item_type, description, embedding, embedding_model, phash,
+            contact_phone, contact_email
+        ) VALUES (%s::text[], %s::text[], %s, %s::text[], %s, %s::vector, %s, %s, %s, %s)
+        RETURNING id
+    """
+    for attempt in range(2):
+        params = (
+            clean_tag_list(data.get("subway_location", [])),
+            clean_tag_list(data.get("color", [])),
+            data.get("item_category", "null"),
+            clean_tag_list(data.get("item_type", [])),
+            description,
+            emb,
+            get_embedding_provider().model_id,
+            image_phash,
+            contact_phone,
+            contact_email,
+        )
+        try:
+            with get_pg_conn() as conn:
+                with conn.cursor() as cur:
+                    execute_prepared(cur, sql, params)
+                    report_id = cur.fetchone()[0]
+                conn.commit()
+            return report_id
+        except Exception as e:
+            error = e
+            if attempt or not refresh_on_dimension_mismatch(e):
+                break
+        # The embedding came from the model before a re-embed cutover.
+        try:
+            emb = get_embedding(description)
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return None
+    st.error(f"Error saving lost report: {error}")
+    return None
+
+
+def record_matches(cur, pairs: list, source: str) -> int:
+    """Upsert ``(report_id, found_item_id, score)`` candidates, keeping the best score per pair."""
+    if not pairs:
+        return 0
+    execute_values(
+        cur,
+        """
+        INSERT INTO report_matches (report_id, found_item_id, score, source) VALUES %s
+        ON CONFLICT (report_id, found_item_id) DO UPDATE
+            SET score = EXCLUDED.score, source = EXCLUDED.source
+            WHERE report_matches.score < EXCLUDED.score
+        """,
+        [(report_id, item_id, float(score), source) for report_id, item_id, score in pairs],
+        page_size=1000,
+    )
+    return len(pairs)
+
+
+def record_search_matches(report_id: int, matches: list) -> bool:
+    """Keep the matches shown when the report was submitted."""
+    pairs = [(report_id, m["id"], m["similarity"] or 0.0) for m in matches]
+    try:
+        with get_pg_conn() as conn:
+            with conn.cursor() as cur:
+                record_matches(cur, pairs, "search")
+            conn.commit()
+        return True
+    except Exception as e:
+        st.error(f"Error saving report matches: {e}")
+        return False
+
+
+def get_report_matches(report_id: int) -> list:
+    """Candidate found items for a report, best first."""
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT m.found_item_id AS id, m.score, m.source, m.created_at AS matched_at,
+                       f.image_path, f.subway_location, f.color, f.item_category, f.item_type, f.description
+                FROM report_matches m JOIN found_items f ON f.id = m.found_item_id
+                WHERE m.report_id = %s
+                ORDER BY m.score DESC
+                """,
+                (report_id,),
+            )
+            cols = [c.name for c in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def close_report(report_id: int):
+    with get_pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE lost_reports SET status = 'closed' WHERE id = %s", (report_id,))
+        conn.commit()
@@ -1,71 +1,419 @@
-from db.postgres import get_pg_conn
-from psycopg2.extras import RealDictCursor
-from utils.embedding import get_openai_embedding, embedding_to_pgvector_literal
+from db.postgres import (
+    get_pg_conn,
+    execute_prepared,
+    active_vector_storage,
+    apply_search_settings,
+    distance_operator,
+    is_reduced,
+    log_slow_query,
+    reduced_operator,
+    refresh_on_dimension_mismatch,
+    reduced_vector,
+    rerank_factor,
+    similarity_from_distance,
+)
+from psycopg2.extras import RealDictCursor, execute_values
+from utils.config import get_setting
+from utils.embedding import get_embedding, get_embeddings
+from utils.helpers import clean_tag_list
+from utils.images import PHASH_MAX_DISTANCE, phash_bands
+from utils.metrics import span
 import streamlit as st
 
+RESULT_COLUMNS = "id, image_path, subway_location, color, item_category, item_type, description"
+LIST_FIELDS = ("item_type", "color", "subway_location")
+SIGNAL_FIELDS = ("vector_rank", "text_rank", "text_score", "image_rank", "hamming", "tag_mismatches", "score")
+HAMMING_SQL = "bit_count((phash # %(phash)s::bigint)::bit(64))"
 
-def search_found_items_postgres(user_report: dict, k: int = 5) -> list:
-    sql = """
-        SELECT id, image_path, subway_location, color, item_category, item_type, description,
-               (embedding <-> %s::vector) AS distance
-        FROM found_items
-        WHERE 1=1
+
+def _visible(window_days: int = None) -> str:
+    """Rows a search may return: ready, and created in the last ``window_days`` days if given.
+
+    The created_at bound lets Postgres skip found_items partitions outside the window.
     """
-    params = []
+    if not window_days:
+        return "status = 'ready'"
+    return f"status = 'ready' AND created_at >= NOW() - make_interval(days => {int(window_days)})"
+
+
+def _window_days(window_days: int = None) -> int:
+    if window_days is None:
+        window_days = get_setting("SEARCH_WINDOW_DAYS", 0)
+    return int(window_days or 0)
 
+
+def _report_tags(user_report: dict):
     icat = user_report.get("item_category")
-    if icat and icat != "null":
-        sql += " AND item_category = %s"
-        params.append(icat)
+    category = icat if icat and icat != "null" else None
+    tags = {}
+    for field in LIST_FIELDS:
+        values = clean_tag_list(user_report.get(field, []))
+        if values:
+            tags[field] = values
+    return category, tags
 
-    itypes = user_report.get("item_type", [])
-    if itypes:
-        sql += " AND item_type LIKE %s"
-        params.append("%" + itypes[0] + "%")
 
-    colors = user_report.get("color", [])
-    if colors:
-        sql += " AND color LIKE %s"
-        params.append("%" + colors[0] + "%")
+def _knn_sql(columns: str, source: str, where: str, emb: str, limit: str, storage: dict) -> str:
+    """Nearest rows of ``source`` to ``emb``, with their exact ``distance``.
 
-    slocs = user_report.get("subway_location", [])
-    if slocs:
-        sql += " AND subway_location LIKE %s"
-        params.append("%" + slocs[0] + "%")
+    On a reduced index (see db.postgres.VECTOR_STORAGE_MODES) the index
+    scan returns ``limit`` times PG_VECTOR_RERANK_FACTOR candidates by the
+    approximate expression, which are then re-ranked against the full vectors.
+    """
+    exact = f"embedding {distance_operator()} {emb}::vector"
+    if storage is None or not is_reduced(storage):
+        return f"SELECT {columns}, {exact} AS distance FROM {source} WHERE {where} ORDER BY distance LIMIT {limit}"
+    op = reduced_operator(storage)[0]
+    approx = f"{reduced_vector(storage, 'embedding')} {op} {reduced_vector(storage, emb + '::vector')}"
+    return f"""
+        SELECT {columns}, {exact} AS distance
+        FROM (
+            SELECT {columns}, embedding FROM {source} WHERE {where}
+            ORDER BY {approx} LIMIT {limit} * {rerank_factor()}
+        ) candidates
+        ORDER BY distance LIMIT {limit}
+    """
 
-    try:
-        user_emb = get_openai_embedding(user_report.get("description", ""))
-    except Exception as e:
-        st.error(f"Embedding error: {e}")
-        return []
 
-    user_emb_literal = embedding_to_pgvector_literal(user_emb)
-    params = [user_emb_literal] + params
+def _filtered_sql(user_report: dict, user_emb, k: int, storage: dict, window_days: int = None):
+    """Tags as hard filters, ranked by vector distance alone."""
+    where = [_visible(window_days)]
+    params = {"emb": user_emb, "k": k}
+
+    category, tags = _report_tags(user_report)
+    if category:
+        where.append("item_category = %(item_category)s")
+        params["item_category"] = category
+
+    # Array overlap matches any of the supplied values and is served by the GIN indexes.
+    for field, values in tags.items():
+        where.append(f"{field} && %({field})s::text[]")
+        params[field] = values
+
+    sql = _knn_sql(RESULT_COLUMNS, "found_items", " AND ".join(where), "%(emb)s", "%(k)s", storage)
+    return sql, params
+
+
+def _batch_sql(k: int, storage: dict, window_days: int = None):
+    """k-NN for many reports at once: a LATERAL vector search per VALUES row.
+
+    Each row carries its own tag filters; NULL means "no filter", so one
+    statement text serves every mix of reports. ``execute_values`` fills in
+    the VALUES list.
+    """
+    where = f"""{_visible(window_days)}
+              AND (q.item_category IS NULL OR f.item_category = q.item_category)
+              AND (q.item_type IS NULL OR f.item_type && q.item_type)
+              AND (q.color IS NULL OR f.color && q.color)
+              AND (q.subway_location IS NULL OR f.subway_location && q.subway_location)"""
+    knn = _knn_sql(RESULT_COLUMNS, "found_items f", where, "q.emb", str(int(k)), storage)
+    sql = f"""
+        WITH queries (ord, emb, item_category, item_type, color, subway_location) AS (VALUES %s)
+        SELECT q.ord, m.*
+        FROM queries q
+        CROSS JOIN LATERAL ({knn}) m
+        ORDER BY q.ord, m.distance
+    """
+    template = "(%s, %s::vector, %s::text, %s::text[], %s::text[], %s::text[])"
+    return sql, template
+
+
+def _batch_row(ord_: int, user_report: dict, user_emb) -> tuple:
+    category, tags = _report_tags(user_report)
+    return (ord_, user_emb, category, tags.get("item_type"), tags.get("color"), tags.get("subway_location"))
+
+
+def _image_params(image_phash: int) -> dict:
+    return {
+        "phash": image_phash,
+        "bands": phash_bands(image_phash, radius=1),
+        # The band lookup finds every hash up to PHASH_MAX_DISTANCE away, and no further.
+        "max_hamming": min(int(get_setting("SEARCH_IMAGE_MAX_HAMMING", PHASH_MAX_DISTANCE)), PHASH_MAX_DISTANCE),
+        "near_duplicate": min(int(get_setting("SEARCH_IMAGE_NEAR_DUPLICATE", 4)), PHASH_MAX_DISTANCE),
+    }
+
+
+def _near_duplicate_sql(image_phash: int, k: int, window_days: int = None):
+    """Rows whose photo is a near-duplicate of the report's, closest first."""
+    params = _image_params(image_phash)
+    params["k"] = k
+    sql = f"""
+        SELECT {RESULT_COLUMNS}, hamming
+        FROM (
+            SELECT {RESULT_COLUMNS}, {HAMMING_SQL} AS hamming
+            FROM found_items
+            WHERE phash_bands && %(bands)s::int[] AND {_visible(window_days)}
+        ) h
+        WHERE hamming <= %(near_duplicate)s
+        ORDER BY hamming, id
+        LIMIT %(k)s
+    """
+    return sql, params
+
 
-    sql += " ORDER BY distance ASC LIMIT %s"
-    params.append(k)
+def _hybrid_sql(
+    user_report: dict,
+    user_emb,
+    k: int,
+    candidates: int,
+    image_phash: int = None,
+    storage: dict = None,
+    window_days: int = None,
+):
+    """Full-text, vector and image candidates fused with reciprocal rank fusion in one statement.
 
+    Each side contributes 1 / (rrf_k + rank); tag mismatches subtract a fixed
+    penalty instead of filtering rows out, and a near-duplicate photo adds a
+    full point so it outranks any text match. The vector, text and image
+    candidate lists are served by the ANN, full-text and phash band indexes.
+
+    The text side only ranks the vector candidates and the rows matching
+    every term of the report: ranking all rows that match any term would
+    score a large share of the table for a report of common words.
+    """
+    op = distance_operator()
+    # Limits are inlined: a prepared statement's generic plan cannot see a
+    # parameter's value and would plan the vector side as a full sort.
+    k, candidates = int(k), int(candidates)
+    params = {
+        "emb": user_emb,
+        "text": user_report.get("description", ""),
+        "rrf_k": float(get_setting("SEARCH_RRF_K", 60)),
+        "penalty": float(get_setting("SEARCH_TAG_PENALTY", 0.008)),
+        "near_duplicate": -1,
+    }
+    mismatches = []
+    category, tags = _report_tags(user_report)
+    if category:
+        mismatches.append("(f.item_category IS DISTINCT FROM %(item_category)s)::int")
+        params["item_category"] = category
+    for field, values in tags.items():
+        mismatches.append(f"(NOT coalesce(f.{field} && %({field})s::text[], false))::int")
+        params[field] = values
+    tag_mismatches = " + ".join(mismatches) or "0"
+    visible = _visible(window_days)
+
+    if image_phash is None:
+        img = "SELECT NULL::int AS id, NULL::bigint AS image_rank, NULL::int AS hamming WHERE false"
+    else:
+        params.update(_image_params(image_phash))
+        img = f"""
+            SELECT id, row_number() OVER (ORDER BY hamming, id) AS image_rank, hamming
+            FROM (
+                SELECT id, {HAMMING_SQL} AS hamming
+                FROM found_items
+                WHERE phash_bands && %(bands)s::int[] AND {visible}
+            ) h
+            WHERE hamming <= %(max_hamming)s
+            ORDER BY hamming, id
+            LIMIT {candidates}
+        """
+
+    sql = f"""
+        WITH vec AS (
+            SELECT id, search_tsv, row_number() OVER (ORDER BY distance) AS vector_rank
+            FROM ({_knn_sql("id, search_tsv", "found_items", visible, "%(emb)s", str(candidates), storage)}) v
+        ),
+        q AS (
+            SELECT plainto_tsquery('english', %(text)s) AS all_terms,
+                   -- OR the report's terms together; ts_rank_cd rewards rows matching more of them.
+                   replace(plainto_tsquery('english', %(text)s)::text, '&', '|')::tsquery AS any_terms
+        ),
+        lex AS (
+            SELECT id, text_score, row_number() OVER (ORDER BY text_score DESC) AS text_rank
+            FROM (
+                SELECT id, ts_rank_cd(search_tsv, q.any_terms) AS text_score
+                FROM q, (
+                    SELECT id, search_tsv FROM vec
+                    UNION
+                    SELECT id, search_tsv FROM found_items, q WHERE search_tsv @@ q.all_terms AND {visible}
+                ) pool
+                WHERE search_tsv @@ q.any_terms
+                ORDER BY text_score DESC
+                LIMIT {candidates}
+            ) l
+        ),
+        img AS ({img}),
+        fused AS (
+            SELECT coalesce(vec.id, lex.id, img.id) AS id,
+                   vec.vector_rank, lex.text_rank, lex.text_score, img.image_rank, img.hamming
+            FROM vec
+            FULL OUTER JOIN lex ON vec.id = lex.id
+            FULL OUTER JOIN img ON img.id = coalesce(vec.id, lex.id)
+        )
+        SELECT *,
+               coalesce(1.0 / (%(rrf_k)s::float8 + vector_rank), 0)
+                 + coalesce(1.0 / (%(rrf_k)s::float8 + text_rank), 0)
+                 + coalesce(1.0 / (%(rrf_k)s::float8 + image_rank), 0)
+                 + (coalesce(hamming <= %(near_duplicate)s, false))::int
+                 - %(penalty)s::float8 * tag_mismatches AS score
+        FROM (
+            SELECT {", ".join("f." + c for c in RESULT_COLUMNS.split(", "))},
+                   (f.embedding {op} %(emb)s::vector) AS distance,
+                   fused.vector_rank, fused.text_rank, fused.text_score, fused.image_rank, fused.hamming,
+                   ({tag_mismatches}) AS tag_mismatches
+            FROM fused JOIN found_items f ON f.id = fused.id AND {visible}
+        ) scored
+        ORDER BY score DESC, distance ASC
+        LIMIT {k}
+    """
+    return sql, params
+
+
+def _to_result(r: dict) -> dict:
+    dist = r.get("distance")
+    if dist is None and r.get("hamming") is not None:
+        similarity = 1.0 - r["hamming"] / 64.0
+    else:
+        similarity = similarity_from_distance(dist)
+    result = {
+        "id": r["id"],
+        "image_path": r["image_path"],
+        "subway_location": r["subway_location"] or [],
+        "color": r["color"] or [],
+        "item_category": r["item_category"],
+        "item_type": r["item_type"] or [],
+        "description": r["description"],
+        "distance": dist,
+        "similarity": similarity,
+    }
+    for field in SIGNAL_FIELDS:
+        if field in r:
+            result[field] = r[field]
+    return result
+
+
+def image_shortcut() -> bool:
+    """Whether a near-duplicate photo is returned without a vector search (SEARCH_IMAGE_SHORTCUT)."""
+    return str(get_setting("SEARCH_IMAGE_SHORTCUT", "true")).lower() == "true"
+
+
+def find_near_duplicates(image_phash: int, k: int = 5, window_days: int = None) -> list:
+    """Found items whose photo is a near-duplicate of ``image_phash``, closest first."""
+    sql, params = _near_duplicate_sql(image_phash, k, _window_days(window_days))
     try:
         with get_pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(sql, params)
-                rows = cur.fetchall()
-        results = []
-        for r in rows:
-            dist = r.get("distance")
-            similarity = None if dist is None else 1.0 / (1.0 + dist)
-            results.append({
-                "id": r["id"],
-                "image_path": r["image_path"],
-                "subway_location": r["subway_location"].split(",") if r["subway_location"] else [],
-                "color": r["color"].split(",") if r["color"] else [],
-                "item_category": r["item_category"],
-                "item_type": r["item_type"].split(",") if r["item_type"] else [],
-                "description": r["description"],
-                "distance": dist,
-                "similarity": similarity,
-            })
-        return results
+                with span("search.query", mode="near_duplicate") as s:
+                    execute_prepared(cur, sql, params)
+                    rows = cur.fetchall()
+                    s.set(rows=len(rows))
+                log_slow_query(cur, s, sql)
     except Exception as e:
         st.error(f"Search error: {e}")
-        return []
\ No newline at end of file
+        return []
+    return [_to_result(r) for r in rows]
+
+
+def search_found_items_postgres(
+    user_report: dict,
+    k: int = 5,
+    hybrid: bool = None,
+    embedding=None,
+    image_phash: int = None,
+    window_days: int = None,
+) -> list:
+    """Find found items matching a standardized lost report.
+
+    With ``hybrid`` (default from SEARCH_HYBRID, on) results fuse full-text,
+    vector and photo-hash ranks and carry per-signal scores; otherwise tags
+    are hard filters and results are ordered by vector distance.
+    ``embedding`` skips embedding the description when the caller already
+    has it. With ``image_phash`` (see utils.images.image_phash) a
+    near-duplicate photo is looked up first and, when found, returned
+    without embedding the description at all. ``window_days`` (default
+    SEARCH_WINDOW_DAYS, 0 for no limit) only considers items found in the
+    last that many days.
+    """
+    if hybrid is None:
+        hybrid = str(get_setting("SEARCH_HYBRID", "true")).lower() == "true"
+    window_days = _window_days(window_days)
+
+    if image_phash is not None and embedding is None and image_shortcut():
+        rows = find_near_duplicates(image_phash, k, window_days)
+        if rows:
+            return rows
+
+    user_emb = embedding
+    if user_emb is None:
+        try:
+            user_emb = get_embedding(user_report.get("description", ""))
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return []
+
+    for attempt in range(2):
+        try:
+            with get_pg_conn() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    storage = active_vector_storage(cur)
+                    if hybrid:
+                        candidates = max(k, int(get_setting("SEARCH_CANDIDATES", 100)))
+                        sql, params = _hybrid_sql(user_report, user_emb, k, candidates, image_phash, storage, window_days)
+                    else:
+                        candidates = k
+                        sql, params = _filtered_sql(user_report, user_emb, k, storage, window_days)
+                    apply_search_settings(cur, limit=candidates)
+                    with span("search.query", mode="hybrid" if hybrid else "filtered") as s:
+                        execute_prepared(cur, sql, params)
+                        rows = cur.fetchall()
+                        s.set(rows=len(rows))
+                    log_slow_query(cur, s, sql)
+            return [_to_result(r) for r in rows]
+        except Exception as e:
+            error = e
+            if attempt or not refresh_on_dimension_mismatch(e):
+                break
+        # The embedding came from the model before a re-embed cutover.
+        try:
+            user_emb = get_embedding(user_report.get("description", ""))
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return []
+    st.error(f"Search error: {error}")
+    return []
+
+
+def search_found_items_batch(reports: list, k: int = 5, embeddings: list = None, window_days: int = None) -> list:
+    """Search for many standardized lost reports at once; returns one result list per report.
+
+    All descriptions are embedded in one batched call and the k-NN for every
+    report runs in a single statement, so a triage queue costs one round
+    trip instead of one per report. Ranking follows the non-hybrid path:
+    tags are hard filters and rows are ordered by vector distance.
+    """
+    if not reports:
+        return []
+    if embeddings is None:
+        try:
+            embeddings = get_embeddings([r.get("description", "") for r in reports])
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return [[] for _ in reports]
+
+    for attempt in range(2):
+        rows = [_batch_row(i, report, emb) for i, (report, emb) in enumerate(zip(reports, embeddings))]
+        grouped = [[] for _ in reports]
+        try:
+            with get_pg_conn() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    sql, template = _batch_sql(k, active_vector_storage(cur), _window_days(window_days))
+                    apply_search_settings(cur, limit=k)
+                    with span("search.query", mode="batch", reports=len(rows)) as s:
+                        found = execute_values(cur, sql, rows, template=template, page_size=len(rows), fetch=True)
+                        s.set(rows=len(found))
+                    for r in found:
+                        grouped[r["ord"]].append(_to_result(r))
+                    log_slow_query(cur, s, sql)
+            return grouped
+        except Exception as e:
+            error = e
+            if attempt or not refresh_on_dimension_mismatch(e):
+                break
+        try:
+            embeddings = get_embeddings([r.get("description", "") for r in reports])
+        except Exception as e:
+            st.error(f"Embedding error: {e}")
+            return [[] for _ in reports]
+    st.error(f"Search error: {error}")
+    return [[] for _ in reports]
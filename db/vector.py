@@ -0,0 +1,98 @@
+"""NumPy <-> pgvector transport.
+
+Embeddings stay float32 ``np.ndarray`` end to end:
+
+* parameters: a registered psycopg2 adapter renders arrays as a compact
+  ``'[...]'::vector`` literal (lossless float32 text, about a third smaller
+  and twice as fast to build as ``map(str, list)``). psycopg2 only sends
+  text parameters, so binary transport is used where the protocol allows it:
+* bulk writes: binary COPY, see ``db.pgbinary.encode_vector``;
+* bulk reads: ``fetch_embeddings`` runs a binary ``COPY ... TO STDOUT`` and
+  returns the embedding matrix as a zero-copy view of the received buffer;
+* query results: select ``vector_send(col)``, which comes back as ``bytea``
+  that psycopg2 unescapes in C, and decode it with ``decode_vector``. A
+  per-connection typecaster still returns plain ``vector`` columns as float32
+  arrays, but it has to parse their text, which is no faster than json.loads.
+"""
+import io
+import struct
+
+import numpy as np
+from psycopg2 import extensions
+
+from db.pgbinary import COPY_SIGNATURE
+
+
+def format_vector(emb) -> str:
+    # float32 needs at most 9 significant digits to round-trip exactly.
+    return "[" + ",".join(map("{:.9g}".format, np.asarray(emb, dtype=np.float32).tolist())) + "]"
+
+
+def parse_vector(text: str) -> np.ndarray:
+    return np.fromstring(text[1:-1], dtype=np.float32, sep=",")
+
+
+def decode_vector(buf) -> np.ndarray:
+    """float32 array from a ``vector_send`` result (see db.pgbinary.encode_vector)."""
+    return np.frombuffer(buf, dtype=">f4", offset=4).astype(np.float32)
+
+
+class VectorAdapter:
+    """psycopg2 adapter rendering float ndarrays as pgvector literals."""
+
+    def __init__(self, arr: np.ndarray):
+        self.arr = arr
+
+    def getquoted(self) -> bytes:
+        return f"'{format_vector(self.arr)}'::vector".encode("ascii")
+
+
+def _adapt_ndarray(arr: np.ndarray):
+    if arr.dtype.kind == "f" and arr.ndim == 1:
+        return VectorAdapter(arr)
+    return extensions.adapt(arr.tolist())
+
+
+extensions.register_adapter(np.ndarray, _adapt_ndarray)
+
+
+def register_vector_typecaster(conn) -> bool:
+    """Return ``vector`` columns on ``conn`` as float32 arrays; False if pgvector is missing."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT oid FROM pg_type WHERE typname = 'vector'")
+        row = cur.fetchone()
+    if row is None:
+        return False
+    caster = extensions.new_type((row[0],), "VECTOR", lambda value, cur: None if value is None else parse_vector(value))
+    extensions.register_type(caster, conn)
+    return True
+
+
+def fetch_embeddings(cur, query: str, params=(), dim: int = 1536):
+    """Stream ``query`` (selecting ``id, embedding``) through binary COPY.
+
+    Returns ``(ids, embeddings)``: an int array and an ``(n, dim)`` big-endian
+    float32 matrix, both views over the received buffer. Rows with a NULL or
+    differently sized embedding must be filtered out by ``query``.
+    """
+    sql = cur.mogrify(query, params).decode("utf-8")
+    buf = io.BytesIO()
+    cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", buf)
+    data = buf.getbuffer()
+
+    header_ext = struct.unpack_from("!i", data, len(COPY_SIGNATURE) + 4)[0]
+    start = len(COPY_SIGNATURE) + 8 + header_ext
+    row_dtype = np.dtype([
+        ("nfields", ">i2"),
+        ("id_len", ">i4"),
+        ("id", ">i4"),
+        ("emb_len", ">i4"),
+        ("dim", ">u2"),
+        ("unused", ">u2"),
+        ("embedding", ">f4", (dim,)),
+    ])
+    n = (len(data) - start - 2) // row_dtype.itemsize
+    rows = np.frombuffer(data, dtype=row_dtype, count=n, offset=start)
+    if n and (rows["dim"] != dim).any():
+        raise ValueError(f"fetch_embeddings expected {dim}-dimensional vectors.")
+    return rows["id"], rows["embedding"]
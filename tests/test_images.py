@@ -0,0 +1,76 @@
+import os
+import random
+
+import pytest
+
+from db.search import _image_params
+from utils.images import PHASH_BANDS, PHASH_MAX_DISTANCE, phash_bands
+
+
+def flipped(value: int, bits) -> int:
+    """``value`` with the given bit positions inverted, as a signed BIGINT."""
+    unsigned = value & ((1 << 64) - 1)
+    for bit in bits:
+        unsigned ^= 1 << bit
+    return unsigned - (1 << 64) if unsigned >= 1 << 63 else unsigned
+
+
+def spread(distance: int) -> list:
+    """Bit positions spread over the bands as evenly as possible: the hardest case for the lookup."""
+    return [16 * (i % PHASH_BANDS) + i // PHASH_BANDS for i in range(distance)]
+
+
+def found(stored: int, photo: int) -> bool:
+    return bool(set(phash_bands(stored)) & set(phash_bands(photo, radius=1)))
+
+
+def test_bands_match_the_sql_layout():
+    assert phash_bands(0) == [0, 65536, 131072, 196608]
+    # SELECT phash_bands(-1::bigint)
+    assert phash_bands(-1) == [65535, 131071, 196607, 262143]
+
+
+def test_every_hash_up_to_the_max_distance_is_found():
+    rng = random.Random(0)
+    stored = flipped(0, rng.sample(range(64), 32))
+    for distance in range(PHASH_MAX_DISTANCE + 1):
+        assert found(stored, flipped(stored, spread(distance))), distance
+        for _ in range(200):
+            assert found(stored, flipped(stored, rng.sample(range(64), distance))), distance
+
+
+def test_lookup_guarantee_ends_at_the_max_distance():
+    stored = 0x0123456789ABCDEF
+    assert PHASH_MAX_DISTANCE == 7
+    assert not found(stored, flipped(stored, spread(PHASH_MAX_DISTANCE + 1)))
+
+
+def test_search_distances_are_clamped_to_the_guarantee(monkeypatch):
+    monkeypatch.setenv("SEARCH_IMAGE_MAX_HAMMING", "12")
+    monkeypatch.setenv("SEARCH_IMAGE_NEAR_DUPLICATE", "9")
+    params = _image_params(5)
+    assert params["max_hamming"] == PHASH_MAX_DISTANCE
+    assert params["near_duplicate"] == PHASH_MAX_DISTANCE
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_PG_CONNECTION_STRING"), reason="needs TEST_PG_CONNECTION_STRING")
+def test_bands_agree_with_the_sql_function():
+    import psycopg2
+
+    from db.postgres import PHASH_BANDS_FUNCTION
+
+    rng = random.Random(0)
+    values = [0, -1, 1, -(1 << 63), (1 << 63) - 1] + [rng.getrandbits(64) - (1 << 63) for _ in range(500)]
+    conn = psycopg2.connect(os.environ["TEST_PG_CONNECTION_STRING"])
+    try:
+        with conn.cursor() as cur:
+            # Rolled back below, so a database that already has the function keeps it.
+            cur.execute(PHASH_BANDS_FUNCTION)
+            cur.execute("SELECT h, phash_bands(h) FROM unnest(%s::bigint[]) h", (values,))
+            rows = cur.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+    assert len(rows) == len(values)
+    for value, bands in rows:
+        assert bands == phash_bands(value), value
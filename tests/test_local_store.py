@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+
+from db.local_store import LocalVectorStore
+
+DIM = 4
+
+
+def item(description: str, category: str, color=(), item_type=()) -> dict:
+    return {
+        "description": description,
+        "item_category": category,
+        "color": list(color),
+        "item_type": list(item_type),
+        "subway_location": [],
+    }
+
+
+def axis(i: int) -> np.ndarray:
+    return np.eye(DIM, dtype=np.float32)[i]
+
+
+def filled_store(path) -> LocalVectorStore:
+    store = LocalVectorStore(path, DIM)
+    store.append_many(
+        [
+            item("red wallet", "Bags", ["Red"], ["Wallet"]),
+            item("blue umbrella", "Umbrellas", ["Blue"]),
+            {**item("blue wallet", "Bags", ["Blue"], ["Wallet"]), "id": 42},
+        ],
+        [axis(0), axis(1), axis(2)],
+    )
+    return store
+
+
+def test_search_ranks_by_similarity(tmp_path):
+    store = filled_store(tmp_path)
+    results = store.search({}, axis(1), k=2)
+    assert [r["description"] for r in results] == ["blue umbrella", "red wallet"]
+    assert results[0]["similarity"] == 1.0
+    assert results[0]["distance"] == 0.0
+
+
+def test_local_rows_get_negative_ids(tmp_path):
+    store = filled_store(tmp_path)
+    assert sorted(r["id"] for r in store.search({}, axis(0), k=3)) == [-2, -1, 42]
+
+
+def test_tags_filter_the_candidates(tmp_path):
+    store = filled_store(tmp_path)
+    results = store.search({"item_category": "Bags", "color": ["Blue"]}, axis(0), k=5)
+    assert [r["id"] for r in results] == [42]
+    assert store.search({"item_type": ["Keys"]}, axis(0), k=5) == []
+
+
+def test_reopened_store_finds_the_same_rows(tmp_path):
+    store = filled_store(tmp_path)
+    report = {"item_type": ["Wallet"]}
+    expected = store.search(report, axis(2), k=5)
+    reopened = LocalVectorStore(tmp_path, DIM)
+    assert reopened.count == 3
+    assert reopened.search(report, axis(2), k=5) == expected
+
+
+def test_rows_appended_elsewhere_show_up_on_search(tmp_path):
+    reader = filled_store(tmp_path)
+    LocalVectorStore(tmp_path, DIM).append_many([item("green scarf", "Clothing", ["Green"])], [axis(3)])
+    assert reader.search({"color": ["Green"]}, axis(3), k=1)[0]["description"] == "green scarf"
+
+
+def test_uncommitted_rows_are_ignored(tmp_path):
+    filled_store(tmp_path)
+    meta = json.loads((tmp_path / "meta.json").read_text())
+    # An append that wrote its row but died before publishing meta.json.
+    with open(tmp_path / "rows.jsonl", "a") as f:
+        f.write(json.dumps({"id": -99, "description": "torn"}) + "\n")
+    store = LocalVectorStore(tmp_path, DIM)
+    assert store.count == meta["count"]
+    store.append_many([item("black phone", "Electronics")], [axis(3)])
+    assert all(r["description"] != "torn" for r in store.search({}, axis(3), k=10))
+    assert len((tmp_path / "rows.jsonl").read_text().splitlines()) == 4
+
+
+def test_store_without_columns_is_indexed_on_open(tmp_path):
+    filled_store(tmp_path)
+    meta = json.loads((tmp_path / "meta.json").read_text())
+    for key in ("rows_bytes", "tag_counts"):
+        del meta[key]
+    (tmp_path / "meta.json").write_text(json.dumps(meta))
+    for column in tmp_path.glob("*.npy"):
+        column.unlink()
+
+    store = LocalVectorStore(tmp_path, DIM)
+    assert [r["id"] for r in store.search({"item_type": ["Wallet"]}, axis(0), k=5)] == [-1, 42]
+    assert (tmp_path / "item_category.npy").exists()
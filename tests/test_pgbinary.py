@@ -0,0 +1,55 @@
+import struct
+
+from db.pgbinary import (
+    COPY_SIGNATURE,
+    BinaryCopyWriter,
+    encode_int8,
+    encode_text,
+    encode_text_array,
+    encode_vector,
+)
+
+
+def test_text_is_utf8():
+    assert encode_text("Café") == b"Caf\xc3\xa9"
+    assert encode_text(42) == b"42"
+
+
+def test_int8_is_big_endian_twos_complement():
+    assert encode_int8(1) == b"\x00\x00\x00\x00\x00\x00\x00\x01"
+    assert encode_int8(-2) == b"\xff\xff\xff\xff\xff\xff\xff\xfe"
+
+
+def test_empty_text_array_has_no_dimensions():
+    # ndim 0, no null bitmap, element type text (oid 25)
+    assert encode_text_array([]) == b"\x00\x00\x00\x00" b"\x00\x00\x00\x00" b"\x00\x00\x00\x19"
+
+
+def test_text_array_layout():
+    assert encode_text_array(["a", "bc"]) == (
+        b"\x00\x00\x00\x01"  # ndim
+        b"\x00\x00\x00\x00"  # no nulls
+        b"\x00\x00\x00\x19"  # text
+        b"\x00\x00\x00\x02"  # length of dimension 1
+        b"\x00\x00\x00\x01"  # lower bound
+        b"\x00\x00\x00\x01a"
+        b"\x00\x00\x00\x02bc"
+    )
+
+
+def test_vector_matches_vector_send():
+    # SELECT vector_send('[1,2.5]'::vector)
+    assert encode_vector([1.0, 2.5]) == b"\x00\x02\x00\x00\x3f\x80\x00\x00\x40\x20\x00\x00"
+
+
+def test_copy_stream_layout():
+    writer = BinaryCopyWriter([encode_text, encode_int8])
+    writer.write_row(["x", 7])
+    writer.write_row([None, 1])
+    data = writer.getbuffer().read()
+
+    header = COPY_SIGNATURE + struct.pack("!ii", 0, 0)
+    first = struct.pack("!h", 2) + struct.pack("!i", 1) + b"x" + struct.pack("!i", 8) + encode_int8(7)
+    second = struct.pack("!h", 2) + struct.pack("!i", -1) + struct.pack("!i", 8) + encode_int8(1)
+    assert data == header + first + second + struct.pack("!h", -1)
+    assert writer.rows == 2
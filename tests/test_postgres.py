@@ -0,0 +1,68 @@
+import hashlib
+from types import SimpleNamespace
+
+from db.postgres import _numbered_placeholders, execute_prepared
+
+
+class Cursor:
+    """Records statements instead of sending them."""
+
+    def __init__(self, prepared=None):
+        self.connection = SimpleNamespace(prepared=prepared)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+def statement_name(sql: str) -> str:
+    return "stmt_" + hashlib.md5(sql.encode("utf-8")).hexdigest()[:16]
+
+
+def test_positional_placeholders_are_numbered_in_order():
+    assert _numbered_placeholders("SELECT %s, %s") == ("SELECT $1, $2", [None, None])
+
+
+def test_repeated_named_placeholder_maps_to_one_parameter():
+    sql, names = _numbered_placeholders("SELECT %(emb)s <-> e, %(k)s, %(emb)s")
+    assert sql == "SELECT $1 <-> e, $2, $1"
+    assert names == ["emb", "k"]
+
+
+def test_escaped_percent_is_unescaped():
+    assert _numbered_placeholders("SELECT 'a%%' LIKE x, %s") == ("SELECT 'a%' LIKE x, $1", [None])
+
+
+def test_statement_is_prepared_once_per_connection():
+    cur = Cursor(prepared=set())
+    sql = "SELECT id FROM found_items WHERE id = %s"
+    execute_prepared(cur, sql, (1,))
+    execute_prepared(cur, sql, (2,))
+    name = statement_name(sql)
+    assert cur.executed == [
+        (f"PREPARE {name} AS SELECT id FROM found_items WHERE id = $1", None),
+        (f"EXECUTE {name} (%s)", [1]),
+        (f"EXECUTE {name} (%s)", [2]),
+    ]
+    assert cur.connection.prepared == {name}
+
+
+def test_statement_names_follow_the_sql_text():
+    cur = Cursor(prepared=set())
+    execute_prepared(cur, "SELECT 1")
+    execute_prepared(cur, "SELECT 2")
+    assert cur.connection.prepared == {statement_name("SELECT 1"), statement_name("SELECT 2")}
+    assert cur.executed[1] == (f"EXECUTE {statement_name('SELECT 1')}", None)
+
+
+def test_named_parameters_are_sent_once_in_placeholder_order():
+    cur = Cursor(prepared=set())
+    sql = "SELECT %(emb)s, %(k)s, %(emb)s"
+    execute_prepared(cur, sql, {"k": 5, "emb": "[1,2]", "unused": 0})
+    assert cur.executed[-1] == (f"EXECUTE {statement_name(sql)} (%s, %s)", ["[1,2]", 5])
+
+
+def test_connection_outside_the_pool_executes_directly():
+    cur = Cursor(prepared=None)
+    execute_prepared(cur, "SELECT %s", (1,))
+    assert cur.executed == [("SELECT %s", (1,))]
@@ -0,0 +1,215 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils.scheduler import CallScheduler, TokenBucket
+
+
+class Transient(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("429")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class Escaped(BaseException):
+    pass
+
+
+def classify(error):
+    if isinstance(error, RateLimited):
+        return "rate_limit"
+    if isinstance(error, Transient):
+        return "transient"
+    return None
+
+
+def make_scheduler(**kwargs) -> CallScheduler:
+    options = {"rate": 0, "burst": 1, "concurrency": 1, "classify": classify, "backoff": 0.01}
+    options.update(kwargs)
+    return CallScheduler("test", **options)
+
+
+def block(scheduler: CallScheduler) -> threading.Event:
+    """Occupy the single worker until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit(hold, priority="operator")
+    assert started.wait(5)
+    return release
+
+
+# ---------------------
+# QUEUEING
+# ---------------------
+def test_runs_calls_by_priority_then_arrival():
+    scheduler = make_scheduler()
+    release = block(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(order.append, name, priority=priority)
+        for name, priority in [("bg", "background"), ("rider-1", "rider"), ("op", "operator"), ("rider-2", "rider")]
+    ]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["op", "rider-1", "rider-2", "bg"]
+
+
+def test_same_key_shares_one_call():
+    scheduler = make_scheduler()
+    release = block(scheduler)
+    calls = []
+    first = scheduler.submit(lambda: calls.append(1) or "done", key="k")
+    second = scheduler.submit(lambda: calls.append(2) or "other", key="k")
+    release.set()
+    assert first is second
+    assert first.result(5) == "done"
+    assert calls == [1]
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_coalesced_call_raises_queued_priority():
+    scheduler = make_scheduler()
+    release = block(scheduler)
+    order = []
+    low = scheduler.submit(order.append, "shared", priority="background", key="k")
+    rider = scheduler.submit(order.append, "rider", priority="rider")
+    scheduler.submit(order.append, "ignored", priority="operator", key="k")
+    release.set()
+    low.result(5)
+    rider.result(5)
+    assert order == ["shared", "rider"]
+
+
+def test_key_is_released_after_the_call():
+    scheduler = make_scheduler()
+    assert scheduler.call(lambda: 1, key="k", timeout=5) == 1
+    assert scheduler.call(lambda: 2, key="k", timeout=5) == 2
+
+
+# ---------------------
+# RETRIES
+# ---------------------
+def test_retries_transient_errors():
+    scheduler = make_scheduler()
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Transient()
+        return "ok"
+
+    assert scheduler.call(flaky, timeout=5) == "ok"
+    stats = scheduler.stats()
+    assert stats["retries"] == 2
+    assert (stats["completed"], stats["failed"], stats["queued"], stats["running"]) == (1, 0, 0, 0)
+
+
+def test_gives_up_after_max_retries():
+    scheduler = make_scheduler(max_retries=2)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise Transient()
+
+    with pytest.raises(Transient):
+        scheduler.call(broken, timeout=5)
+    assert len(attempts) == 3
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_does_not_retry_unclassified_errors():
+    scheduler = make_scheduler()
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(broken, key="k", timeout=5)
+    assert attempts == [1]
+    assert scheduler.stats()["retries"] == 0
+    assert scheduler.call(lambda: "again", key="k", timeout=5) == "again"
+
+
+def test_rate_limit_pauses_every_queued_call():
+    scheduler = make_scheduler(rate=100, burst=1, concurrency=2)
+    attempts = []
+
+    def limited():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited(0.3)
+        return "ok"
+
+    start = time.monotonic()
+    future = scheduler.submit(limited)
+    while not attempts:
+        time.sleep(0.005)
+    time.sleep(0.05)
+    other = scheduler.submit(time.monotonic)
+    assert future.result(5) == "ok"
+    assert attempts[1] - start >= 0.3
+    assert other.result(5) - start >= 0.3
+    assert scheduler.stats()["rate_limited"] == 1
+
+
+# ---------------------
+# THROTTLING
+# ---------------------
+def test_token_bucket_limits_rate_after_burst():
+    bucket = TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Two calls from the burst, then four at 20 per second.
+    assert time.monotonic() - start >= 0.18
+
+
+def test_token_bucket_pause_withholds_tokens():
+    bucket = TokenBucket(rate=1000, burst=5)
+    bucket.pause(0.2)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.19
+
+
+def test_scheduler_spaces_calls_at_rate():
+    scheduler = make_scheduler(rate=20, burst=1, concurrency=4)
+    start = time.monotonic()
+    times = [f.result(5) for f in [scheduler.submit(time.monotonic) for _ in range(5)]]
+    assert max(times) - start >= 0.18
+
+
+# ---------------------
+# FAILURES
+# ---------------------
+def test_base_exception_reaches_waiters_and_keeps_worker():
+    scheduler = make_scheduler()
+    release = block(scheduler)
+
+    def escape():
+        raise Escaped()
+
+    first = scheduler.submit(escape, key="k")
+    second = scheduler.submit(escape, key="k")
+    release.set()
+    for future in (first, second):
+        with pytest.raises(Escaped):
+            future.result(5)
+    assert scheduler.call(lambda: "alive", key="k", timeout=5) == "alive"
+    stats = scheduler.stats()
+    assert (stats["running"], stats["queued"], stats["failed"]) == (0, 0, 1)
@@ -0,0 +1,52 @@
+from utils.tags import TagIndex, normalize_tag_text
+
+VOCABULARIES = {
+    "subway_location": ["Times Square", "14 St - Union Square", "Fulton St", "N", "Q", "R"],
+    "color": ["Gray", "Navy Blue", "Red"],
+    "item_category": ["Bags & Accessories", "Electronics"],
+    "item_type": ["Backpack", "Umbrella", "iPhone"],
+}
+
+
+def test_normalization_canonicalizes_tokens():
+    assert normalize_tag_text("14th Street & 3rd Avenue") == ("14", "st", "and", "3", "av")
+    assert normalize_tag_text("the Times Sq station", "subway_location") == ("times", "sq")
+
+
+def test_spelling_variants_map_exactly():
+    index = TagIndex(VOCABULARIES)
+    assert index.match("color", "grey") == ("Gray", 1.0)
+    assert index.match("color", "dark navy blue") == ("Navy Blue", 1.0)
+    assert index.match("subway_location", "Fulton Street") == ("Fulton St", 1.0)
+    assert index.match("item_category", "bags and accessories") == ("Bags & Accessories", 1.0)
+
+
+def test_aliases_apply_when_their_target_is_loaded():
+    index = TagIndex(VOCABULARIES)
+    assert index.match("subway_location", "Union sq") == ("14 St - Union Square", 1.0)
+    assert TagIndex(VOCABULARIES, aliases={}).match("subway_location", "Union sq")[1] < 1.0
+
+
+def test_typos_and_extra_words_match_fuzzily():
+    index = TagIndex(VOCABULARIES)
+    for field, value, tag in [("item_type", "umbrela", "Umbrella"), ("item_type", "black backpack", "Backpack")]:
+        match, confidence = index.match(field, value)
+        assert match == tag
+        assert 0.75 <= confidence < 1.0
+
+
+def test_unknown_value_has_no_tag():
+    assert TagIndex(VOCABULARIES).match("item_type", "zebra") == (None, 0.0)
+
+
+def test_list_values_are_split_into_tags():
+    index = TagIndex(VOCABULARIES)
+    assert index.match_many("subway_location", ["Times Sq (N, Q, R)"], 0.75) == (["Times Square", "N", "Q", "R"], 1.0, [])
+    assert index.match_many("color", "grey / red", 0.75) == (["Gray", "Red"], 1.0, [])
+
+
+def test_unresolved_parts_are_reported():
+    tags, confidence, unresolved = TagIndex(VOCABULARIES).match_many("item_type", ["zebra", "null", "", "iPhone"], 0.75)
+    assert tags == ["iPhone"]
+    assert confidence == 1.0
+    assert unresolved == ["zebra"]
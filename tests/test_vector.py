@@ -0,0 +1,58 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from db.pgbinary import COPY_SIGNATURE, encode_vector
+from db.vector import VectorAdapter, decode_vector, fetch_embeddings, format_vector, parse_vector
+
+
+class CopyCursor:
+    """Serves a prepared binary COPY stream to fetch_embeddings."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def mogrify(self, query, params):
+        return query.encode("utf-8")
+
+    def copy_expert(self, sql, buf):
+        buf.write(self.data)
+
+
+def copy_stream(rows) -> bytes:
+    out = io.BytesIO()
+    out.write(COPY_SIGNATURE + struct.pack("!ii", 0, 0))
+    for item_id, emb in rows:
+        vector = encode_vector(emb)
+        out.write(struct.pack("!hii", 2, 4, item_id) + struct.pack("!i", len(vector)) + vector)
+    out.write(struct.pack("!h", -1))
+    return out.getvalue()
+
+
+def test_text_literal_round_trips_float32_exactly():
+    arr = np.random.default_rng(0).normal(size=64).astype(np.float32)
+    assert np.array_equal(parse_vector(format_vector(arr)), arr)
+
+
+def test_adapter_renders_a_vector_literal():
+    assert VectorAdapter(np.array([1.0, 0.5], dtype=np.float32)).getquoted() == b"'[1,0.5]'::vector"
+
+
+def test_decode_vector_reads_vector_send_output():
+    decoded = decode_vector(b"\x00\x02\x00\x00\x3f\x80\x00\x00\x40\x20\x00\x00")
+    assert decoded.dtype == np.float32
+    assert decoded.tolist() == [1.0, 2.5]
+
+
+def test_fetch_embeddings_views_the_copy_buffer():
+    embs = np.arange(6, dtype=np.float32).reshape(2, 3)
+    ids, got = fetch_embeddings(CopyCursor(copy_stream([(7, embs[0]), (9, embs[1])])), "SELECT id, embedding", dim=3)
+    assert ids.tolist() == [7, 9]
+    assert np.array_equal(got, embs)
+
+
+def test_fetch_embeddings_rejects_other_dimensions():
+    with pytest.raises(ValueError, match="expected 3-dimensional"):
+        fetch_embeddings(CopyCursor(copy_stream([(1, [1.0, 2.0, 3.0, 4.0])])), "SELECT id, embedding", dim=3)
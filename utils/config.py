@@ -0,0 +1,17 @@
+import os
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    """Read a setting from Streamlit secrets, falling back to the environment.
+
+    The environment fallback lets the command-line tools run outside of
+    ``streamlit run`` with the same configuration keys.
+    """
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.environ.get(name, default)
+    return value
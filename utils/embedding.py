@@ -1,18 +1,580 @@
+import base64
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import streamlit as st
-import openai
+
+from db.vector import format_vector
+from utils.config import get_setting
+from utils.metrics import bind, registry, span
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 
 
-def get_openai_embedding(text: str) -> list:
-    key = st.secrets.get("OPENAI_API_KEY")
+# ---------------------
+# CACHE
+# ---------------------
+class EmbeddingCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, emb = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                _count("expired")
+                return None
+            self._entries.move_to_end(key)
+            return emb
+
+    def put(self, key, emb):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), emb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                _count("evicted")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_memory_cache = EmbeddingCache(
+    max_entries=int(get_setting("EMBEDDING_CACHE_SIZE", 2048)),
+    ttl=float(get_setting("EMBEDDING_CACHE_TTL", 24 * 3600)),
+)
+_stats = {
+    "memory_hits": 0,
+    "persistent_hits": 0,
+    "misses": 0,
+    "evicted": 0,
+    "expired": 0,
+    "persistent_errors": 0,
+    "requests": 0,
+    "retries": 0,
+    "coalesced": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def embedding_cache_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Content address of ``text`` for ``model``; callers pass normalized text."""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def get_embedding_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+    stats["memory_entries"] = len(_memory_cache)
+    return stats
+
+
+registry.register_gauges("embedding_cache", get_embedding_cache_stats)
+
+
+def _persistent_enabled() -> bool:
+    return bool(get_setting("PG_CONNECTION_STRING")) and str(get_setting("EMBEDDING_CACHE_PERSIST", "true")).lower() == "true"
+
+
+def _load_persistent(keys: list, model: str) -> dict:
+    # The shared table is best-effort: a failure here only costs an API call.
+    from db.postgres import get_pg_conn
+    from db.vector import decode_vector
+
+    try:
+        with get_pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT text_hash, vector_send(embedding) FROM embedding_cache WHERE model = %s AND text_hash = ANY(%s)",
+                    (model, list(keys)),
+                )
+                rows = cur.fetchall()
+        return {key: decode_vector(buf) for key, buf in rows}
+    except Exception:
+        _count("persistent_errors")
+        return {}
+
+
+def _store_persistent(items: dict, model: str):
+    from db.postgres import get_pg_conn
+    from psycopg2.extras import execute_values
+
+    try:
+        with get_pg_conn() as conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO embedding_cache (model, text_hash, embedding) VALUES %s
+                    ON CONFLICT (model, text_hash) DO NOTHING
+                    """,
+                    [(model, key, emb) for key, emb in items.items()],
+                    template="(%s, %s, %s)",
+                )
+    except Exception:
+        _count("persistent_errors")
+
+
+# ---------------------
+# PROVIDERS
+# ---------------------
+# Limits of the OpenAI embeddings endpoint. Token counts are estimated from
+# length, erring on the side of smaller requests.
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+MAX_TOKENS_PER_INPUT = 8191
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+
+class EmbeddingProvider:
+    """An embedding model; ``embed`` returns one unit-length float32 vector per text.
+
+    ``model_id`` names the model together with its output size. It keys both
+    caches and tags the rows written to Postgres, so vectors of different
+    models are never compared.
+    """
+
+    name = ""
+    native_dims = None
+    max_inputs = MAX_INPUTS_PER_REQUEST
+    max_tokens = MAX_TOKENS_PER_REQUEST
+    max_concurrency = 1
+    persist_cache = False
+
+    def __init__(self, model: str, dims: int):
+        self.model = model
+        self.dims = int(dims)
+
+    @property
+    def model_id(self) -> str:
+        if self.dims == self.native_dims:
+            return self.model
+        return f"{self.name}/{self.model}@{self.dims}"
+
+    def spec(self) -> dict:
+        return {"provider": self.name, "model": self.model, "dims": self.dims}
+
+    def embed(self, texts: list) -> list:
+        raise NotImplementedError
+
+
+def _normalized(vectors: np.ndarray) -> list:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return list((vectors / norms).astype(np.float32))
+
+
+def _retryable_errors() -> tuple:
+    import openai
+
+    return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+@st.cache_resource
+def get_openai_client():
+    # Imported here: the SDK is only needed once something is actually embedded.
+    import openai
+
+    key = get_setting("OPENAI_API_KEY")
     if not key:
         raise RuntimeError("OPENAI_API_KEY not set in Streamlit secrets.")
-    openai.api_key = key
-    resp = openai.Embeddings.create(model=EMBEDDING_MODEL, input=text or "")
-    return resp["data"][0]["embedding"]
+    # Retries are handled here so that backoff is shared across a batch.
+    return openai.OpenAI(api_key=key, max_retries=0)
+
+
+def _retry_delay(attempt: int, error) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class OpenAIEmbeddings(EmbeddingProvider):
+    """The OpenAI embeddings endpoint; text-embedding-3 models can return fewer dimensions."""
+
+    name = "openai"
+    NATIVE_DIMS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
+    persist_cache = True
+
+    def __init__(self, model: str = None, dims: int = None):
+        model = model or EMBEDDING_MODEL
+        self.native_dims = self.NATIVE_DIMS.get(model)
+        if not (dims or self.native_dims):
+            raise RuntimeError(f"Set EMBEDDING_DIMS for the OpenAI model {model!r}.")
+        super().__init__(model, dims or self.native_dims)
+        self.max_concurrency = int(get_setting("EMBEDDING_MAX_CONCURRENCY", 4))
+
+    def embed(self, texts: list) -> list:
+        max_retries = int(get_setting("EMBEDDING_MAX_RETRIES", 5))
+        retryable = _retryable_errors()
+        # Only text-embedding-3 models accept ``dimensions``; they shorten and renormalize server-side.
+        extra = {"dimensions": self.dims} if self.dims != self.native_dims else {}
+        with span("openai.embeddings", rows=len(texts), retries=0) as s:
+            for attempt in range(max_retries + 1):
+                try:
+                    resp = get_openai_client().embeddings.create(
+                        model=self.model, input=[t or " " for t in texts], encoding_format="base64", **extra
+                    )
+                    # base64 carries the raw little-endian float32s, skipping JSON float parsing.
+                    return [
+                        np.frombuffer(base64.b64decode(d.embedding), dtype="<f4")
+                        for d in sorted(resp.data, key=lambda d: d.index)
+                    ]
+                except retryable as e:
+                    if attempt == max_retries:
+                        raise
+                    _count("retries")
+                    s.set(retries=attempt + 1)
+                    time.sleep(_retry_delay(attempt, e))
+
 
+class OnnxEmbeddings(EmbeddingProvider):
+    """A sentence-embedding model exported to ONNX, run on the CPU.
 
-def embedding_to_pgvector_literal(emb: list) -> str:
+    EMBEDDING_ONNX_PATH is a directory holding the exported model and its
+    ``tokenizer.json`` (e.g. all-MiniLM-L6-v2 or bge-small-en-v1.5, 384
+    dims); EMBEDDING_ONNX_FILE picks a quantized export such as
+    ``model_quantized.onnx``. Token vectors are mean-pooled over the
+    attention mask. A ``dims`` below the model's width keeps the leading
+    dimensions, which only suits Matryoshka-trained models.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model: str = None, dims: int = None):
+        self.path = Path(get_setting("EMBEDDING_ONNX_PATH", "models/embedding"))
+        super().__init__(model or self.path.name, dims or 384)
+        self.max_inputs = int(get_setting("EMBEDDING_ONNX_BATCH", 32))
+        self.max_tokens = self.max_inputs * int(get_setting("EMBEDDING_ONNX_MAX_TOKENS", 256))
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Imported here: onnxruntime and tokenizers are only needed by CPU deployments.
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with self._lock:
+            if self._session is None:
+                tokenizer = Tokenizer.from_file(str(self.path / "tokenizer.json"))
+                tokenizer.enable_truncation(max_length=int(get_setting("EMBEDDING_ONNX_MAX_TOKENS", 256)))
+                tokenizer.enable_padding()
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = int(get_setting("EMBEDDING_ONNX_THREADS", 0))
+                session = onnxruntime.InferenceSession(
+                    str(self.path / get_setting("EMBEDDING_ONNX_FILE", "model.onnx")), options, providers=["CPUExecutionProvider"]
+                )
+                self._inputs = {i.name for i in session.get_inputs()}
+                self._tokenizer, self._session = tokenizer, session
+        return self._tokenizer, self._session
+
+    def embed(self, texts: list) -> list:
+        tokenizer, session = self._load()
+        encodings = tokenizer.encode_batch([t or " " for t in texts])
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        with span("onnx.embeddings", rows=len(texts)):
+            output = session.run(None, {k: v for k, v in feeds.items() if k in self._inputs})[0]
+        if output.ndim == 3:
+            weights = mask[:, :, None].astype(np.float32)
+            output = (output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        if output.shape[1] < self.dims:
+            raise RuntimeError(f"{self.model} returns {output.shape[1]} dimensions, fewer than EMBEDDING_DIMS={self.dims}.")
+        return _normalized(output[:, : self.dims])
+
+
+class HashingEmbeddings(EmbeddingProvider):
+    """Feature hashing of words and character n-grams; no model files, no network.
+
+    Texts sharing words or word pieces land close together, so it still
+    ranks by surface overlap, which is enough for offline kiosks, tests and
+    benchmarks but well below a trained model. Model ``words`` hashes
+    whole words only; ``ngramN`` adds character N-grams (default ngram3).
+    """
+
+    name = "hashing"
+    _WORD = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, model: str = None, dims: int = None):
+        super().__init__(model or "ngram3", dims or 384)
+        if self.model != "words" and not re.fullmatch(r"ngram[1-9]", self.model):
+            raise RuntimeError(f"Unknown hashing model {self.model!r}; use 'words' or 'ngram1'..'ngram9'.")
+        self.ngram = 0 if self.model == "words" else int(self.model[5:])
+        self._slots = {}
+
+    def _slot(self, feature: str) -> tuple:
+        slot = self._slots.get(feature)
+        if slot is None:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            slot = self._slots[feature] = (h % self.dims, 1.0 if (h >> 63) & 1 else -1.0)
+        return slot
+
+    def _features(self, text: str):
+        for word in self._WORD.findall((text or "").lower()):
+            yield word
+            if self.ngram:
+                padded = f"<{word}>"
+                for i in range(len(padded) - self.ngram + 1):
+                    yield "#" + padded[i : i + self.ngram]
+
+    def embed(self, texts: list) -> list:
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                index, sign = self._slot(feature)
+                vectors[row, index] += sign
+        vectors[~vectors.any(axis=1), 0] = 1.0
+        return _normalized(vectors)
+
+
+EMBEDDING_PROVIDERS = {"openai": OpenAIEmbeddings, "onnx": OnnxEmbeddings, "hashing": HashingEmbeddings}
+
+
+def make_embedding_provider(provider: str = None, model: str = None, dims: int = None) -> EmbeddingProvider:
+    """Provider from arguments, falling back to EMBEDDING_PROVIDER, EMBEDDING_MODEL and EMBEDDING_DIMS."""
+    name = str(provider or get_setting("EMBEDDING_PROVIDER", "openai")).lower()
+    if name not in EMBEDDING_PROVIDERS:
+        raise RuntimeError(f"Unsupported EMBEDDING_PROVIDER {name!r}; use one of {sorted(EMBEDDING_PROVIDERS)}.")
+    if provider is None:
+        model = model or get_setting("EMBEDDING_MODEL") or None
+        dims = dims or int(get_setting("EMBEDDING_DIMS", 0) or 0) or None
+    return EMBEDDING_PROVIDERS[name](model, dims)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+_provider_override = None
+_state_failed_at = None
+
+
+def provider_for(spec: dict) -> EmbeddingProvider:
+    """Shared provider instance for a ``{provider, model, dims}`` spec (None: the settings), created once per process."""
+    key = (spec["provider"], spec["model"], spec["dims"]) if spec else None
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = make_embedding_provider(**spec) if spec else make_embedding_provider()
+    return provider
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """The provider new embeddings should come from.
+
+    With the Postgres backend this follows the model recorded in
+    embedding_state (see db.reembed), so every process switches models at a
+    re-embed cutover without a restart; the EMBEDDING_* settings only seed a
+    new database and configure the local backend. A failed lookup is not
+    retried for EMBEDDING_STATE_TTL seconds, so an unreachable database does
+    not cost a connect timeout per embedding.
+    """
+    global _state_failed_at
+    if _provider_override is not None:
+        return _provider_override
+    spec = None
+    if get_setting("PG_CONNECTION_STRING"):
+        from db.backend import get_backend
+        from db.postgres import active_embedding
+
+        failed_at = _state_failed_at
+        retry = failed_at is None or time.monotonic() - failed_at >= float(get_setting("EMBEDDING_STATE_TTL", 10))
+        if get_backend() == "postgres" and retry:
+            try:
+                spec = active_embedding()
+                _state_failed_at = None
+            except Exception:
+                _state_failed_at = time.monotonic()  # unreachable or not initialized yet
+    return provider_for(spec)
+
+
+def set_embedding_provider(provider: EmbeddingProvider = None):
+    """Use ``provider`` for every embedding in this process; None goes back to get_embedding_provider's choice."""
+    global _provider_override
+    _provider_override = provider
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN_ESTIMATE + 1
+
+
+def _pack_batches(texts: list, max_inputs: int = MAX_INPUTS_PER_REQUEST, max_tokens: int = MAX_TOKENS_PER_REQUEST) -> list:
+    """Group texts into requests that stay under the input and token limits."""
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = _estimate_tokens(text)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+# ---------------------
+# EMBEDDINGS
+# ---------------------
+def get_embeddings(texts: list, provider: EmbeddingProvider = None) -> list:
+    """Embed many texts with as few model calls as possible, preserving order.
+
+    Cached texts are served from memory or, for API providers, Postgres; the
+    remaining distinct texts are packed into requests within the provider's
+    limits and sent with at most ``provider.max_concurrency`` in flight.
+    ``provider`` defaults to get_embedding_provider().
+    """
+    provider = provider or get_embedding_provider()
+    model = provider.model_id
+    with span("embedding.batch", rows=len(texts), provider=provider.name) as s:
+        normalized = [normalize_text(t)[: MAX_TOKENS_PER_INPUT * CHARS_PER_TOKEN_ESTIMATE] for t in texts]
+        keys = [embedding_cache_key(t, model) for t in normalized]
+        found = {}
+        for key in set(keys):
+            emb = _memory_cache.get(key)
+            if emb is not None:
+                found[key] = emb
+        _count("memory_hits", len(found))
+        s.set(cache_hits=len(found), misses=0)
+
+        persistent = provider.persist_cache and _persistent_enabled()
+        missing = {key: text for key, text in zip(keys, normalized) if key not in found}
+        if persistent and missing:
+            for key, emb in _load_persistent(list(missing), model).items():
+                found[key] = emb
+                _memory_cache.put(key, emb)
+                missing.pop(key)
+                _count("persistent_hits")
+            s.set(cache_hits=len(found))
+
+        if missing:
+            miss_keys = list(missing)
+            batches = _pack_batches([missing[k] for k in miss_keys], provider.max_inputs, provider.max_tokens)
+            workers = max(1, min(len(batches), provider.max_concurrency))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                embedded = [emb for batch in pool.map(bind(provider.embed), batches) for emb in batch]
+            fresh = dict(zip(miss_keys, embedded))
+            for key, emb in fresh.items():
+                found[key] = emb
+                _memory_cache.put(key, emb)
+            _count("misses", len(fresh))
+            _count("requests", len(batches))
+            s.set(misses=len(fresh), requests=len(batches))
+            if persistent:
+                _store_persistent(fresh, model)
+
+        return [found[key] for key in keys]
+
+
+class _EmbeddingBatcher:
+    """Coalesces concurrent single-text requests into shared batch calls.
+
+    Streamlit serves every session from a thread in the same process, so
+    requests arriving within ``window`` seconds of each other are flushed
+    together through get_embeddings.
+    """
+
+    def __init__(self, window: float, max_batch: int, max_flushes: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._flushes = ThreadPoolExecutor(max_workers=max_flushes, thread_name_prefix="embedding-flush")
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flushes.submit(self._flush, batch)
+
+    @staticmethod
+    def _flush(batch: list):
+        if len(batch) > 1:
+            _count("coalesced", len(batch) - 1)
+        try:
+            embs = get_embeddings([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), emb in zip(batch, embs):
+            future.set_result(emb)
+
+
+_batcher = _EmbeddingBatcher(
+    window=float(get_setting("EMBEDDING_BATCH_WINDOW_MS", 10)) / 1000.0,
+    max_batch=int(get_setting("EMBEDDING_BATCH_MAX", 256)),
+    max_flushes=int(get_setting("EMBEDDING_MAX_CONCURRENCY", 4)),
+)
+
+
+def get_embedding(text: str) -> np.ndarray:
+    """Embed a single text, sharing a model call with concurrent callers."""
+    with span("embedding", cache_hits=1) as s:
+        emb = _memory_cache.get(embedding_cache_key(normalize_text(text), get_embedding_provider().model_id))
+        if emb is not None:
+            _count("memory_hits")
+            return emb
+        s.set(cache_hits=0)
+        if _batcher.window <= 0:
+            return get_embeddings([text])[0]
+        return _batcher.submit(text).result()
+
+
+def embedding_to_pgvector_literal(emb) -> str:
     # return string literal like '[0.1,0.2,...]'
-    return "[" + ",".join(map(str, emb)) + "]"
+    return format_vector(emb)
+
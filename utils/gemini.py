@@ -1,10 +1,18 @@
 # utils/gemini.py
+import contextvars
+import hashlib
 import os
 import json
 import re
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from google import genai
-from google.genai import types
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.metrics import registry, span
+from utils.scheduler import CallScheduler
+from utils.tags import LIST_FIELDS, TAG_FIELDS, get_tag_index
 
 # ---------------------
 # PROMPTS
@@ -24,14 +32,14 @@ The user will upload a picture of the item. Begin by thoroughly analyzing the im
 
 If the user provides accompanying text, incorporate it only if it is factual and consistent with the image.
 
-After generating this detailed description, immediately output ONLY the structured record below:
-(no questions, no explanations, no reasoning)
+After generating this detailed description, immediately output ONLY the structured record,
+as a JSON object with these fields (no questions, no explanations, no reasoning):
 
-Subway Location: <station name or null>
-Color: <color or colors or null>
-Item Category: <category or null>
-Item Type: <type or null>
-Description: <concise factual summary>
+subway_location: <station names, or an empty list>
+color: <color or colors, or an empty list>
+item_category: <category or null>
+item_type: <type or types, or an empty list>
+description: <concise factual summary>
 
 Do not include anything outside the structured record.
 Do not ask any follow-up questions.
@@ -49,23 +57,21 @@ If an image is provided, describe visible traits such as color, material, type,
 If text is provided, restate and cleanly summarize it in factual language.
 Do not wait for confirmation before giving the first description.
 
-2. Clarification
-Ask targeted concise follow up questions to collect identifying details such as brand, condition,
-writing, contents, location (station), and time found.
+2. Details
+Keep identifying details the user gives such as brand, condition, writing, contents, location (station), and time.
 If the user provides a station name (for example “Times Sq”, “Queensboro Plaza”), try to identify the corresponding subway line or lines.
 If multiple lines serve the station, you can mention all of them. If the station name has four or more lines, record only the station name.
-If the station is unclear or unknown, set Subway Location to null.
-Stop asking questions once the description is clear and specific enough.
-Do not include questions or notes in the final output.
+If the station is unclear or unknown, leave Subway Location empty.
+There is no follow-up turn: do not ask questions, and do not include questions or notes in the output.
 
 3. Finalization
-When you have enough detail, output only this structured record:
+Output only the structured record, as a JSON object with these fields:
 
-Subway Location: <station or null>
-Color: <dominant or user provided colors or null>
-Item Category: <free text category such as Bags and Accessories, Electronics, Clothing or null>
-Item Type: <free text item type such as Backpack, Phone, Jacket or null>
-Description: <concise free text summary combining all verified details>
+subway_location: <stations, or an empty list>
+color: <dominant or user provided colors, or an empty list>
+item_category: <free text category such as Bags and Accessories, Electronics, Clothing or null>
+item_type: <free text item types such as Backpack, Phone, Jacket, or an empty list>
+description: <concise free text summary combining all verified details>
 """
 
 STANDARDIZER_PROMPT = """
@@ -118,30 +124,132 @@ If you cannot confidently match a value, use "null" or an empty array as appropr
 Do not output any explanation. Only output the JSON object.
 """
 
+# JSON schema of a structured record, enforced by Gemini's structured output
+# so replies always parse instead of needing another ask.
+RECORD_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "subway_location": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "color": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "item_category": {"type": "STRING", "nullable": True},
+        "item_type": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "description": {"type": "STRING"},
+    },
+    "required": ["subway_location", "color", "item_category", "item_type", "description"],
+    "propertyOrdering": ["subway_location", "color", "item_category", "item_type", "description"],
+}
+GEMINI_MODEL = "gemini-2.5-flash"
+
 # ---------------------
 # CLIENT
 # ---------------------
 def gemini_available() -> bool:
     return bool(os.environ.get("GOOGLE_API_KEY"))
 
-client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"))
+@st.cache_resource
+def get_client():
+    # Created on first use and shared by every session: genai.Client refuses
+    # to construct without a key, which would otherwise break every import
+    # of this module.
+    from google import genai
+
+    return genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"))
 
-def create_operator_chat():
-    return client.chats.create(
-        model="gemini-2.5-flash",
-        history=[
-            types.Content(role="system", parts=[types.Part.from_text(GENERATOR_SYSTEM_PROMPT)])
-        ],
+# ---------------------
+# SCHEDULING
+# ---------------------
+# Every call goes through one scheduler per process (utils/scheduler.py):
+# GEMINI_RPM requests per minute with bursts of GEMINI_BURST, at most
+# GEMINI_MAX_CONCURRENCY in flight, GEMINI_MAX_RETRIES retries of quota and
+# server errors. Processes do not share the budget; split the project quota
+# between the app and the intake workers.
+_RETRYABLE_STATUS = {408, 500, 502, 503, 504}
+_priority = contextvars.ContextVar("gemini_priority", default="background")
+
+def classify_error(error):
+    code = getattr(error, "code", None)
+    if code == 429:
+        return "rate_limit"
+    if code in _RETRYABLE_STATUS or isinstance(error, (ConnectionError, TimeoutError)):
+        return "transient"
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return "transient" if isinstance(error, httpx.TransportError) else None
+
+@st.cache_resource
+def get_scheduler() -> CallScheduler:
+    scheduler = CallScheduler(
+        "gemini",
+        rate=float(get_setting("GEMINI_RPM", 60)) / 60.0,
+        burst=float(get_setting("GEMINI_BURST", 5)),
+        concurrency=int(get_setting("GEMINI_MAX_CONCURRENCY", 4)),
+        max_retries=int(get_setting("GEMINI_MAX_RETRIES", 4)),
+        classify=classify_error,
     )
+    registry.register_gauges("gemini_scheduler", scheduler.stats)
+    return scheduler
+
+@contextmanager
+def gemini_priority(name: str):
+    """Schedule the Gemini calls made inside the block as operator, rider or background traffic.
 
-def create_user_chat():
-    return client.chats.create(
-        model="gemini-2.5-flash",
-        history=[
-            types.Content(role="system", parts=[types.Part.from_text(USER_SIDE_GENERATOR_PROMPT)])
-        ],
+    Calls outside any block are background work (intake workers, imports).
+    Threads started with utils.metrics.bind inherit the priority.
+    """
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def _request_key(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def generate_json(contents: list, system_instruction: str, purpose: str, schema: dict = RECORD_SCHEMA) -> str:
+    """One structured-output call through the scheduler; returns the reply's JSON text.
+
+    ``contents`` are strings and ``(bytes, mime_type)`` pairs. Identical
+    requests in flight at the same time share a single call.
+    """
+    from google.genai import types
+
+    key = _request_key(purpose, system_instruction, json.dumps(schema, sort_keys=True), *(
+        part for item in contents for part in (item if isinstance(item, tuple) else (item,))
+    ))
+    parts = [types.Part.from_bytes(data=c[0], mime_type=c[1]) if isinstance(c, tuple) else c for c in contents]
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_schema=schema,
     )
 
+    def request():
+        return get_client().models.generate_content(model=GEMINI_MODEL, contents=parts, config=config).text
+
+    priority = _priority.get()
+    with span("gemini.generate_content", purpose=purpose, priority=priority):
+        return get_scheduler().call(
+            request, priority=priority, key=key, timeout=float(get_setting("GEMINI_CALL_TIMEOUT", 120))
+        )
+
+def describe_found_item(image_bytes: bytes, mime_type: str) -> str:
+    """Operator description of a found-item photo, as a JSON record."""
+    return generate_json(
+        [(image_bytes, mime_type), "I have a photo of the found item. Here is my description based on what I see: "],
+        GENERATOR_SYSTEM_PROMPT,
+        "describe",
+    )
+
+def structure_user_report(message_text: str) -> str:
+    """A rider's report turned into a JSON record."""
+    return generate_json([message_text or " "], USER_SIDE_GENERATOR_PROMPT, "structure")
+
 # ---------------------
 # HELPERS
 # ---------------------
@@ -152,21 +260,60 @@ def extract_field(text: str, field: str) -> str:
     m = re.search(rf"{field}\s*:\s*(.*)", text)
     return m.group(1).strip() if m else ""
 
-def standardize_description(text: str, tags: dict):
+RECORD_LABELS = {
+    "subway_location": "Subway Location",
+    "color": "Color",
+    "item_category": "Item Category",
+    "item_type": "Item Type",
+    "description": "Description",
+}
+
+def parse_record(text: str):
+    """Read a JSON record or a "Field: value" structured record; None if neither."""
     try:
         data = json.loads(text)
+        if isinstance(data, dict):
+            return data
     except Exception:
+        pass
+    data = {field: extract_field(text, label) for field, label in RECORD_LABELS.items()}
+    if not any(data.values()):
+        return None
+    return {field: value for field, value in data.items() if value}
+
+def _llm_standardize(fields: dict, tags: dict) -> dict:
+    """Ask Gemini to map the fields the local index could not place."""
+    record = "\n".join(
+        f"{label}: {', '.join(fields.get(field, [])) or 'null'}"
+        for field, label in RECORD_LABELS.items() if field != "description"
+    )
+    reference = "\n".join(
+        f"{RECORD_LABELS[field]} tags: {'; '.join(tags.get(key, []))}" for field, key in TAG_FIELDS.items()
+    )
+    return json.loads(
+        generate_json([f"Tags reference:\n{reference}\n\n{record}\nDescription: null"], STANDARDIZER_PROMPT, "standardize")
+    )
+
+def standardize_description(text: str, tags: dict, fallback: bool = None):
+    """Map a model record onto the Tags.xlsx vocabularies.
+
+    Fields are matched offline with the precomputed tag index. With
+    ``fallback`` (default TAG_LLM_FALLBACK, on) fields where nothing reached
+    TAG_MATCH_THRESHOLD go to Gemini in one blocking call; otherwise they are
+    left empty. Per-field confidences are returned under ``tag_confidence``.
+    """
+    data = parse_record(text)
+    if data is None:
         data = {
             "subway_location": [],
             "color": [],
             "item_category": "null",
             "item_type": [],
             "description": text,
-            "time": datetime.now(timezone.utc).isoformat(),
         }
 
     # Ensure list fields
-    for k in ["subway_location", "color", "item_type"]:
+    for k in LIST_FIELDS:
         if k in data and isinstance(data[k], str):
             data[k] = [data[k]]
         elif k not in data:
@@ -178,4 +325,28 @@ def standardize_description(text: str, tags: dict):
         data["description"] = text
     if "time" not in data:
         data["time"] = datetime.now(timezone.utc).isoformat()
+
+    if tags:
+        index = get_tag_index(tags)
+        threshold = float(get_setting("TAG_MATCH_THRESHOLD", 0.75))
+        confidence, unresolved = {}, {}
+        for field in LIST_FIELDS + ("item_category",):
+            matched, confidence[field], left = index.match_many(field, data[field], threshold)
+            data[field] = matched if field != "item_category" else (matched[0] if matched else "null")
+            if left and not matched:
+                unresolved[field] = left
+
+        if fallback is None:
+            fallback = str(get_setting("TAG_LLM_FALLBACK", "true")).lower() == "true"
+        if unresolved and fallback and gemini_available():
+            try:
+                suggested = _llm_standardize(unresolved, tags)
+            except Exception:
+                suggested = {}
+            for field in unresolved:
+                matched, score, _ = index.match_many(field, suggested.get(field), threshold)
+                if matched:
+                    data[field] = matched if field != "item_category" else matched[0]
+                    confidence[field] = score
+        data["tag_confidence"] = confidence
     return data
@@ -1,22 +1,80 @@
-import pandas as pd
-import streamlit as st
+import json
+import os
 import re
+from pathlib import Path
+
+import streamlit as st
+
+TAGS_FILE = Path("Tags.xlsx")
+TAG_CATALOG_VERSION = 1
+TAG_COLUMNS = {
+    "locations": "Subway Location",
+    "colors": "Color",
+    "categories": "Item Category",
+    "item_types": "Item Type",
+}
+
+
+def _tag_catalog_path(path: Path) -> Path:
+    return path.with_name(path.name + ".catalog.json")
+
+
+def compile_tag_catalog(path: Path = TAGS_FILE) -> dict:
+    """Read the tag lists out of the spreadsheet (needs pandas and openpyxl)."""
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    return {key: sorted(set(df[column].dropna().astype(str))) for key, column in TAG_COLUMNS.items()}
+
+
+def load_tag_catalog(path: Path = TAGS_FILE) -> dict:
+    """Tag lists from the compiled JSON next to ``path``, recompiled when the spreadsheet changes.
+
+    The cache records the spreadsheet's mtime and size, so normal starts read
+    a few KB of JSON instead of importing pandas and parsing the workbook.
+    """
+    stat = path.stat()
+    source = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    cache = _tag_catalog_path(path)
+    try:
+        compiled = json.loads(cache.read_text(encoding="utf-8"))
+        if compiled.get("version") == TAG_CATALOG_VERSION and compiled.get("source") == source:
+            return compiled["catalog"]
+    except (OSError, ValueError):
+        pass
+
+    catalog = compile_tag_catalog(path)
+    try:
+        tmp = cache.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": TAG_CATALOG_VERSION, "source": source, "catalog": catalog}), encoding="utf-8")
+        os.replace(tmp, cache)
+    except OSError:
+        # A read-only checkout still works, it just recompiles on every start.
+        pass
+    return catalog
+
 
 @st.cache_data
 def load_tag_data():
     try:
-        df = pd.read_excel("Tags.xlsx")
-        return {
-            "df": df,
-            "locations": sorted(set(df["Subway Location"].dropna().astype(str))),
-            "colors": sorted(set(df["Color"].dropna().astype(str))),
-            "categories": sorted(set(df["Item Category"].dropna().astype(str))),
-            "item_types": sorted(set(df["Item Type"].dropna().astype(str))),
-        }
+        return load_tag_catalog(TAGS_FILE)
     except Exception as e:
         st.error(f"Error loading Tags.xlsx: {e}")
         return None
-    
+
+
+def clean_tag_list(values) -> list:
+    """Normalize a tag field to a list of distinct, non-null values."""
+    if isinstance(values, str):
+        values = [values]
+    tags = []
+    for v in values or []:
+        v = str(v).strip()
+        if v and v.lower() != "null" and v not in tags:
+            tags.append(v)
+    return tags
+
+
 def validate_phone(phone: str) -> bool:
     return bool(re.fullmatch(r"\d{10}", phone or ""))
 
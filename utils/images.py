@@ -0,0 +1,172 @@
+"""Content-addressed storage for item photos.
+
+    found_images/
+        3f/3fa2...c9.jpg              original, named by the sha256 of its bytes
+        thumbs/3fa2...c9_256.webp     resized WebP variants, made after ingest
+
+Uploads are streamed to a temporary file while being hashed and then moved
+into place, so identical photos are stored once and two uploads that share
+a file name never overwrite each other. Match listings show the small
+variant instead of the full-resolution original; the intake worker and
+bulk import create the variants, and ``thumbnail_path`` makes any that are
+still missing on first view.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+
+from utils.config import get_setting
+
+CHUNK_SIZE = 1 << 20
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+THUMBNAIL_SIZES = (256, 1024)
+LISTING_SIZE = 256
+
+
+def image_root() -> Path:
+    return Path(get_setting("IMAGE_STORE_DIR", "found_images"))
+
+
+def _suffix(filename: str) -> str:
+    suffix = Path(filename or "").suffix.lower()
+    return suffix if suffix in IMAGE_SUFFIXES else ".jpg"
+
+
+def store_image(source, filename: str = "", root: Path = None) -> tuple:
+    """Stream ``source`` (bytes or a binary file object) into the store.
+
+    Returns ``(path, sha256 hex digest)``. An image already in the store is
+    not written again. Thumbnails are left to ``make_thumbnails``, so that
+    storing stays cheap on the enqueue path.
+    """
+    root = Path(root) if root is not None else image_root()
+    root.mkdir(parents=True, exist_ok=True)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, "seek"):
+        source.seek(0)
+
+    h = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+                out.write(chunk)
+        digest = h.hexdigest()
+        # The same bytes uploaded as .jpg and .jpeg are still one file.
+        existing = next((root / digest[:2]).glob(f"{digest}.*"), None)
+        if existing is not None:
+            path = existing
+            os.unlink(tmp)
+        else:
+            path = root / digest[:2] / f"{digest}{_suffix(filename)}"
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return str(path), digest
+
+
+def _thumbnail_file(path: Path, size: int) -> Path:
+    if len(path.stem) == 64 and path.parent.name == path.stem[:2]:
+        root, stem = path.parent.parent, path.stem
+    else:
+        # Files stored before content addressing: key by a hash of the path.
+        root, stem = path.parent, hashlib.sha256(str(path).encode("utf-8")).hexdigest()
+    return root / "thumbs" / f"{stem}_{size}.webp"
+
+
+def make_thumbnails(path, sizes=THUMBNAIL_SIZES) -> list:
+    """Create the missing WebP variants of ``path``; returns the ones that exist."""
+    from PIL import Image, ImageOps
+
+    path = Path(path)
+    wanted = {size: _thumbnail_file(path, size) for size in sizes}
+    missing = {size: dest for size, dest in wanted.items() if not dest.exists()}
+    if missing:
+        try:
+            with Image.open(path) as img:
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+                for size, dest in sorted(missing.items(), reverse=True):
+                    variant = img.copy()
+                    variant.thumbnail((size, size))
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = dest.with_suffix(".tmp")
+                    variant.save(tmp, format="WEBP", quality=80, method=4)
+                    os.replace(tmp, dest)
+        except (OSError, ValueError):
+            # Not a readable image: callers fall back to the original file.
+            pass
+    return [dest for dest in wanted.values() if dest.exists()]
+
+
+def thumbnail_path(image_path: str, size: int = LISTING_SIZE) -> str:
+    """Path of the ``size`` variant of ``image_path``, created on first use for older
+    uploads; the original path if no variant can be made."""
+    if not image_path:
+        return image_path
+    dest = _thumbnail_file(Path(image_path), size)
+    if not dest.exists():
+        make_thumbnails(image_path, sizes=(size,))
+    return str(dest) if dest.exists() else image_path
+
+
+# ---------------------
+# PERCEPTUAL HASH
+# ---------------------
+PHASH_BANDS = 4  # 16-bit bands
+# Hashes within this distance differ by at most one bit in some band, which a
+# lookup with phash_bands(value, radius=1) finds.
+PHASH_MAX_DISTANCE = 2 * PHASH_BANDS - 1
+
+
+def _dct_matrix(n: int):
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+
+
+def image_phash(source):
+    """64-bit DCT perceptual hash of an image path, bytes or file object, as a signed
+    int (Postgres BIGINT); None if it cannot be read."""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        with Image.open(source) as img:
+            img.draft("L", (64, 64))  # JPEG decodes at reduced scale, much faster for photos
+            img = ImageOps.exif_transpose(img).convert("L").resize((32, 32), Image.LANCZOS)
+            pixels = np.asarray(img, dtype=np.float64)
+    except (OSError, ValueError):
+        return None
+    d = _dct_matrix(32)
+    low = (d @ pixels @ d.T)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def phash_bands(value: int, radius: int = 0) -> list:
+    """Band keys matching the ``phash_bands`` SQL function: band index in the high bits.
+
+    ``radius=1`` adds every key one bit away within its band, for lookups.
+    """
+    unsigned = value & ((1 << 64) - 1)
+    keys = []
+    for band in range(PHASH_BANDS):
+        bits = (unsigned >> (16 * band)) & 0xFFFF
+        keys.append((band << 16) | bits)
+        if radius:
+            keys.extend((band << 16) | (bits ^ (1 << i)) for i in range(16))
+    return keys
@@ -0,0 +1,222 @@
+"""Latency instrumentation: stage spans, Prometheus metrics and per-request log lines.
+
+    with request_trace("user_intake"):
+        with span("gemini.generate_content"):
+            ...
+        with span("search.query", mode="hybrid") as s:
+            rows = cur.fetchall()
+            s.set(rows=len(rows))
+
+Every span is observed in the ``lost_found_stage_seconds`` histogram under
+its stage name. Numeric attributes such as rows, cache hits or retries are
+added to ``lost_found_stage_<attr>_total`` counters, and failed spans count
+in ``lost_found_stage_errors_total``. Spans that end inside a
+``request_trace`` are also collected, and the trace is written as one JSON
+line on the ``lost_found.requests`` logger when it closes. Worker threads
+only see the trace when started with ``bind``.
+
+``start_metrics_server`` serves everything at /metrics in the Prometheus
+text format from a daemon thread when METRICS_PORT is set.
+"""
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.config import get_setting
+
+PREFIX = "lost_found"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+request_log = logging.getLogger("lost_found.requests")
+
+
+# ---------------------
+# REGISTRY
+# ---------------------
+class _Registry:
+    """Histograms and counters keyed by (metric, label value), plus gauge callbacks."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric: str, label: str, value: str, seconds: float):
+        with self._lock:
+            h = self._histograms.setdefault((metric, label, value), [[0] * len(self.buckets), 0.0, 0])
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                h[0][index] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    def inc(self, metric: str, label: str, value: str, amount: float = 1):
+        with self._lock:
+            key = (metric, label, value)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_gauges(self, name: str, collect):
+        """Expose ``collect()``'s numeric values as ``<prefix>_<name>_<key>`` gauges at scrape time."""
+        with self._lock:
+            self._gauges[name] = collect
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        lines = []
+        for metric in sorted({k[0] for k in histograms}):
+            lines.append(f"# TYPE {metric} histogram")
+            for (name, label, value), (counts, total, count) in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label}="{value}"}} {total}')
+                lines.append(f'{metric}_count{{{label}="{value}"}} {count}')
+        for metric in sorted({k[0] for k in counters}):
+            lines.append(f"# TYPE {metric} counter")
+            for (name, label, value), amount in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{{{label}="{value}"}} {amount}')
+        for name, collect in sorted(gauges.items()):
+            try:
+                values = collect()
+            except Exception:
+                continue  # e.g. no database configured
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {PREFIX}_{name}_{key} gauge")
+                    lines.append(f"{PREFIX}_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = _Registry(LATENCY_BUCKETS)
+
+
+# ---------------------
+# SPANS AND TRACES
+# ---------------------
+_trace = contextvars.ContextVar("lost_found_trace", default=None)
+
+
+class Span:
+    def __init__(self, stage: str, attrs: dict):
+        self.stage = stage
+        self.attrs = attrs
+        self.seconds = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time a block as ``stage``; attributes can be added while it runs with ``Span.set``."""
+    s = Span(stage, attrs)
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        registry.inc(f"{PREFIX}_stage_errors_total", "stage", stage)
+        raise
+    finally:
+        s.seconds = time.perf_counter() - started
+        registry.observe(f"{PREFIX}_stage_seconds", "stage", stage, s.seconds)
+        for key, value in s.attrs.items():
+            if isinstance(value, (int, float)):
+                registry.inc(f"{PREFIX}_stage_{key}_total", "stage", stage, int(value) if isinstance(value, bool) else value)
+        trace = _trace.get()
+        if trace is not None:
+            trace["stages"].append({"stage": stage, "ms": round(s.seconds * 1000, 2), **s.attrs})
+
+
+@contextmanager
+def request_trace(name: str, **attrs):
+    """Collect the spans of one request and log them as a single JSON line when it ends."""
+    trace = {"request": name, **attrs, "stages": []}
+    token = _trace.set(trace)
+    started = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as e:
+        trace["error"] = type(e).__name__
+        raise
+    finally:
+        _trace.reset(token)
+        seconds = time.perf_counter() - started
+        trace["ms"] = round(seconds * 1000, 2)
+        registry.observe(f"{PREFIX}_request_seconds", "request", name, seconds)
+        request_log.info(json.dumps(trace, default=str))
+
+
+def bind(fn):
+    """Wrap ``fn`` to run in a copy of the caller's context, so worker threads join its trace."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+# ---------------------
+# EXPOSITION
+# ---------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = None):
+    """Serve /metrics on METRICS_PORT (once per process); returns the server, or None if no port is set."""
+    global _server
+    port = port or int(get_setting("METRICS_PORT", 0) or 0)
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((get_setting("METRICS_HOST", "0.0.0.0"), port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+def configure_logging():
+    """Send the ``lost_found`` loggers to stderr, one message per line, unless already configured."""
+    logger = logging.getLogger("lost_found")
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(str(get_setting("LOG_LEVEL", "INFO")).upper())
+        logger.propagate = False
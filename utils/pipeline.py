@@ -0,0 +1,188 @@
+"""Staged intake pipeline for the user report flow.
+
+The blocking SDK calls (Gemini, the embedding provider, Postgres) run on a
+shared thread pool and are orchestrated with asyncio:
+
+    structure (Gemini) ─> standardize ─> embed description ─> search
+                            (local)                            │
+    near-duplicate photo lookup (Postgres) ────────────────────┘
+
+The photo lookup needs nothing from the model, so it runs while Gemini
+structures the report. When it finds a near-duplicate, those rows are
+the matches and the search stage is skipped, as search_found_items does
+for a photo without an embedding (SEARCH_IMAGE_SHORTCUT).
+
+Every stage has a timeout (PIPELINE_*_TIMEOUT, seconds). A timed-out stage
+is cancelled from the pipeline's point of view; its worker thread cannot be
+interrupted and finishes in the background, where an embedding still lands
+in the cache.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.config import get_setting
+from utils.embedding import get_embedding
+from utils.gemini import (
+    RECORD_LABELS,
+    gemini_available,
+    gemini_priority,
+    is_structured_record,
+    parse_record,
+    standardize_description,
+    structure_user_report,
+)
+from utils.metrics import bind, request_trace
+
+# Not asyncio's default executor: asyncio.run() waits for that one on exit,
+# which would block the caller on abandoned stages.
+_executor = ThreadPoolExecutor(max_workers=int(get_setting("PIPELINE_WORKERS", 8)), thread_name_prefix="intake")
+
+
+def _timeout(stage: str, default: float) -> float:
+    return float(get_setting(f"PIPELINE_{stage.upper()}_TIMEOUT", default))
+
+
+def _with_script_context(fn):
+    """Let ``fn`` call st.* from a worker thread of the current Streamlit run."""
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return fn
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    return run
+
+
+async def _stage(result: dict, name: str, timeout: float, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    future = loop.run_in_executor(_executor, functools.partial(bind(_with_script_context(fn)), *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    finally:
+        result["timings"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def _user_turn(message_text: str) -> str:
+    if not gemini_available():
+        return ""
+    return structure_user_report(message_text)
+
+
+def merge_record(structured_text: str, overrides: dict = None) -> str:
+    """Structured record with the user's explicit choices taking precedence."""
+    overrides = overrides or {}
+    data = parse_record(structured_text) or {}
+    lines = []
+    for field, label in RECORD_LABELS.items():
+        value = data.get(field) or ""
+        if isinstance(value, list):
+            value = ", ".join(map(str, value))
+        lines.append(f"{label}: {overrides.get(label) or value}")
+    return "\n" + "\n".join(lines) + "\n"
+
+
+async def user_intake(
+    message_text: str,
+    tag_data: dict,
+    overrides: dict = None,
+    k: int = 5,
+    search: bool = True,
+    image_phash: int = None,
+) -> dict:
+    """Run the user report flow, with the photo lookup alongside the Gemini call.
+
+    Returns a dict with ``model_text``, ``merged_text``, ``record``,
+    ``embedding``, ``matches`` (None unless ``search``), per-stage
+    ``timings`` in ms and ``errors``. ``record`` is None when the model did
+    not produce a structured record or standardization failed; a failed
+    embedding leaves ``embedding`` None and skips the search.
+    """
+    from db.backend import find_near_duplicates, search_found_items
+    from db.search import image_shortcut
+
+    result = {
+        "model_text": "",
+        "merged_text": "",
+        "record": None,
+        "embedding": None,
+        "matches": None,
+        "timings": {},
+        "errors": [],
+    }
+    started = time.perf_counter()
+
+    async def run(name, coro):
+        try:
+            return await coro
+        except asyncio.TimeoutError:
+            result["errors"].append(f"{name} timed out")
+        except Exception as e:
+            result["errors"].append(f"{name} failed: {e}")
+        return None
+
+    async def lookup_duplicates():
+        try:
+            return await _stage(result, "near_duplicates", _timeout("search", 10), find_near_duplicates, image_phash, k=k)
+        except Exception:
+            return None  # only a shortcut: the search stage still runs
+
+    duplicates = None
+    if search and image_phash is not None and image_shortcut():
+        duplicates = asyncio.ensure_future(lookup_duplicates())
+
+    try:
+        model_text = await run("structure", _stage(result, "structure", _timeout("llm", 45), _user_turn, message_text))
+        if model_text is None or not is_structured_record(model_text):
+            result["model_text"] = model_text or ""
+            return result
+        result["model_text"] = model_text
+        result["merged_text"] = merge_record(model_text, overrides)
+
+        record = await run(
+            "standardize",
+            _stage(result, "standardize", _timeout("standardize", 20), standardize_description, result["merged_text"], tag_data),
+        )
+        if record is None:
+            return result
+        result["record"] = record
+
+        embedding = await run(
+            "embedding",
+            _stage(result, "embedding", _timeout("embed", 15), get_embedding, record.get("description", "")),
+        )
+        if embedding is None:
+            return result
+        result["embedding"] = embedding
+
+        if duplicates is not None:
+            result["matches"] = (await duplicates) or None
+        if search and result["matches"] is None:
+            result["matches"] = await run(
+                "search",
+                _stage(result, "search", _timeout("search", 10), search_found_items, record, k=k, embedding=embedding, image_phash=image_phash),
+            )
+        return result
+    finally:
+        if duplicates is not None:
+            duplicates.cancel()
+        result["timings"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def run_user_intake(*args, **kwargs) -> dict:
+    """Synchronous entry point for Streamlit scripts; see ``user_intake``.
+
+    Its Gemini calls are scheduled as rider traffic.
+    """
+    with request_trace("user_intake"), gemini_priority("rider"):
+        return asyncio.run(user_intake(*args, **kwargs))
@@ -0,0 +1,254 @@
+"""Shared scheduler for calls to a rate-limited API.
+
+    scheduler = CallScheduler("gemini", rate=1.0, burst=5, concurrency=4, classify=classify_error)
+    text = scheduler.call(request, priority="operator", key=request_key)
+
+Calls wait in a priority queue (operator, then rider, then background
+traffic; first come first served within a priority) until one of
+``concurrency`` worker threads is free and the token bucket, refilled at
+``rate`` calls per second up to ``burst``, has a token. Failures that
+``classify`` calls "transient" or "rate_limit" are retried up to
+``max_retries`` times after the server's Retry-After or a jittered
+exponential backoff; a rate-limit error also empties and pauses the
+bucket, so the whole queue backs off instead of spending the quota on
+calls that will fail. Calls submitted with the same ``key`` while one is
+queued or running share its future, and raise it to the higher priority.
+
+Workers run each call in a copy of the submitter's context
+(utils.metrics.bind), so its spans join the caller's request trace.
+"""
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.metrics import bind
+
+PRIORITIES = {"operator": 0, "rider": 1, "background": 2}
+
+
+class TokenBucket:
+    """``rate`` tokens per second up to ``burst``; a rate of 0 never throttles."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    delay = self.updated - now  # paused
+            time.sleep(delay)
+            waited += delay
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Hand out nothing for ``seconds``, then refill from empty."""
+        with self._lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class _Job:
+    def __init__(self, fn, priority: int, key):
+        self.fn = fn
+        self.priority = priority
+        self.key = key
+        self.future = Future()
+        self.attempts = 0
+        self.generation = 0
+        self.state = "queued"  # queued, running or waiting to retry
+        self.submitted_at = time.monotonic()
+
+
+class CallScheduler:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        concurrency: int,
+        max_retries: int = 4,
+        classify=None,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.classify = classify or (lambda error: None)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = {}
+        self._cond = threading.Condition()
+        self._workers = []
+        self._stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "queued": 0,
+            "running": 0,
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "throttled_seconds": 0.0,
+            "queue_seconds": 0.0,
+        }
+
+    # ---------------------
+    # SUBMISSION
+    # ---------------------
+    def submit(self, fn, *args, priority="rider", key=None, **kwargs) -> Future:
+        """Queue ``fn(*args, **kwargs)``; returns its future, shared with in-flight calls of the same ``key``."""
+        level = PRIORITIES[priority] if isinstance(priority, str) else int(priority)
+        with self._cond:
+            self._stats["submitted"] += 1
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                self._stats["coalesced"] += 1
+                if level < job.priority:
+                    job.priority = level
+                    if job.state == "queued":
+                        self._push(job)
+                return job.future
+            job = _Job(bind(functools.partial(fn, *args, **kwargs)), level, key)
+            if key is not None:
+                self._inflight[key] = job
+            self._stats["queued"] += 1
+            self._push(job)
+            self._start_workers()
+        return job.future
+
+    def call(self, fn, *args, priority="rider", key=None, timeout: float = None, **kwargs):
+        """``submit`` and wait; a timeout leaves the call to finish in the background."""
+        return self.submit(fn, *args, priority=priority, key=key, **kwargs).result(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._stats)
+
+    def _push(self, job: _Job):
+        # Re-pushing with a new generation makes older heap entries of the job stale.
+        job.generation += 1
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job.generation, job))
+        self._cond.notify()
+
+    def _pop(self):
+        while self._heap:
+            _, _, generation, job = heapq.heappop(self._heap)
+            if generation == job.generation and job.state == "queued":
+                return job
+        return None
+
+    def _start_workers(self):
+        while len(self._workers) < self.concurrency:
+            worker = threading.Thread(target=self._work, name=f"{self.name}-call-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    # ---------------------
+    # WORKERS
+    # ---------------------
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+            # The token is taken before choosing the job, so a call submitted
+            # while this worker waits still goes first if it ranks higher.
+            waited = self.bucket.acquire()
+            with self._cond:
+                job = self._pop()
+                if job is None:
+                    self.bucket.refund()
+                    continue
+                job.state = "running"
+                self._stats["queued"] -= 1
+                self._stats["running"] += 1
+                self._stats["throttled_seconds"] += waited
+                self._stats["queue_seconds"] += time.monotonic() - job.submitted_at
+            self._run(job)
+
+    def _run(self, job: _Job):
+        try:
+            result = job.fn()
+        except BaseException as e:
+            # Anything escaping the call must reach the future: coalesced
+            # callers are waiting on it, and the worker has to keep running.
+            kind = self.classify(e) if isinstance(e, Exception) else None
+            with self._cond:
+                self._stats["running"] -= 1
+                retry = kind is not None and job.attempts < self.max_retries
+                job.state = "retry"
+                if retry:
+                    job.attempts += 1
+                    self._stats["retries"] += 1
+                    self._stats["queued"] += 1
+                    if kind == "rate_limit":
+                        self._stats["rate_limited"] += 1
+                else:
+                    self._stats["failed"] += 1
+                    self._release(job)
+            if not retry:
+                job.future.set_exception(e)
+                return
+            delay = self._retry_delay(job.attempts - 1, e)
+            if kind == "rate_limit":
+                self.bucket.pause(delay)
+            timer = threading.Timer(delay, self._requeue, (job,))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._cond:
+            self._stats["running"] -= 1
+            self._stats["completed"] += 1
+            self._release(job)
+        job.future.set_result(result)
+
+    def _requeue(self, job: _Job):
+        with self._cond:
+            job.state = "queued"
+            job.submitted_at = time.monotonic()
+            self._push(job)
+
+    def _release(self, job: _Job):
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def _retry_delay(self, attempt: int, error) -> float:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff)
+        # Half fixed, half random: spreads retries out without ever retrying at once.
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,302 @@
+"""Offline mapping of free-text field values onto the Tags.xlsx vocabularies.
+
+``TagIndex`` is built once per tag list and answers ``match(field, value)``
+without any network call:
+
+1. exact hit on the normalized label or a known alias (score 1.0);
+2. otherwise candidates sharing a token or character trigram are scored by
+   token overlap (how much of the tag the value covers) and trigram Dice
+   similarity (typos, "Delancey" vs "Delancy"), and the best one wins.
+
+Normalization folds case and accents, spells ``&`` as ``and``, drops ordinal
+suffixes and canonicalizes common abbreviations, so "Times Sq", "Times
+Square-42 St" and "times square" all land on ``Times Square``.
+"""
+import re
+import unicodedata
+from collections import Counter
+
+import streamlit as st
+
+# Field name -> key in ``load_tag_data()``.
+TAG_FIELDS = {
+    "subway_location": "locations",
+    "color": "colors",
+    "item_category": "categories",
+    "item_type": "item_types",
+}
+LIST_FIELDS = ("subway_location", "color", "item_type")
+
+TOKEN_CANON = {
+    "street": "st",
+    "str": "st",
+    "avenue": "av",
+    "ave": "av",
+    "square": "sq",
+    "center": "ctr",
+    "centre": "ctr",
+    "grey": "gray",
+}
+STOPWORDS = {
+    "subway_location": {"the", "station", "stop", "train", "trains", "line", "lines", "subway", "at", "near"},
+    "color": {"the", "a", "an", "my", "dark", "light", "bright", "pale", "ish", "colored", "color"},
+    "item_category": {"the", "a", "an", "my"},
+    "item_type": {"the", "a", "an", "my", "small", "large", "big", "new", "old"},
+}
+
+# Extra spellings per field; entries whose target is not in the loaded vocabulary are ignored.
+TAG_ALIASES = {
+    "subway_location": {
+        "times sq 42 st": "Times Square",
+        "42 st times sq": "Times Square",
+        "union sq": "14 St - Union Square",
+        "14 st union sq": "14 St - Union Square",
+        "penn": "Penn Station",
+        "34 st penn station": "Penn Station",
+        "grand central 42 st": "Grand Central",
+        "wtc": "World Trade Center",
+        "34 st herald sq": "Herald Square",
+        "42 st bryant park": "Bryant Park",
+        "atlantic av barclays ctr": "Barclays",
+        "barclays ctr": "Barclays",
+        "47 50 sts rockefeller ctr": "Rockefeller",
+        "rockefeller ctr": "Rockefeller",
+        "59 st columbus circle": "Columbus Circle",
+        "w 4 st washington sq": "Washington Square",
+        "delancey st": "Delancy St",
+    },
+    "color": {
+        "silver": "Gray",
+        "charcoal": "Gray",
+        "navy": "Blue",
+        "teal": "Blue",
+        "turquoise": "Blue",
+        "olive": "Green",
+        "khaki": "Brown",
+        "beige": "Brown",
+        "tan": "Brown",
+        "maroon": "Red",
+        "burgundy": "Red",
+        "gold": "Yellow",
+        "violet": "Purple",
+        "lavender": "Purple",
+        "magenta": "Pink",
+        "cream": "White",
+        "ivory": "White",
+    },
+    "item_category": {
+        "bags": "Bags & Containers",
+        "bags and accessories": "Bags & Containers",
+        "clothing": "Clothing & Apparel",
+        "apparel": "Clothing & Apparel",
+        "accessories": "Personal Items & Accessories",
+        "personal items": "Personal Items & Accessories",
+        "documents": "Identification & Documents",
+        "identification": "Identification & Documents",
+        "other": "Other / Miscellaneous",
+        "miscellaneous": "Other / Miscellaneous",
+    },
+    "item_type": {
+        "iphone": "Phone / Cell Phone",
+        "smartphone": "Phone / Cell Phone",
+        "cellphone": "Phone / Cell Phone",
+        "mobile": "Phone / Cell Phone",
+        "book bag": "Backpack",
+        "bookbag": "Backpack",
+        "rucksack": "Backpack",
+        "ipad": "Tablet / iPad",
+        "airpods": "Headphones / Earbuds",
+        "earphones": "Headphones / Earbuds",
+        "apple watch": "Smartwatch",
+        "coat": "Jacket / Coat",
+        "hoodie": "Sweater / Hoodie",
+        "jeans": "Pants",
+        "trousers": "Pants",
+        "sneakers": "Shoes",
+        "boots": "Shoes",
+        "cap": "Hat",
+        "beanie": "Hat",
+        "sunglasses": "Glasses",
+        "eyeglasses": "Glasses",
+        "key": "Keys / Keychain",
+        "necklace": "Jewelry",
+        "ring": "Jewelry",
+        "bracelet": "Jewelry",
+        "earrings": "Jewelry",
+        "metrocard": "Credit / Debit Card",
+        "id": "ID Card / Badge",
+        "bottle": "Water Bottle",
+        "laptop bag": "Briefcase / Laptop Bag",
+        "purse": "Handbag / Purse / Makeup Bag",
+    },
+}
+
+_ORDINAL = re.compile(r"^(\d+)(st|nd|rd|th)$")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_SPLIT = re.compile(r"[,;()\[\]]|/|\band\b|\+")
+_MEMO_SIZE = 10000
+
+
+def normalize_tag_text(text: str, field: str = "") -> tuple:
+    """Return the canonical token tuple for ``text``."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").lower()
+    text = _NON_ALNUM.sub(" ", text.replace("&", " and "))
+    stop = STOPWORDS.get(field, ())
+    tokens = []
+    for token in text.split():
+        m = _ORDINAL.match(token)
+        if m:
+            token = m.group(1)
+        token = TOKEN_CANON.get(token, token)
+        if token not in stop:
+            tokens.append(token)
+    return tuple(tokens)
+
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _FieldIndex:
+    def __init__(self, field: str, labels: list, aliases: dict):
+        self.field = field
+        self.labels = []
+        self.keys = []  # (tokens, trigrams, label index)
+        self.exact = {}
+        self.token_postings = {}
+        self.gram_postings = {}
+
+        by_label = {}
+        for label in labels:
+            label = str(label).strip()
+            if label and label not in by_label:
+                by_label[label] = len(self.labels)
+                self.labels.append(label)
+
+        spellings = []
+        for label, i in by_label.items():
+            spellings.append((label, i))
+            # "Handbag / Purse / Makeup Bag" is also reachable as "purse",
+            # "Sports Equipment (ex. Ball, Racket)" as "sports equipment".
+            if "/" in label:
+                spellings.extend((part, i) for part in label.split("/"))
+            if "(" in label:
+                spellings.append((label.split("(")[0], i))
+        spellings.extend((alias, by_label[target]) for alias, target in aliases.items() if target in by_label)
+
+        for text, i in spellings:
+            tokens = normalize_tag_text(text, field)
+            key = " ".join(tokens)
+            if not key or key in self.exact:
+                continue
+            self.exact[key] = i
+            k = len(self.keys)
+            grams = _trigrams(key)
+            self.keys.append((frozenset(tokens), grams, i))
+            for token in tokens:
+                self.token_postings.setdefault(token, []).append(k)
+            for gram in grams:
+                self.gram_postings.setdefault(gram, []).append(k)
+
+    def best(self, tokens: tuple):
+        """Best label index and score for a normalized value."""
+        key = " ".join(tokens)
+        if not key:
+            return None, 0.0
+        if key in self.exact:
+            return self.exact[key], 1.0
+
+        query_tokens = set(tokens)
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            for k in self.gram_postings.get(gram, ()):
+                shared[k] += 1
+        for token in query_tokens:
+            for k in self.token_postings.get(token, ()):
+                shared.setdefault(k, 0)
+
+        best_label, best_score = None, 0.0
+        for k, common in shared.items():
+            key_tokens, key_grams, label = self.keys[k]
+            overlap = len(query_tokens & key_tokens)
+            # Mostly how much of the tag the value covers, a little how much of the value is explained.
+            token_score = 0.7 * overlap / len(key_tokens) + 0.3 * overlap / len(query_tokens)
+            gram_score = 2.0 * common / (len(grams) + len(key_grams))
+            score = max(token_score, gram_score)
+            if score > best_score:
+                best_label, best_score = label, score
+        return best_label, best_score
+
+
+class TagIndex:
+    """Precomputed fuzzy lookup over the Tags.xlsx vocabularies."""
+
+    def __init__(self, vocabularies: dict, aliases: dict = None):
+        aliases = TAG_ALIASES if aliases is None else aliases
+        self.fields = {
+            field: _FieldIndex(field, labels, aliases.get(field, {}))
+            for field, labels in vocabularies.items()
+        }
+        self._memo = {}
+
+    def match(self, field: str, value) -> tuple:
+        """Return ``(tag, confidence)`` for one value; ``tag`` is None when nothing is close."""
+        memo_key = (field, value)
+        hit = self._memo.get(memo_key)
+        if hit is not None:
+            return hit
+        index = self.fields[field]
+        label, score = index.best(normalize_tag_text(value, field))
+        result = (index.labels[label] if label is not None else None, round(score, 4))
+        if len(self._memo) >= _MEMO_SIZE:
+            self._memo.clear()
+        self._memo[memo_key] = result
+        return result
+
+    def match_many(self, field: str, values, threshold: float) -> tuple:
+        """Map a list-field value onto tags.
+
+        Returns ``(tags, confidence, unresolved)``: the accepted tags, the
+        lowest confidence among them, and the parts that stayed below
+        ``threshold``. Unless a value matches a tag exactly it is split on
+        commas, slashes, parentheses and "and", so "Times Sq (N, Q, R)"
+        yields ``Times Square`` plus the three lines.
+        """
+        if isinstance(values, str):
+            values = [values]
+        tags, scores, unresolved = [], [], []
+        for value in values or []:
+            value = str(value).strip()
+            if not value or value.lower() == "null":
+                continue
+            tag, score = self.match(field, value)
+            candidates = [(value, tag, score)]
+            if score < 1.0:
+                pieces = [p.strip() for p in _SPLIT.split(value) if p.strip()]
+                if len(pieces) > 1:
+                    candidates = [(p,) + self.match(field, p) for p in pieces]
+            for text, tag, score in candidates:
+                if tag is not None and score >= threshold:
+                    if tag not in tags:
+                        tags.append(tag)
+                    scores.append(score)
+                elif normalize_tag_text(text, field):
+                    unresolved.append(text)
+        return tags, (min(scores) if scores else 0.0), unresolved
+
+
+def tag_vocabularies(tag_data: dict) -> dict:
+    return {field: list(tag_data.get(key, [])) for field, key in TAG_FIELDS.items()}
+
+
+@st.cache_resource
+def _cached_tag_index(vocab_key: tuple) -> TagIndex:
+    return TagIndex({field: list(labels) for field, labels in vocab_key})
+
+
+def get_tag_index(tag_data: dict) -> TagIndex:
+    """Shared ``TagIndex`` for the given ``load_tag_data()`` result."""
+    vocab = tag_vocabularies(tag_data)
+    return _cached_tag_index(tuple((field, tuple(labels)) for field, labels in vocab.items()))